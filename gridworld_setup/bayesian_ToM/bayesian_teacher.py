@@ -1,129 +1,594 @@
-from minigrid.core.constants import DIR_TO_VEC
+from minigrid.core.constants import DIR_TO_VEC, COLOR_TO_IDX
 from minigrid.core.actions import Actions
 
 from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
 from utils import *
+from demo_library import DemoLibrary, demo_hash, common_prefix_length
+from learner_knowledge import LearnerKnowledgeTracker
+from reward_memo import RewardMemo
+from policy_table import PolicyTable
 
 import numpy as np
-from queue import SimpleQueue
+import os
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Executor
 
 import matplotlib.pyplot as plt
 
 from typing import Callable
 
 ##
-# Bayesian teacher that knows rational learner
+# Predicted rewards of (demo, goal color, rf) tasks, one random stream per task (same results in the main process or in a pool)
+##
+
+# Teacher of the worker process with its private env, rebuilt only when the layout or the teacher changes
+_WORKER_TEACHER = {}
+
+def _task_reward(teacher, demo: list, goal_color: int, rf_idx: int, rng: np.random.Generator, num_samples: int=1, **kwargs) -> float:
+    if num_samples > 1:
+        return teacher.predicted_reward_stats(demo, goal_color, rf_idx, num_samples=num_samples, rng=rng, **kwargs)[0]
+    return teacher.predicted_reward(demo, goal_color, rf_idx, rng=rng)
+
+def _predicted_rewards_shard(teacher_type: type, teacher_config: dict, layout: dict, tasks: list, reward_kwargs: dict,
+                             metrics: bool=False) -> tuple:
+    # Rewards of the tasks and metrics of the shard (snapshot of the worker with its pid, None if disabled) merged by the main process
+    # The worker starts from empty metrics (a forked worker copies the metrics of the main process)
+    if metrics:
+        METRICS.enable()
+        METRICS.reset()
+    key = (teacher_type.__name__, repr(sorted(teacher_config.items())), layout_key(layout))
+    teacher = _WORKER_TEACHER.get(key)
+    if teacher is None:
+        _WORKER_TEACHER.clear()
+        teacher = teacher_type(env=env_from_layout(layout), **teacher_config)
+        _WORKER_TEACHER[key] = teacher
+    rewards = _tasks_rewards(teacher, tasks, reward_kwargs)
+    return rewards, dict(METRICS.snapshot(reset=True), pid=os.getpid()) if metrics else None
+
+def _tasks_rewards(teacher, tasks: list, reward_kwargs: dict) -> list:
+    # Single rollouts: the tasks of each receptive field are evaluated together (demos sharing a prefix observed once)
+    # Same rewards as one predicted_reward per task (used without the trie, or for a receptive field with a single task)
+    if not teacher.prefix_trie or reward_kwargs.get('num_samples', 1) > 1:
+        return [_task_reward(teacher, *task, **reward_kwargs) for task in tasks]
+    rewards = [None] * len(tasks)
+    for rf_idx in sorted(set(task[2] for task in tasks)):
+        indices = [kk for kk, task in enumerate(tasks) if task[2] == rf_idx]
+        if len(indices) == 1:
+            rewards[indices[0]] = _task_reward(teacher, *tasks[indices[0]])
+            continue
+        # One node per distinct demo, played for each of its goal colors
+        demos, goal_colors, rngs, nodes = [], [], [], {}
+        for kk in indices:
+            demo, goal_color, _, rng = tasks[kk]
+            node = nodes.setdefault(demo_hash(demo), len(demos))
+            if node == len(demos):
+                demos.append(demo)
+                goal_colors.append([])
+                rngs.append([])
+            goal_colors[node].append(goal_color)
+            rngs[node].append(rng)
+        node_rewards = predicted_rewards_by_prefix(teacher, demos, goal_colors, rf_idx, rngs)
+        position = [0] * len(demos)
+        for kk in indices:
+            node = nodes[demo_hash(tasks[kk][0])]
+            rewards[kk] = node_rewards[node][position[node]]
+            position[node] += 1
+
+    return rewards
+
+def evaluate_predicted_rewards(teacher, tasks: list, pool: Executor | None=None, num_shards: int | None=None, rngs: list | None=None,
+                               **reward_kwargs) -> list:
+    # Tasks (demo, goal_color, rf_idx) evaluated in order by the teacher, or in contiguous shards by the pool
+    # rngs: random stream of each task (spawned from the teacher stream by default, with or without a pool)
+    # Unlike the first version, the rollouts do not draw from the teacher stream one after the other: the reward of a task
+    # only depends on its own stream, so it is the same in the main process, in a pool, in the memo and whatever the order
+    # of the tasks (the rewards are not the ones of the sequential draws, the distribution is the same)
+    # reward_kwargs: num_samples (> 1: mean reward of the multi-sample rollouts) and its options
+    # The env of the teacher keeps its goal and receptive field (grid reset if rollouts were played)
+    rngs = teacher.rng.spawn(len(tasks)) if rngs is None else rngs
+    tasks = [(demo, goal_color, rf_idx, rng) for (demo, goal_color, rf_idx), rng in zip(tasks, rngs)]
+    if teacher.reward_memo is not None and len(tasks) > 0:
+        return _memoized_predicted_rewards(teacher, tasks, pool, num_shards, reward_kwargs)
+    return _evaluate_tasks(teacher, tasks, pool, num_shards, reward_kwargs)
+
+def _memoized_predicted_rewards(teacher, tasks: list, pool: Executor | None, num_shards: int | None, reward_kwargs: dict) -> list:
+    # Only the tasks missing from the memo are simulated (same random stream --> same reward)
+    memo = teacher.reward_memo
+    layout_hash = layout_key(layout_description(teacher.env))
+    teacher_key = repr((type(teacher).__name__, sorted((k, v) for k, v in teacher.config().items() if k not in ('policy_table_size', 'belief_epsilon', 'prefix_trie'))))
+    keys = [memo.key(layout_hash, demo, goal_color, rf_idx, teacher_key, rng, reward_kwargs) for demo, goal_color, rf_idx, rng in tasks]
+    rewards = memo.get_many(keys)
+
+    missing = [kk for kk, key in enumerate(keys) if key not in rewards]
+    if len(missing) > 0:
+        new_rewards = _evaluate_tasks(teacher, [tasks[kk] for kk in missing], pool, num_shards, reward_kwargs)
+        memo.put_many([(keys[kk], reward) for kk, reward in zip(missing, new_rewards)])
+        rewards.update((keys[kk], reward) for kk, reward in zip(missing, new_rewards))
+
+    return [rewards[key] for key in keys]
+
+def _evaluate_tasks(teacher, tasks: list, pool: Executor | None, num_shards: int | None, reward_kwargs: dict) -> list:
+    if pool is None or len(tasks) == 0:
+        return _tasks_rewards(teacher, tasks, reward_kwargs)
+
+    # A few shards per core (rollout lengths vary)
+    num_shards = min(len(tasks), num_shards if num_shards is not None else 4 * (os.cpu_count() or 1))
+    shard_size = -(-len(tasks) // num_shards)
+    layout = layout_description(teacher.env)
+    futures = [pool.submit(_predicted_rewards_shard, type(teacher), teacher.config(), layout, tasks[start:start + shard_size], reward_kwargs,
+                           METRICS.enabled)
+               for start in range(0, len(tasks), shard_size)]
+    rewards = []
+    for future in futures:
+        shard_rewards, metrics = future.result()
+        if metrics is not None:
+            METRICS.merge(metrics)
+        rewards += shard_rewards
+    return rewards
+
+##
+# Demos observed along a trie of their action prefixes: a prefix shared by several demos is observed once, the learner
+# knowledge is checkpointed where the demos branch
 ##
 
-class BayesianTeacher:
+def _restore_env(env: MultiGoalsEnv | MultiRoomsGoalsEnv, path: tuple, tracker: LearnerKnowledgeTracker) -> None:
+    # Env as after the actions of the path from the reset grid
+    env.reset_grid()
+    if 3 in path or 5 in path:
+        # Objects picked up or doors toggled: replay the path
+        for a in path:
+            env.step(Actions(a))
+    elif len(path) > 0:
+        env.agent_pos, env.agent_dir, env.step_count = tracker.pos, tracker.dir, len(path)
+
+def _play_learner(teacher, goal_color: int, rf_idx: int, rng: np.random.Generator) -> float:
+    # Same as the end of predicted_reward: simulate the learner playing on the reset env with its current knowledge
+    env = teacher.env
+    env.agent_goal = goal_color + 1
+    env.reset_grid()
+    teacher.learner_step_count = 0
+    terminated = False
+    while (not terminated) and (env.step_count < env.max_steps):
+        final_reward = teacher.finish_rollout(goal_color, rf_idx, rng)
+        if final_reward is not None:
+            reward = final_reward
+            break
+        a = draw(teacher.learner_policy(goal_color, rf_idx), rng)
+        _, reward, terminated, _, _ = env.step(Actions(a))
+        teacher.update_knowledge(env.agent_pos, env.agent_dir, env.step_count, rf_idx)
+    METRICS.observe(f'{type(teacher).__name__}.rollout_length', env.step_count)
+    return reward
+
+@METRICS.timed('predicted_rewards_by_prefix')
+def predicted_rewards_by_prefix(teacher, demos: list, goal_colors: list, rf_idx: int, rngs: list) -> list:
+    # Same rewards as teacher.predicted_reward(demos[i], goal_colors[i][j], rf_idx, rng=rngs[i][j])
+    env = teacher.env
+    current_receptive_field = env.agent_view_size
+    current_env_goal = env.agent_goal
+
+    env.agent_view_size = teacher.rf_values[rf_idx]
+    env.reset_grid()
+    # Knowledge of the learner observing the demos (no subscriber: the learner model is only used when playing)
+    tracker = LearnerKnowledgeTracker(env, teacher.rf_values_basic, teacher.add_full_obs)
+    tracker.step_count = 0
+
+    # Observed actions (first unused action to get the first observation), walked in lexicographic order
+    sequences = [(4,) + tuple(demo) if len(demo) > 0 else () for demo in demos]
+    order = sorted(range(len(demos)), key=lambda idx: sequences[idx])
+    # Depth where each demo of the walk branches from the next one
+    branch = [common_prefix_length(sequences[order[p]], sequences[order[p + 1]]) for p in range(len(order) - 1)]
+
+    rewards = [[] for _ in demos]
+    # (depth, knowledge) at the branching depths of the path
+    checkpoints = [(0, tracker.copy())]
+    path = ()
+    for p, demo_idx in enumerate(order):
+        sequence = sequences[demo_idx]
+        if p > 0 and len(path) > branch[p - 1]:
+            # Back to the last branching point
+            while checkpoints[-1][0] > branch[p - 1]:
+                checkpoints.pop()
+            depth, checkpoint = checkpoints[-1]
+            tracker.copy_from(checkpoint, rf_idx)
+            path = sequence[:depth]
+            _restore_env(env, path, tracker)
+
+        # Depths where the next demos of the walk branch from this one
+        branching = set(np.minimum.accumulate(branch[p:]).tolist()) if p < len(branch) else set()
+        for depth in range(len(path), len(sequence) + 1):
+            if depth in branching and depth > checkpoints[-1][0]:
+                checkpoints.append((depth, tracker.copy()))
+            if depth < len(sequence):
+                env.step(Actions(sequence[depth]))
+                tracker.update(env.agent_pos, env.agent_dir, env.step_count, rf_idx)
+        path = sequence
+
+        # Learner playing after the demo for each goal color (learner model reset to the knowledge after the demo)
+        for goal_color, rng in zip(goal_colors[demo_idx], rngs[demo_idx]):
+            with teacher.simulated_learner(rf_idx):
+                teacher.knowledge_tracker.copy_from(tracker, rf_idx)
+                rewards[demo_idx].append(_play_learner(teacher, goal_color, rf_idx, rng))
+        _restore_env(env, path, tracker)
+        METRICS.count('predicted_rewards_by_prefix.observed_steps', len(sequence) - (branch[p - 1] if p > 0 else 0))
+
+    # Reset env
+    env.agent_view_size = current_receptive_field
+    env.agent_goal = current_env_goal
+    env.reset_grid()
+    return rewards
+
+def demo_length_sweep(teacher, demo: list, l_max: int, cost_function: Callable[[int, int], float], lengths: list | None=None) -> tuple:
+    # Predicted utility of the truncations demo[:length] (all the lengths by default) for the hypotheses of the teacher,
+    # all the truncations are observed in a single walk along the demo
+    lengths = list(range(len(demo) + 1)) if lengths is None else list(lengths)
+    hypotheses = [(goal_color, rf_idx) for goal_color in range(teacher.num_colors) for rf_idx, _ in enumerate(teacher.rf_values)
+                  if not np.isclose(teacher.beliefs[goal_color, rf_idx], 0)]
+    tasks = [(demo[:length], goal_color, rf_idx) for length in lengths for goal_color, rf_idx in hypotheses]
+    rewards = np.array(teacher.predicted_rewards(tasks)).reshape(len(lengths), len(hypotheses))
+    weights = np.array([teacher.beliefs[goal_color, rf_idx] for goal_color, rf_idx in hypotheses])
+    costs = np.array([cost_function(length, l_max) for length in lengths])
+    return np.array(lengths), (rewards - costs[:, None]) @ weights
+
+##
+# Racing between the candidate demos: rollouts in rounds of doubling size with common random numbers, demos whose utility
+# is confidently below the one of the leader are eliminated
+##
+
+def race_demos(teacher, demos: list, hypotheses: list, costs: np.ndarray, pool: Executor | None=None,
+               initial_samples: int=4, max_samples: int=32, confidence: float=2.) -> tuple:
+    # Utility sample of a demo: sum over the hypotheses of belief * (reward of one rollout - cost)
+    # The k-th sample of every demo uses the same random stream for each hypothesis, so the demos are compared on the
+    # paired differences: a demo is eliminated when the upper bound (mean + confidence * standard error) of its
+    # difference with the leader is negative
+    # Returns the selected demo index, the mean utility of each demo (when eliminated or at the end) and the number of rollouts
+    weights = np.array([teacher.beliefs[goal_color, rf_idx] for goal_color, rf_idx in hypotheses])
+    costs = np.asarray(costs, dtype=float)
+
+    alive = np.arange(len(demos))
+    samples = np.zeros((len(demos), 0))
+    predicted_utility = np.zeros(len(demos))
+    num_rollouts = 0
+    batch = initial_samples
+    while samples.shape[1] < max_samples:
+        num_new = min(batch, max_samples - samples.shape[1])
+        # Common random numbers: one seed per (sample, hypothesis) shared by all the demos
+        seeds = teacher.rng.integers(np.iinfo(np.int64).max, size=(num_new, len(hypotheses)))
+        tasks = [(demos[demo_idx], goal_color, rf_idx) for demo_idx in alive for _ in range(num_new) for goal_color, rf_idx in hypotheses]
+        rngs = [np.random.default_rng(seed) for _ in alive for seed in seeds.reshape(-1)]
+        rewards = np.array(evaluate_predicted_rewards(teacher, tasks, pool, rngs=rngs)).reshape(len(alive), num_new, len(hypotheses))
+        num_rollouts += len(tasks)
+
+        new_samples = np.full((len(demos), num_new), np.nan)
+        new_samples[alive] = (rewards - costs[alive, None, None]) @ weights
+        samples = np.concatenate((samples, new_samples), axis=1)
+        means = samples[alive].mean(axis=1)
+        predicted_utility[alive] = means
+        if len(alive) == 1:
+            break
+
+        if samples.shape[1] > 1:
+            # Paired differences with the leader
+            diff = samples[alive] - samples[alive[np.argmax(means)]]
+            upper = diff.mean(axis=1) + confidence * diff.std(axis=1, ddof=1) / np.sqrt(diff.shape[1])
+            alive = alive[(upper >= 0) | np.isclose(upper, 0)]
+            if len(alive) == 1:
+                break
+        batch = samples.shape[1]
+
+    METRICS.count('race_demos.rollouts', num_rollouts)
+    METRICS.observe('race_demos.demos_left', len(alive))
+
+    argmax_set = alive[np.isclose(predicted_utility[alive], np.max(predicted_utility[alive]))]
+    demo_idx = teacher.rng.choice(argmax_set)
+    return demo_idx, predicted_utility, num_rollouts
+
+##
+# Shared by the Bayesian teachers: model of the observed learner, simulated learners of the rollouts and demo selection
+##
+
+class BaseBayesianTeacher:
+
+    # Teacher attributes holding the state of the learner model (set by the subclasses)
+    ROLLOUT_STATE = ()
 
     def __init__(self,
                  env: MultiGoalsEnv | MultiRoomsGoalsEnv,
-                 num_colors: int=4,
-                 rf_values: np.ndarray=np.array([3,5,7]),
-                 Na: int=6,
-                 lambd: float=0.5,
-                 add_full_obs: bool=True
+                 num_colors: int,
+                 rf_values: np.ndarray,
+                 Na: int,
+                 add_full_obs: bool,
+                 rng: np.random.Generator | None,
+                 knowledge_tracker: LearnerKnowledgeTracker | None,
+                 reward_memo: RewardMemo | None,
+                 policy_table_size: int,
+                 prefix_trie: bool
                  ) -> None:
-        
+
         self.Na = Na
+        # Learner policies already computed for the same state (no table if the size is 0, the default): the key only holds
+        # the knowledge, the pose and the flags/plan of the hypothesis, the rest of the learner model must follow from them
+        self.policy_table_size = policy_table_size
+        self.policy_table = PolicyTable(policy_table_size, f'{type(self).__name__}.policy_table') if policy_table_size > 0 else None
+        # Predicted rewards already computed (on disk, shared by the processes and the runs)
+        self.reward_memo = reward_memo
+        # Single rollouts of several demos evaluated along the trie of their prefixes (False: one predicted_reward per task)
+        self.prefix_trie = prefix_trie
+        # Random stream of the teacher (simulated learner actions, tie-breaking between demos)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Number of rollouts of the last demo selection
+        self.selection_rollouts = 0
         self.rf_values_basic = rf_values
         self.add_full_obs = add_full_obs
 
-        # Boltzmann temperature parameter (confidence in greedy)
-        self.lambd = lambd
-
         self.num_colors = num_colors
         self.num_rf = len(rf_values) + 1 if self.add_full_obs else len(rf_values)
-        
+
         # Init beliefs on the type of learner
         self.beliefs = 1. / (num_colors * self.num_rf) * np.ones((num_colors, self.num_rf))
+        # Hypotheses still alive (the dead ones are no longer predicted, simulated nor tracked)
+        self.active_hypotheses = np.ones((num_colors, self.num_rf), dtype=bool)
         # Init env and learner beliefs about the env
-        self.init_env(env)
+        self.knowledge_tracker = None
+        self.init_env(env, knowledge_tracker)
 
         self.LOG = []
 
-    def init_env(self, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> None:
+    def init_env(self, env: MultiGoalsEnv | MultiRoomsGoalsEnv, knowledge_tracker: LearnerKnowledgeTracker | None = None) -> None:
+        if self.policy_table is not None and getattr(self, 'env', None) is not env:
+            self.policy_table.clear()
         self.env = env
         self.gridsize = self.env.height
-        if self.add_full_obs:
-            self.rf_values  = np.concatenate((self.rf_values_basic, np.array([self.gridsize])))
+
+        # What the learner knows about the env: shared with the other teachers observing the same learner, or private
+        if self.knowledge_tracker is not None:
+            self.knowledge_tracker.unsubscribe(self)
+        if knowledge_tracker is None:
+            knowledge_tracker = LearnerKnowledgeTracker(env, self.rf_values_basic, self.add_full_obs)
+        assert(knowledge_tracker.env is env and knowledge_tracker.num_rf == self.num_rf)
+        self.knowledge_tracker = knowledge_tracker
+        self.knowledge_tracker.subscribe(self)
+        self.rf_values = self.knowledge_tracker.rf_values
+
+        self.init_learner_model()
+        # Model of the simulated learners (private tracker and buffers allocated at the first rollout in the env)
+        self.rollout_state = None
+
+    def save_rollout_state(self) -> dict:
+        return {name: getattr(self, name) for name in self.ROLLOUT_STATE}
+
+    def load_rollout_state(self, state: dict) -> None:
+        for name in self.ROLLOUT_STATE:
+            setattr(self, name, state[name])
+
+    @contextmanager
+    def simulated_learner(self, rf_idx: int | None = None):
+        # Within the block the learner model is the one of the simulated learners: a private tracker (not shared with the
+        # other teachers) and buffers allocated once per env, cleared in place (all the hypotheses or only the ones of rf_idx)
+        # The model of the observed learner is left untouched and is back after the block (subscribed to its tracker again)
+        observed = self.save_rollout_state()
+        self.knowledge_tracker.unsubscribe(self)
+        if self.rollout_state is not None:
+            self.load_rollout_state(self.rollout_state)
+            self.knowledge_tracker.reset(rf_idx)
+            self.clear_learner_model(rf_idx)
         else:
-            self.rf_values = self.rf_values_basic
+            self.knowledge_tracker = LearnerKnowledgeTracker(self.env, self.rf_values_basic, self.add_full_obs)
+            self.init_learner_model()
+        self.knowledge_tracker.subscribe(self)
+        try:
+            yield
+        finally:
+            self.knowledge_tracker.unsubscribe(self)
+            self.rollout_state = self.save_rollout_state()
+            self.load_rollout_state(observed)
+            self.knowledge_tracker.subscribe(self)
+
+    # Learner state and knowledge read from the tracker
+    @property
+    def learner_knowledge(self) -> np.ndarray:
+        return self.knowledge_tracker.knowledge
+
+    @property
+    def learner_pos(self) -> tuple:
+        return self.knowledge_tracker.pos
+
+    @property
+    def learner_dir(self) -> int:
+        return self.knowledge_tracker.dir
+
+    @property
+    def learner_step_count(self) -> int:
+        return self.knowledge_tracker.step_count
+
+    @learner_step_count.setter
+    def learner_step_count(self, step_count: int) -> None:
+        self.knowledge_tracker.step_count = step_count
+
+    def active_rfs(self) -> np.ndarray:
+        # Receptive fields with at least one goal color hypothesis alive
+        return self.active_hypotheses.any(axis=0)
+
+    def observe_demo(self, demo: list, goal_color: int, rf_idx: int) -> None:
+        # Simulated learner of the hypothesis observing the demo on the reset env (knowledge of rf_idx only)
+        self.env.agent_view_size = self.rf_values[rf_idx]
+        self.env.agent_goal = goal_color + 1
+        self.env.reset_grid()
+        self.learner_step_count = 0
 
-        self.learner_beliefs = 1. / (2 + 2 * self.num_colors) * np.ones((self.num_rf, self.gridsize, self.gridsize, 2 + 2 * self.num_colors))
+        if len(demo) > 0:
+            # Add first unused action to get the first observation
+            demo = [4] + demo
 
-        self.learner_going_to_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
-        self.learner_going_to_goal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
-        self.learner_reached_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
-        self.learner_step_count = -1
+        for a in demo:
+            action = Actions(a)
+            _, _, _, _, _ = self.env.step(action)
+            self.update_knowledge(self.env.agent_pos, self.env.agent_dir, self.env.step_count, rf_idx)
 
-        self.distance_subgoal = np.zeros((self.num_rf, self.num_colors, self.gridsize, self.gridsize))
-        self.distance_goal = np.zeros((self.num_rf, self.num_colors, self.gridsize, self.gridsize))
+    def predicted_reward(self, demo: list, goal_color: int, rf_idx: int, rng: np.random.Generator | None = None) -> float:
+        # Random stream of the simulated learner (teacher stream by default)
+        rng = self.rng if rng is None else rng
 
-    def update_learner_belief(self, rf_idx: int) -> None:
+        current_receptive_field = self.env.agent_view_size
+        current_env_goal = self.env.agent_goal
+
+        with METRICS.timer(f'{type(self).__name__}.predicted_reward'), self.simulated_learner(rf_idx):
+            # Simulate the learner observing the demo
+            self.observe_demo(demo, goal_color, rf_idx)
+            # Simulate the learner playing on the env AFTER seen the demo
+            reward = _play_learner(self, goal_color, rf_idx, rng)
+
+        # Reset env
+        self.env.agent_view_size = current_receptive_field
+        self.env.agent_goal = current_env_goal
+        self.env.reset_grid()
+
+        # Return the predicted reward
+        return reward
+
+    def predicted_rewards(self, tasks: list, pool: Executor | None = None, num_samples: int=1, se_threshold: float | None = None) -> list:
+        # Predicted reward of each (demo, goal_color, rf_idx) task (in worker processes if a pool is given)
+        # Mean reward of up to num_samples rollouts if num_samples > 1
+        # Each task draws from its own stream spawned from the teacher stream (see evaluate_predicted_rewards)
+        return evaluate_predicted_rewards(self, tasks, pool, num_samples=num_samples, se_threshold=se_threshold)
+
+    def select_demo(self, l_max: int, cost_function: Callable[[int, int], float], all_demos: list | None = None,
+                    layout: LayoutAnalysis | None = None, demo_library: DemoLibrary | None = None, pool: Executor | None = None,
+                    num_samples: int=1, se_threshold: float | None = None, racing: bool = False) -> list:
+        # num_samples > 1: predicted rewards averaged over rollouts (see predicted_reward_stats)
+        # racing: demos raced with up to num_samples rollouts per hypothesis (see race_demos), at least 2 samples to eliminate a demo
+        with METRICS.timer(f'{type(self).__name__}.select_demo'):
+            goal_color_belief = np.sum(self.beliefs, axis=1)
+
+            if np.isclose(np.max(goal_color_belief), 1):
+                pred_goal_color = np.argmax(goal_color_belief)
+                # Learner-specific demos planned on one analysis of the layout of the env
+                if demo_library is None:
+                    demo_library = DemoLibrary(self.env, self.num_colors, layout=layout, rng=self.rng)
+                demos = [demo_library.demo(rf, pred_goal_color) for rf in self.rf_values]
+
+            else:
+                demos = all_demos
         
-        receptive_field = self.rf_values[rf_idx]
-        obs, vis_mask = compute_learner_obs(self.learner_pos, self.learner_dir, receptive_field, self.env)
-
-        f_vec = DIR_TO_VEC[self.learner_dir]
-        dir_vec = DIR_TO_VEC[self.learner_dir]
-        dx, dy = dir_vec
-        r_vec =  np.array((-dy, dx))
-        top_left = (
-            self.learner_pos
-            + f_vec * (receptive_field - 1)
-            - r_vec * (receptive_field // 2)
-        )
-        new_cells = 0
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, receptive_field):
-            for vis_i in range(0, receptive_field):
-
-                if not vis_mask[vis_i, vis_j]:
-                    continue
-
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-                if abs_i < 0 or abs_i >= self.gridsize:
-                    continue
-                if abs_j < 0 or abs_j >= self.gridsize:
-                    continue
-
-                one_hot = np.zeros(2 + 2 * self.num_colors)
-                color_idx = obs[vis_i, vis_j, 1]
-
-                if self.learner_pos == (abs_i, abs_j):
-                    one_hot[0] = 1
-                # Goal
-                elif obs[vis_i, vis_j, 0] == 4:
-                    one_hot[2 + (color_idx - 1) * 2] = 1
-                # Subgoal (key)
-                elif obs[vis_i, vis_j, 0] == 5:
-                    one_hot[2 + (color_idx - 1) * 2 + 1] = 1
-                # Wall
-                elif obs[vis_i, vis_j, 0] == 2:
-                    one_hot[1] = 1
-                # Nothing
-                else:
-                    one_hot[0] = 1
-                
-                if np.any(self.learner_beliefs[rf_idx, abs_i, abs_j, :] != one_hot):
-                    new_cells +=1
+            # Alive hypotheses with a non-negligible weight
+            hypotheses = [(pred_goal_color, pred_rf_idx) for pred_goal_color, pred_rf_idx in np.argwhere(self.active_hypotheses).tolist()
+                          if not np.isclose(self.beliefs[pred_goal_color, pred_rf_idx], 0)]
+
+            if racing:
+                if num_samples < 2:
+                    raise ValueError('Racing needs num_samples >= 2 (the demos are compared on the spread of their samples)')
+                costs = [cost_function(len(demo), l_max) for demo in demos]
+                demo_idx, predicted_utility, self.selection_rollouts = race_demos(self, demos, hypotheses, costs, pool, max_samples=num_samples)
+                return demos[demo_idx], demo_idx, predicted_utility[demo_idx], demos
+
+            tasks = [(demo, pred_goal_color, pred_rf_idx) for demo in demos for pred_goal_color, pred_rf_idx in hypotheses]
+            self.selection_rollouts = len(tasks) * num_samples
+            predicted_rewards = iter(self.predicted_rewards(tasks, pool, num_samples=num_samples, se_threshold=se_threshold))
+
+            predicted_utility = []
+            for demo_idx, demo in enumerate(demos):
+                pred_u = 0
+                for pred_goal_color, pred_rf_idx in hypotheses:
+                    weight = self.beliefs[pred_goal_color, pred_rf_idx]
+                    hat_r = next(predicted_rewards)
+                    cost = cost_function(len(demo), l_max)
+                    pred_u += (hat_r - cost) * weight
+                predicted_utility.append(pred_u)
+
+            argmax_set = np.where(np.isclose(predicted_utility, np.max(predicted_utility)))[0]
+            demo_idx = self.rng.choice(argmax_set)
+
+            predicted_best_utility = np.max(predicted_utility)
+
+            return demos[demo_idx], demo_idx, predicted_best_utility, demos
+
+##
+# Bayesian teacher that knows rational learner
+##
+
+class BayesianTeacher(BaseBayesianTeacher):
+
+    # Teacher attributes holding the state of the simulated learner (swapped between the samples of a lockstep rollout)
+    ROLLOUT_STATE = ('knowledge_tracker', 'learner_going_to_subgoal', 'learner_going_to_goal', 'learner_reached_subgoal',
+                     'distance_subgoal', 'distance_goal', 'learner_distance_fields')
+
+    def __init__(self,
+                 env: MultiGoalsEnv | MultiRoomsGoalsEnv,
+                 num_colors: int=4,
+                 rf_values: np.ndarray=np.array([3,5,7]),
+                 Na: int=6,
+                 lambd: float=0.5,
+                 add_full_obs: bool=True,
+                 rng: np.random.Generator | None = None,
+                 knowledge_tracker: LearnerKnowledgeTracker | None = None,
+                 reward_memo: RewardMemo | None = None,
+                 policy_table_size: int=0,
+                 belief_epsilon: float=0.,
+                 prefix_trie: bool=True
+                 ) -> None:
+
+        # Boltzmann temperature parameter (confidence in greedy)
+        self.lambd = lambd
+        # Hypotheses with a belief below epsilon are pruned (belief set to 0, 0 by default: exact posterior, see prune_hypotheses)
+        self.belief_epsilon = belief_epsilon
+        super().__init__(env, num_colors, rf_values, Na, add_full_obs, rng, knowledge_tracker, reward_memo, policy_table_size, prefix_trie)
 
-                self.learner_beliefs[rf_idx, abs_i, abs_j, :] = one_hot
+    def init_learner_model(self) -> None:
+        self.learner_going_to_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
+        self.learner_going_to_goal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
+        self.learner_reached_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
 
-        if new_cells > 0:
+        # Number of actions from each (dir, x, y) state of the learner to the subgoal/goal
+        self.distance_subgoal = np.zeros((self.num_rf, self.num_colors, 4, self.gridsize, self.gridsize), dtype=np.int16)
+        self.distance_goal = np.zeros((self.num_rf, self.num_colors, 4, self.gridsize, self.gridsize), dtype=np.int16)
+        # (obj, rf_idx, goal_color) --> distance field repaired in place in distance_subgoal/distance_goal when cells are revealed
+        self.learner_distance_fields = {}
+
+    def clear_learner_model(self, rf_idx: int | None = None) -> None:
+        # Same learner model as init_learner_model, cleared in place (all the hypotheses or only the ones of rf_idx)
+        rows = slice(None) if rf_idx is None else rf_idx
+        self.learner_going_to_subgoal[:, rows] = False
+        self.learner_going_to_goal[:, rows] = False
+        self.learner_reached_subgoal[:, rows] = False
+        self.distance_subgoal[rows] = 0
+        self.distance_goal[rows] = 0
+        for key in [key for key in self.learner_distance_fields if rf_idx is None or key[1] == rf_idx]:
+            del self.learner_distance_fields[key]
+
+    def prune_hypotheses(self) -> None:
+        # Hypotheses with a belief below epsilon are dead (at least the most likely one is kept)
+        # With epsilon > 0 this is an approximation: the beliefs become the posterior conditioned on the alive hypotheses
+        # (renormalized over them) and a dead hypothesis never comes back, its knowledge and distance maps are no longer
+        # updated. With epsilon = 0 only the hypotheses with a zero belief die (exact posterior)
+        alive = self.active_hypotheses & (self.beliefs > self.belief_epsilon)
+        if not alive.any():
+            alive = self.beliefs == self.beliefs.max()
+        dead = self.active_hypotheses & ~alive
+        if dead.any():
+            METRICS.count('BayesianTeacher.pruned_hypotheses', int(dead.sum()))
+            self.active_hypotheses = alive
+            self.beliefs[dead] = 0
+            self.beliefs /= self.beliefs.sum()
+            # No distance map repaired for them anymore
+            self.learner_going_to_subgoal[dead] = False
+            self.learner_going_to_goal[dead] = False
+
+    @METRICS.timed('BayesianTeacher.on_knowledge_update')
+    def on_knowledge_update(self, new_cells: np.ndarray) -> None:
+        # Number of cells newly revealed to the learner for each receptive field (notified by the tracker)
+        for rf_idx in np.nonzero(new_cells)[0]:
+            # Additional info --> update the distance maps of all the goal colors at once
+            to_subgoal = self.learner_going_to_subgoal[:, rf_idx] & ~self.learner_reached_subgoal[:, rf_idx]
+            to_goal = ~to_subgoal & self.learner_going_to_goal[:, rf_idx]
+            # No hypothesis of the rf follows a distance map: no obstacle grid and no update (the fields are synced later)
+            if not (to_subgoal.any() or to_goal.any()):
+                continue
             for goal_color in range(self.num_colors):
-                # Additional info --> update distance map
-                if self.learner_going_to_subgoal[goal_color, rf_idx] and not self.learner_reached_subgoal[goal_color, rf_idx]:
+                if to_subgoal[goal_color]:
                     self.LOG.append('Recompute distances to subgoal')
-                    self.update_distance_subgoal(goal_color, rf_idx)
-
-                elif self.learner_going_to_goal[goal_color, rf_idx]:
+                elif to_goal[goal_color]:
                     self.LOG.append('Recompute distances to goal')
-                    self.update_distance_goal(goal_color, rf_idx)
+            self.update_distances(rf_idx, np.nonzero(to_subgoal)[0], np.nonzero(to_goal)[0])
     
     def learner_exploration_policy(self, goal_color: int, rf_idx: int) -> np.ndarray:
         prob_dist = np.zeros(self.Na)
@@ -131,12 +596,7 @@ class BayesianTeacher:
         prob_dist[1] = 1
 
         next_pos = self.learner_pos + DIR_TO_VEC[self.learner_dir]
-        one_hot_empty = np.zeros(2 + self.num_colors * 2)
-        one_hot_empty[0] = 1
-        one_hot_subgoal = np.zeros(2 + self.num_colors * 2)
-        one_hot_subgoal[2 + 2 * goal_color + 1] = 1
-        if (np.all(self.learner_beliefs[rf_idx, next_pos[0], next_pos[1], :] == one_hot_empty) or \
-            np.all(self.learner_beliefs[rf_idx, next_pos[0], next_pos[1], :] == one_hot_subgoal)): # No obstacle in front
+        if self.learner_knowledge[rf_idx, next_pos[0], next_pos[1]] in (EMPTY, 2 + 2 * goal_color + 1): # No obstacle in front
             prob_dist[2] = 1
 
         prob_dist /= prob_dist.sum()
@@ -151,29 +611,12 @@ class BayesianTeacher:
             raise ValueError('Unknown object for distance map')
 
         proba_dist = np.zeros(self.Na)
-        const = distance_map[rf_idx, goal_color, self.learner_pos[0], self.learner_pos[1]]
-        for action in range(3):
-            # Boltzman wrt distance to the goal
-            if action in [0, 1]: # Turn left or right
-                if action == 0:
-                    next_dir = (self.learner_dir - 1) % 4
-                    next_next_dir = (self.learner_dir - 2) % 4
-                elif action == 1:
-                    next_dir = (self.learner_dir + 1) % 4
-                    next_next_dir = (self.learner_dir + 2) % 4            
-            
-                next_pos = self.learner_pos + DIR_TO_VEC[next_dir] # Turn 
-                next_next_pos = self.learner_pos + DIR_TO_VEC[next_next_dir] # U-turn
-                
-                # Turn OR U-turn
-                proba_dist[action] = 0.5 * (np.exp( - (distance_map[rf_idx, goal_color, next_pos[0], next_pos[1]] - const) / self.lambd) \
-                                            + np.exp( - (distance_map[rf_idx, goal_color, next_next_pos[0], next_next_pos[1]] - const) / self.lambd))
-
-            else:
-                # Forward
-                next_dir = self.learner_dir
-                next_pos = self.learner_pos + DIR_TO_VEC[next_dir]
-                proba_dist[action] = np.exp( - (distance_map[rf_idx, goal_color, next_pos[0], next_pos[1]] - const) / self.lambd)
+        field = distance_map[rf_idx, goal_color]
+        const = float(field[self.learner_dir, self.learner_pos[0], self.learner_pos[1]])
+        # Boltzman wrt number of actions to the goal from the states reached by turn left, turn right and forward
+        next_dist = pose_successor_distances(field, self.learner_pos, self.learner_dir).astype(float)
+        next_dist[next_dist == UNREACHABLE] = np.inf
+        proba_dist[:3] = np.exp( - (next_dist - const) / self.lambd)
         # Normalize
         proba_dist /= proba_dist.sum()
         
@@ -181,6 +624,82 @@ class BayesianTeacher:
             
         return proba_dist
 
+    def learner_greedy_policies(self, distance_map: np.ndarray) -> np.ndarray:
+        # Same as learner_greedy_policy for all the (goal color, rf) hypotheses at once: (num_colors, num_rf, 3)
+        x, y, dir = self.learner_pos[0], self.learner_pos[1], self.learner_dir
+        fields = distance_map.transpose(1, 0, 2, 3, 4)
+        const = fields[:, :, dir, x, y].astype(float)
+        # Boltzman wrt number of actions to the goal from the states reached by turn left, turn right and forward
+        next_dist = np.full(const.shape + (3,), float(UNREACHABLE))
+        next_dist[..., 0] = fields[:, :, (dir - 1) % 4, x, y]
+        next_dist[..., 1] = fields[:, :, (dir + 1) % 4, x, y]
+        next_x, next_y = x + DIR_VEC[dir][0], y + DIR_VEC[dir][1]
+        if 0 <= next_x < self.gridsize and 0 <= next_y < self.gridsize:
+            next_dist[..., 2] = fields[:, :, dir, next_x, next_y]
+        next_dist[next_dist == UNREACHABLE] = np.inf
+        proba_dist = np.exp( - (next_dist - const[..., None]) / self.lambd)
+        # Normalize
+        return proba_dist / proba_dist.sum(axis=2, keepdims=True)
+
+    def learner_policies(self) -> np.ndarray:
+        # Predicted policy of the learner for all the alive (goal color, rf) hypotheses: (num_colors, num_rf, Na), 0 for the dead ones
+        # Only the hypotheses starting to go to a subgoal/goal (path planning) are handled one by one with learner_policy
+        policies = np.zeros((self.num_colors, self.num_rf, self.Na))
+        active = self.active_hypotheses
+
+        if self.learner_step_count == 0:
+            policies[:, :, 4] = 1 # unused (to get first observation)
+            return policies
+
+        colors = np.arange(self.num_colors)[:, None]
+        next_pos = self.learner_pos + DIR_TO_VEC[self.learner_dir]
+        front = self.learner_knowledge[:, next_pos[0], next_pos[1]][None, :]
+
+        # Subgoal (key) in front of the learner
+        key_in_front = (front == 2 + colors * 2 + 1) & active
+        if key_in_front.any():
+            self.LOG.append('key in front')
+        self.learner_reached_subgoal |= key_in_front
+        self.learner_going_to_subgoal &= ~key_in_front
+        policies[key_in_front, 3] = 1 # Pickup the subgoal (key)
+
+        # Goal (door) in front of the learner
+        door_in_front = ~key_in_front & (front == 2 + colors * 2) & self.learner_reached_subgoal & active
+        if door_in_front.any():
+            self.LOG.append('door in front')
+        self.learner_going_to_goal &= ~door_in_front
+        policies[door_in_front, 5] = 1 # Open the goal (door)
+
+        # Start going to the subgoal (key) or to the goal (door) --> path planning, one hypothesis at a time
+        known = known_labels(self.learner_knowledge, 2 + 2 * self.num_colors)
+        known_goal, known_subgoal = known[:, 2::2].T, known[:, 3::2].T
+        to_subgoal = known_subgoal & ~self.learner_reached_subgoal & ~self.learner_going_to_subgoal
+        to_goal = ~to_subgoal & known_goal & self.learner_reached_subgoal & ~self.learner_going_to_goal
+        planning = ~key_in_front & ~door_in_front & (to_subgoal | to_goal) & active
+        for goal_color, rf_idx in zip(*np.nonzero(planning)):
+            policies[goal_color, rf_idx] = self.learner_policy(goal_color, rf_idx)
+        others = ~key_in_front & ~door_in_front & ~planning & active
+
+        # Going to the subgoal --> greedy wrt to distance to the subgoal
+        greedy_subgoal = others & self.learner_going_to_subgoal
+        if greedy_subgoal.any():
+            policies[greedy_subgoal, :3] = self.learner_greedy_policies(self.distance_subgoal)[greedy_subgoal]
+        # Going to the goal --> greedy wrt to distance to the goal
+        greedy_goal = others & ~self.learner_going_to_subgoal & self.learner_going_to_goal
+        if greedy_goal.any():
+            policies[greedy_goal, :3] = self.learner_greedy_policies(self.distance_goal)[greedy_goal]
+        assert(not np.isnan(policies[greedy_subgoal | greedy_goal, 0]).any())
+
+        # Nothing to do --> Action that maximizes the exploration
+        exploration = others & ~self.learner_going_to_subgoal & ~self.learner_going_to_goal
+        no_obstacle = (front == EMPTY) | (front == 2 + colors * 2 + 1)
+        policies[exploration, 0] = 1
+        policies[exploration, 1] = 1
+        policies[exploration, 2] = no_obstacle[exploration]
+        policies[exploration] /= policies[exploration].sum(axis=1, keepdims=True)
+
+        return policies
+
     def obj_in_front(self, rf_idx: int, obj_idx: int) -> bool:
 
         dx, dy = 0, 0
@@ -193,28 +712,64 @@ class BayesianTeacher:
         elif self.learner_dir == 1:
             dy = 1
 
-        return self.learner_beliefs[rf_idx, self.learner_pos[0] + dx, self.learner_pos[1] + dy, obj_idx] == 1
+        return self.learner_knowledge[rf_idx, self.learner_pos[0] + dx, self.learner_pos[1] + dy] == obj_idx
     
     def compute_obstacle_grid(self, rf_idx: int) -> np.ndarray:
-        one_hot = np.zeros(2 + self.num_colors * 2)
-        one_hot[0] = 1
-        return np.ones((self.gridsize, self.gridsize)) - np.all(self.learner_beliefs[rf_idx, ...] == one_hot.reshape(1, 1, -1), axis=2)
+        return self.knowledge_tracker.obstacle_grid(rf_idx)
     
-    def update_distance_goal(self, goal_color: int, rf_idx: int) -> None:
-        goal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2] == 1)
+    def update_distances(self, rf_idx: int, subgoal_colors: np.ndarray, goal_colors: np.ndarray) -> None:
+        # Distances to the subgoals (keys) and goals (doors) of the given colors on the obstacle grid of the rf
+        # Existing fields are repaired around the changed cells, the new ones are computed in one batch
         grid = self.compute_obstacle_grid(rf_idx)
-        grid[goal_pos[0], goal_pos[1]] = 0
-        # Update distance to the goal
-        self.distance_goal[rf_idx, goal_color, :] = Dijkstra(grid, goal_pos[0], goal_pos[1])
+        new_fields = []
+        for obj, colors, distance in (('subgoal', subgoal_colors, self.distance_subgoal), ('goal', goal_colors, self.distance_goal)):
+            for goal_color in colors:
+                label = 2 + goal_color * 2 + 1 if obj == 'subgoal' else 2 + goal_color * 2
+                target = tuple(np.argwhere(self.learner_knowledge[rf_idx] == label)[0].tolist())
+                key = (obj, rf_idx, goal_color)
+                field = self.learner_distance_fields.get(key)
+                if field is not None and field.goal == target:
+                    field.sync(grid)
+                else:
+                    new_fields.append((key, target, distance[rf_idx, goal_color]))
 
-    def update_distance_subgoal(self, goal_color: int, rf_idx: int) -> None:
-        subgoal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2 + 1] == 1)
-        grid = self.compute_obstacle_grid(rf_idx)
-        grid[subgoal_pos[0], subgoal_pos[1]] = 0
-        # Update distance to the subgoal
-        self.distance_subgoal[rf_idx, goal_color, :] = Dijkstra(grid, subgoal_pos[0], subgoal_pos[1])
+        if len(new_fields) > 0:
+            fields = cached_target_pose_distance_fields(grid, [target for _, target, _ in new_fields])
+            for (key, target, distance), field in zip(new_fields, fields):
+                self.learner_distance_fields[key] = DynamicPoseDistanceField(grid, target, distance=distance, field=field)
     
     def learner_policy(self, goal_color: int, rf_idx: int) -> np.ndarray:
+        # The policy is a function of the knowledge of the rf, the pose and the flags of the hypothesis: same state in
+        # the table --> same policy and same flags after (the distance maps of a new target come from the field cache)
+        if self.policy_table is None:
+            return self.compute_learner_policy(goal_color, rf_idx)
+        flags = (self.learner_reached_subgoal[goal_color, rf_idx], self.learner_going_to_subgoal[goal_color, rf_idx],
+                 self.learner_going_to_goal[goal_color, rf_idx])
+        key = (goal_color, self.knowledge_tracker.knowledge_hash(rf_idx), tuple(self.learner_pos) if self.learner_pos is not None else None,
+               self.learner_dir, self.learner_step_count == 0, flags)
+        entry = self.policy_table.get(key)
+        if entry is None:
+            log_start = len(self.LOG)
+            proba_dist = self.compute_learner_policy(goal_color, rf_idx)
+            self.policy_table.put(key, (proba_dist.copy(), (self.learner_reached_subgoal[goal_color, rf_idx],
+                                                            self.learner_going_to_subgoal[goal_color, rf_idx],
+                                                            self.learner_going_to_goal[goal_color, rf_idx]),
+                                        tuple(self.LOG[log_start:])))
+            return proba_dist
+
+        proba_dist, (reached_subgoal, going_to_subgoal, going_to_goal), log = entry
+        self.LOG.extend(log)
+        self.learner_reached_subgoal[goal_color, rf_idx] = reached_subgoal
+        self.learner_going_to_subgoal[goal_color, rf_idx] = going_to_subgoal
+        self.learner_going_to_goal[goal_color, rf_idx] = going_to_goal
+        # Started going to the subgoal/goal: distance map of the target
+        if going_to_subgoal and not flags[1]:
+            self.update_distances(rf_idx, np.array([goal_color]), np.array([], dtype=int))
+        if going_to_goal and not flags[2]:
+            self.update_distances(rf_idx, np.array([], dtype=int), np.array([goal_color]))
+        return proba_dist.copy()
+
+    def compute_learner_policy(self, goal_color: int, rf_idx: int) -> np.ndarray:
             
         if self.learner_step_count == 0:
             proba_dist = np.zeros(self.Na)
@@ -241,11 +796,11 @@ class BayesianTeacher:
             return proba_dist
 
         # If know where is the subgoal (key) & not already have subgoal (key) & not already going to the subgoal (key) --> go to the subgoal (key)
-        if (self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2 + 1] == 1).any() and \
+        if (self.learner_knowledge[rf_idx] == 2 + goal_color * 2 + 1).any() and \
             not self.learner_reached_subgoal[goal_color, rf_idx] and \
             not self.learner_going_to_subgoal[goal_color, rf_idx]:
             
-            subgoal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2 + 1] == 1)
+            subgoal_pos = np.where(self.learner_knowledge[rf_idx] == 2 + goal_color * 2 + 1)
             # Obstacle grid
             grid = self.compute_obstacle_grid(rf_idx)
             grid[subgoal_pos[0], subgoal_pos[1]] = 0
@@ -254,21 +809,19 @@ class BayesianTeacher:
 
             if path is not None: # First time computing the distance map
                 # Compute distance to the subgoal
-                self.distance_subgoal[rf_idx, goal_color, :] = Dijkstra(grid, subgoal_pos[0], subgoal_pos[1])
+                self.update_distances(rf_idx, np.array([goal_color]), np.array([], dtype=int))
                 # Set variable
                 self.learner_going_to_subgoal[goal_color, rf_idx] = True
                 # Return policy
                 return self.learner_policy(goal_color, rf_idx)
 
         # If know where is the goal (door) & has subgoal (key) & not already going to the goal (door) --> go to the goal (door)
-        elif (self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2] == 1).any() and \
+        elif (self.learner_knowledge[rf_idx] == 2 + goal_color * 2).any() and \
               self.learner_reached_subgoal[goal_color, rf_idx] and \
               not self.learner_going_to_goal[goal_color, rf_idx]:
 
-            goal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2] == 1)
+            goal_pos = np.where(self.learner_knowledge[rf_idx] == 2 + goal_color * 2)
             # Obstacle grid
-            one_hot = np.zeros(2 + self.num_colors * 2)
-            one_hot[0] = 1
             grid = self.compute_obstacle_grid(rf_idx)
             grid[goal_pos[0], goal_pos[1]] = 0
 
@@ -276,7 +829,7 @@ class BayesianTeacher:
 
             if path is not None: # First time computing the distance map
                 # Compute distance to the subgoal
-                self.distance_goal[rf_idx, goal_color, :] = Dijkstra(grid, goal_pos[0], goal_pos[1])
+                self.update_distances(rf_idx, np.array([], dtype=int), np.array([goal_color]))
                 # Set variable
                 self.learner_going_to_goal[goal_color, rf_idx] = True
                 # Return action
@@ -293,151 +846,182 @@ class BayesianTeacher:
         # Nothing to do --> Action that maximizes the exploration
         return self.learner_exploration_policy(goal_color, rf_idx)
         
+    @METRICS.timed('BayesianTeacher.update_knowledge')
     def update_knowledge(self, learner_pos: tuple, learner_dir: int, learner_step_count: int, rf_idx: int | None = None) -> None:
-        self.learner_pos = learner_pos
-        self.learner_dir = learner_dir
-        self.learner_step_count += 1
-        assert(self.learner_step_count == learner_step_count)
-        
-        if rf_idx is None:
-            for rf_idx in range(self.num_rf):
-                # Update what the learner knows about the env
-                self.update_learner_belief(rf_idx)
-        else:
-            self.update_learner_belief(rf_idx)
+        # Update what the learner knows about the env (all the receptive fields with an alive hypothesis at once)
+        # No-op if the step was already seen by a teacher sharing the tracker
+        self.knowledge_tracker.update(learner_pos, learner_dir, learner_step_count, rf_idx)
 
+    @METRICS.timed('BayesianTeacher.observe')
     def observe(self, action: int) -> None:
 
         self.LOG.append(f'step t={self.learner_step_count}')
         self.LOG.append(f'True action {action}')
         
-        for rf_idx in range(self.num_rf):
-            for goal_color in range(self.num_colors):
-                # Predict policy of the learner
-                predicted_policy = self.learner_policy(goal_color, rf_idx)
-                rf = self.rf_values[rf_idx]
-                if goal_color == 0:
-                    self.LOG.append(f'agent_pos {self.env.agent_pos} dir {self.env.agent_dir} rf {rf} goal_color {goal_color} policy {np.round(predicted_policy, 4)}')
-                    
-                # Bayesian update
-                self.beliefs[goal_color, rf_idx] *= predicted_policy[action]
+        # Predict policy of the learner for all the hypotheses
+        predicted_policies = self.learner_policies()
+        for rf_idx, rf in enumerate(self.rf_values):
+            self.LOG.append(f'agent_pos {self.env.agent_pos} dir {self.env.agent_dir} rf {rf} goal_color 0 policy {np.round(predicted_policies[0, rf_idx], 4)}')
+
+        # Bayesian update
+        self.beliefs *= predicted_policies[:, :, action]
 
         self.beliefs /= self.beliefs.sum()
+        self.prune_hypotheses()
         self.LOG.append(f'pred {list(np.around(self.beliefs, 4))}')
 
-    def predicted_reward(self, demo: list, goal_color: int, rf_idx: int) -> float:
-        current_receptve_field = self.env.agent_view_size
+    def finish_rollout(self, goal_color: int, rf_idx: int, rng: np.random.Generator) -> float | None:
+        # The Boltzmann learner draws every action: the end of a rollout is never determined in advance
+        return None
+
+    def clone_rollout_state(self, state: dict) -> dict:
+        clone = {name: state[name].copy() for name in self.ROLLOUT_STATE if name != 'learner_distance_fields'}
+        # Distance fields repaired in place in the copied distance maps
+        clone['learner_distance_fields'] = {}
+        for (obj, rf_idx, goal_color), field in state['learner_distance_fields'].items():
+            distance = clone['distance_subgoal'] if obj == 'subgoal' else clone['distance_goal']
+            clone['learner_distance_fields'][obj, rf_idx, goal_color] = field.copy(distance=distance[rf_idx, goal_color])
+        return clone
+
+    def lockstep_rollouts(self, demo_state: dict, goal_color: int, rf_idx: int, num_samples: int, rng: np.random.Generator) -> np.ndarray:
+        # Rewards of num_samples learners playing from the state reached after the demo, simulated step by step together
+        # The env is not stepped: the samples move on their own copy of the labels of the reset grid (keys do not block
+        # the view and the doors keep their label when open)
+        samples = [self.clone_rollout_state(demo_state) for _ in range(num_samples)]
+        world = np.repeat(get_world_labels(self.env)[None], num_samples, axis=0)
+        for sample, labels in zip(samples, world):
+            sample['knowledge_tracker'].labels = labels
+
+        dir_vec = np.array(DIR_VEC)
+        pos = np.tile(np.asarray(self.env.agent_start_pos, dtype=int), (num_samples, 1))
+        dir = np.full(num_samples, self.env.agent_start_dir, dtype=int)
+        carrying = np.full(num_samples, -1, dtype=int)
+        # Doors of each color: 0 locked, 1 open, 2 closed (unlocked)
+        doors = np.zeros((num_samples, self.num_colors), dtype=int)
+        rewards = np.zeros(num_samples)
+        active = np.ones(num_samples, dtype=bool)
+
+        step_count = 0
+        while active.any() and step_count < self.env.max_steps:
+            idx = np.nonzero(active)[0]
+            policies = np.zeros((len(idx), self.Na))
+            for kk, sample_idx in enumerate(idx):
+                self.load_rollout_state(samples[sample_idx])
+                policies[kk] = self.learner_policy(goal_color, rf_idx)
+            actions = draw_batch(policies, rng)
+            step_count += 1
+
+            # Same transitions as the env for the actions of the learner
+            front_pos = pos[idx] + dir_vec[dir[idx]]
+            front = world[idx, front_pos[:, 0], front_pos[:, 1]]
+            is_key = (front >= 2) & (front % 2 == 1)
+            is_door = (front >= 2) & (front % 2 == 0)
+            door_color = np.where(is_door, (front - 2) // 2, 0)
+            door_state = np.where(is_door, doors[idx, door_color], 0)
+
+            dir[idx[actions == 0]] = (dir[idx[actions == 0]] - 1) % 4
+            dir[idx[actions == 1]] = (dir[idx[actions == 1]] + 1) % 4
+            forward = (actions == 2) & ((front == EMPTY) | (is_door & (door_state == 1)))
+            pos[idx[forward]] = front_pos[forward]
+
+            pickup = (actions == 3) & is_key & (carrying[idx] == -1)
+            carrying[idx[pickup]] = (front[pickup] - 3) // 2
+            world[idx[pickup], front_pos[pickup, 0], front_pos[pickup, 1]] = EMPTY
+
+            drop = (actions == 4) & (front == EMPTY) & (carrying[idx] != -1)
+            world[idx[drop], front_pos[drop, 0], front_pos[drop, 1]] = 2 + carrying[idx[drop]] * 2 + 1
+            carrying[idx[drop]] = -1
+
+            toggle = (actions == 5) & is_door
+            unlock = toggle & (door_state == 0) & (carrying[idx] == door_color)
+            new_state = np.where(unlock, 1, np.where(door_state == 1, 2, 1))
+            toggle &= unlock | (door_state != 0)
+            doors[idx[toggle], door_color[toggle]] = new_state[toggle]
+            terminated = toggle & (new_state == 1) & (door_color == goal_color)
+            rewards[idx[terminated]] = self.env.success_reward(step_count)
+            active[idx[terminated]] = False
+
+            for sample_idx in idx[~terminated]:
+                self.load_rollout_state(samples[sample_idx])
+                self.update_knowledge(tuple(pos[sample_idx].tolist()), int(dir[sample_idx]), step_count, rf_idx)
+
+            for _ in idx[terminated]:
+                METRICS.observe('BayesianTeacher.rollout_length', step_count)
+        for _ in np.nonzero(active)[0]:
+            METRICS.observe('BayesianTeacher.rollout_length', step_count)
+
+        self.load_rollout_state(demo_state)
+        return rewards
+
+    @METRICS.timed('BayesianTeacher.predicted_reward_stats')
+    def predicted_reward_stats(self, demo: list, goal_color: int, rf_idx: int, num_samples: int=16, se_threshold: float | None = None,
+                               batch_size: int | None = None, rng: np.random.Generator | None = None) -> tuple:
+        # Mean reward, standard error and number of rollouts of up to num_samples learners after the same demo
+        # The demo is observed once, the rollouts are simulated in lockstep batches of batch_size samples
+        # (stop after the first batch with a standard error below se_threshold)
+        rng = self.rng if rng is None else rng
+        batch_size = num_samples if batch_size is None else batch_size
+        current_receptive_field = self.env.agent_view_size
         current_env_goal = self.env.agent_goal
 
-        # Reset env AND estimate beliefs of the learner
-        self.env.agent_view_size = self.rf_values[rf_idx]
-        self.env.agent_goal = goal_color + 1
-        self.env.reset_grid()
-        self.init_env(self.env)
+        with self.simulated_learner(rf_idx):
+            # Simulate the learner observing the demo (shared by all the samples)
+            self.observe_demo(demo, goal_color, rf_idx)
+
+            # Simulate the learners playing on the env AFTER seen the demo
+            self.env.reset_grid()
+            self.learner_step_count = 0
+            demo_state = self.save_rollout_state()
+
+            rewards = np.zeros(0)
+            standard_error = np.inf
+            while len(rewards) < num_samples:
+                batch = self.lockstep_rollouts(demo_state, goal_color, rf_idx, min(batch_size, num_samples - len(rewards)), rng)
+                rewards = np.concatenate((rewards, batch))
+                if len(rewards) > 1:
+                    standard_error = rewards.std(ddof=1) / np.sqrt(len(rewards))
+                if se_threshold is not None and standard_error <= se_threshold:
+                    break
 
-        self.learner_step_count = 0
-
-        if len(demo) > 0:
-            # Add first unused action to get the first observation
-            demo = [4] + demo
-        else:
-            demo = demo
-        
-        # Simulate the learner observing the demo
-        for a in demo:
-            action = Actions(a)
-            _, _, _, _, _ = self.env.step(action)
-            self.update_knowledge(self.env.agent_pos, self.env.agent_dir, self.env.step_count, rf_idx)
-        
-        # Simulate the learner playing on the env AFTER seen the demo
-        self.env.reset_grid()
-        self.learner_step_count = 0
-        terminated = False
-        while (not terminated) and (self.env.step_count < self.env.max_steps):
-            a = draw(self.learner_policy(goal_color, rf_idx))
-            action = Actions(a)
-            _, reward, terminated, _, _ = self.env.step(action)
-            self.update_knowledge(self.env.agent_pos, self.env.agent_dir, self.env.step_count, rf_idx)
-            
         # Reset env
-        self.env.agent_view_size = current_receptve_field
-        self.env.agent_gaol = current_env_goal
+        self.env.agent_view_size = current_receptive_field
+        self.env.agent_goal = current_env_goal
         self.env.reset_grid()
 
-        # Return the predicted reward
-        return reward
-    
-    def select_demo(self, l_max: int, cost_function: Callable[[int, int], float], all_demos: list | None = None) -> list:
-        goal_color_belief = np.sum(self.beliefs, axis=1)
-
-        if np.isclose(np.max(goal_color_belief), 1):
-            pred_goal_color = np.argmax(goal_color_belief)
-            demos = []
-            for rf in self.rf_values:
-                demo = generate_demo(self.env, rf, pred_goal_color)
-                demos.append(demo)
-
-        else:
-            demos = all_demos
-        
-        predicted_utility = []
-        for demo_idx, demo in enumerate(demos):
-            pred_u = 0
-            for pred_goal_color in range(self.num_colors):
-                for pred_rf_idx, _ in enumerate(self.rf_values):
-                    weight = self.beliefs[pred_goal_color, pred_rf_idx]
-                    if not np.isclose(weight, 0):
-                        hat_r = self.predicted_reward(demo, pred_goal_color, pred_rf_idx)
-                        cost = cost_function(len(demo), l_max)
-                        pred_u += (hat_r - cost) * weight
-            predicted_utility.append(pred_u)
+        return rewards.mean(), standard_error, len(rewards)
 
-        argmax_set = np.where(np.isclose(predicted_utility, np.max(predicted_utility)))[0]
-        demo_idx = np.random.choice(argmax_set)
-
-        predicted_best_utility = np.max(predicted_utility)
-
-        return demos[demo_idx], demo_idx, predicted_best_utility, demos
+    def config(self) -> dict:
+        # Constructor parameters (to rebuild the teacher in a worker process)
+        return dict(num_colors=self.num_colors, rf_values=self.rf_values_basic, Na=self.Na, lambd=self.lambd, add_full_obs=self.add_full_obs,
+                    policy_table_size=self.policy_table_size, belief_epsilon=self.belief_epsilon, prefix_trie=self.prefix_trie)
     
 ##          
 # Bayesian teacher that knows learner is using A* algo to compute the shortest path & active exploration
 ##
 
-class AlignedBayesianTeacher:
+class AlignedBayesianTeacher(BaseBayesianTeacher):
+
+    # Teacher attributes holding the state of the simulated learner
+    ROLLOUT_STATE = ('knowledge_tracker', 'learner_queue_actions', 'learner_queue_transitions', 'learner_shortest_path_subgoal',
+                     'learner_shortest_path_goal', 'learner_obstacle_version', 'committed_check_version', 'learner_going_to_subgoal',
+                     'learner_going_to_goal', 'learner_reached_subgoal')
 
     def __init__(self,
                  env: MultiGoalsEnv | MultiRoomsGoalsEnv,
                  num_colors: int=4,
                  rf_values: np.ndarray=np.array([3,5,7]),
                  Na: int=6,
-                 add_full_obs: bool=True
+                 add_full_obs: bool=True,
+                 rng: np.random.Generator | None = None,
+                 knowledge_tracker: LearnerKnowledgeTracker | None = None,
+                 reward_memo: RewardMemo | None = None,
+                 policy_table_size: int=0,
+                 prefix_trie: bool=True
                  ) -> None:
-        
-        self.Na = Na
-        self.rf_values_basic = rf_values
-        self.add_full_obs = add_full_obs
 
-        self.num_colors = num_colors
-        self.num_rf = len(rf_values) + 1 if self.add_full_obs else len(rf_values)
-        
-        # Init beliefs on the type of learner
-        self.beliefs = 1. / ( num_colors * self.num_rf) * np.ones((num_colors, self.num_rf))
-        # Init env and learner beliefs about the env
-        self.init_env(env)
-
-        self.LOG = []
-
-    def init_env(self, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> None:
-        self.env = env
-        
-        self.gridsize = self.env.height
-        if self.add_full_obs:
-            self.rf_values  = np.concatenate((self.rf_values_basic, np.array([self.gridsize])))
-        else:
-            self.rf_values = self.rf_values_basic
-
-        self.learner_beliefs = 1. / (2 + 2 * self.num_colors) * np.ones((self.num_rf, self.gridsize, self.gridsize, 2 + 2 * self.num_colors))
+        super().__init__(env, num_colors, rf_values, Na, add_full_obs, rng, knowledge_tracker, reward_memo, policy_table_size, prefix_trie)
 
+    def init_learner_model(self) -> None:
         self.learner_queue_actions = {}
         self.learner_queue_transitions = {}
         self.learner_shortest_path_subgoal = {}
@@ -448,105 +1032,55 @@ class AlignedBayesianTeacher:
             self.learner_shortest_path_subgoal[goal_color] = {}
             self.learner_shortest_path_goal[goal_color] = {}
             for rf in self.rf_values:
-                self.learner_queue_actions[goal_color][rf] = SimpleQueue()
-                self.learner_queue_transitions[goal_color][rf] = SimpleQueue()
+                self.learner_queue_actions[goal_color][rf] = deque()
+                self.learner_queue_transitions[goal_color][rf] = deque()
                 self.learner_shortest_path_subgoal[goal_color][rf] = None
                 self.learner_shortest_path_goal[goal_color][rf] = None
 
-        self.learner_obstacle_grid = np.ones((self.num_colors, self.num_rf, self.env.height, self.env.width))
+        # Version of the obstacle grid of the rf (stored once in the tracker) used for the current shortest path
+        self.learner_obstacle_version = np.zeros((self.num_colors, self.num_rf), dtype=int)
+        # Version of the obstacle grid when the end of the rollout was last checked to be determined (-1: never)
+        self.committed_check_version = np.full((self.num_colors, self.num_rf), -1, dtype=int)
 
         self.learner_going_to_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
         self.learner_going_to_goal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
         
         self.learner_reached_subgoal = np.zeros((self.num_colors, self.num_rf), dtype=bool)
-        
-        self.learner_step_count = -1
 
-    def update_learner_belief(self, rf_idx: int) -> None:
-        
-        receptive_field = self.rf_values[rf_idx]
-
-        obs, vis_mask = compute_learner_obs(self.learner_pos, self.learner_dir, receptive_field, self.env)
-
-        f_vec = DIR_TO_VEC[self.learner_dir]
-        dir_vec = DIR_TO_VEC[self.learner_dir]
-        dx, dy = dir_vec
-        r_vec =  np.array((-dy, dx))
-        top_left = (
-            self.learner_pos
-            + f_vec * (receptive_field - 1)
-            - r_vec * (receptive_field // 2)
-        )
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, receptive_field):
-            for vis_i in range(0, receptive_field):
-
-                if not vis_mask[vis_i, vis_j]:
-                    continue
-
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-                if abs_i < 0 or abs_i >= self.gridsize:
-                    continue
-                if abs_j < 0 or abs_j >= self.gridsize:
-                    continue
-
-                one_hot = np.zeros(2 + 2 * self.num_colors)
-                color_idx = obs[vis_i, vis_j, 1]
-
-                if self.learner_pos == (abs_i, abs_j):
-                    one_hot[0] = 1
-                # Goal
-                elif obs[vis_i, vis_j, 0] == 4:
-                    one_hot[2 + (color_idx - 1) * 2] = 1
-                # Subgoal (key)
-                elif obs[vis_i, vis_j, 0] == 5:
-                    one_hot[2 + (color_idx - 1) * 2 + 1] = 1
-                # Wall
-                elif obs[vis_i, vis_j, 0] == 2:
-                    one_hot[1] = 1
-                # Nothing
-                else:
-                    one_hot[0] = 1
-                
-                # print('update', 'pos', abs_i, abs_j, 'beliefs', one_hot)
-                self.learner_beliefs[rf_idx, abs_i, abs_j, :] = one_hot
+    def clear_learner_model(self, rf_idx: int | None = None) -> None:
+        # Same learner model as init_learner_model, cleared in place (the plan queues are emptied, not replaced)
+        rows = slice(None) if rf_idx is None else rf_idx
+        for goal_color in range(self.num_colors):
+            for rf in np.atleast_1d(self.rf_values[rows]):
+                self.learner_queue_actions[goal_color][rf].clear()
+                self.learner_queue_transitions[goal_color][rf].clear()
+                self.learner_shortest_path_subgoal[goal_color][rf] = None
+                self.learner_shortest_path_goal[goal_color][rf] = None
+        self.learner_obstacle_version[:, rows] = 0
+        self.committed_check_version[:, rows] = -1
+        self.learner_going_to_subgoal[:, rows] = False
+        self.learner_going_to_goal[:, rows] = False
+        self.learner_reached_subgoal[:, rows] = False
+
+    def on_knowledge_update(self, new_cells: np.ndarray) -> None:
+        # Nothing to do: the plans are checked against the obstacle grid when the policy is predicted
+        pass
+
+    def prune_hypotheses(self) -> None:
+        # Hypotheses with a zero belief are dead (their plans are dropped): the learner model is deterministic, a hypothesis
+        # dies as soon as it mispredicts an action
+        dead = self.active_hypotheses & (self.beliefs == 0)
+        if dead.any():
+            METRICS.count('AlignedBayesianTeacher.pruned_hypotheses', int(dead.sum()))
+            self.active_hypotheses = self.active_hypotheses & ~dead
+            for goal_color, rf_idx in np.argwhere(dead):
+                self.empty_queues(goal_color, rf_idx)
 
     def compute_exploration_score(self, dir: int, pos: tuple, rf_idx: int) -> float:
         
-        receptive_field = self.rf_values[rf_idx]
-        
-        f_vec = DIR_TO_VEC[dir]
-        dir_vec = DIR_TO_VEC[dir]
-        dx, dy = dir_vec
-        r_vec =  np.array((-dy, dx))
-
-        top_left = (
-            pos
-            + f_vec * (receptive_field - 1)
-            - r_vec * (receptive_field // 2)
-        )
-
-        _, vis_mask = compute_learner_obs(pos, dir, receptive_field, self.env)
-        exploration_score = 0
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, receptive_field):
-            for vis_i in range(0, receptive_field):
-
-                if not vis_mask[vis_i, vis_j]:
-                    continue
-
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-                if abs_i < 0 or abs_i >= self.gridsize:
-                    continue
-                if abs_j < 0 or abs_j >= self.gridsize:
-                    continue
-
-                if Shannon_entropy(self.learner_beliefs[rf_idx, abs_i, abs_j, :]) > 0:
-                    exploration_score += 1
+        # Number of visible cells the learner does not know yet
+        cells = self.knowledge_tracker.visible_cells(pos, dir, rf_idx)
+        exploration_score = int(np.sum(self.learner_knowledge[rf_idx].reshape(-1)[cells] == UNKNOWN))
             
         return exploration_score
     
@@ -559,13 +1093,9 @@ class AlignedBayesianTeacher:
         scores[1] = self.compute_exploration_score((self.learner_dir + 1) % 4, self.learner_pos, rf_idx=rf_idx)
         # Move forward
         next_pos = self.learner_pos + DIR_TO_VEC[self.learner_dir]
-        one_hot_empty = np.zeros(2 + self.num_colors * 2)
-        one_hot_empty[0] = 1
-        one_hot_subgoal = np.zeros(2 + self.num_colors * 2)
-        one_hot_subgoal [2 + 2 * goal_color + 1]
 
-        if not (np.all(self.learner_beliefs[rf_idx, next_pos[0], next_pos[1], :] == one_hot_empty) or \
-            np.all(self.learner_beliefs[rf_idx, next_pos[0], next_pos[1], :] == one_hot_subgoal)): # Obstacle in front
+        # Only a known empty cell can be entered (a key in front is an obstacle for this learner model)
+        if self.learner_knowledge[rf_idx, next_pos[0], next_pos[1]] != EMPTY: # Obstacle in front
             scores[2] = -1.
         else:
             scores[2] = self.compute_exploration_score(self.learner_dir, next_pos, rf_idx=rf_idx)
@@ -581,12 +1111,68 @@ class AlignedBayesianTeacher:
         return proba_dist
             
 
+    def empty_queues(self, goal_color: int, rf_idx: int) -> None:
+        receptive_field = self.rf_values[rf_idx]
+        self.learner_queue_transitions[goal_color][receptive_field].clear()
+        self.learner_queue_actions[goal_color][receptive_field].clear()
+
+    def learner_policies(self) -> np.ndarray:
+        # Predicted policy of the learner for all the alive (goal color, rf) hypotheses: (num_colors, num_rf, Na), 0 for the dead ones
+        # The hypotheses following a plan (queued actions/transitions) or planning one are handled one by one with learner_policy,
+        # the exploration policy does not depend on the goal color (computed once per rf)
+        # LOG: 'First action' is written once and the exploration scores once per rf (not once per hypothesis), after the
+        # lines of the sequential hypotheses of all the rfs
+        policies = np.zeros((self.num_colors, self.num_rf, self.Na))
+        active = self.active_hypotheses
+
+        if self.learner_step_count == 0:
+            self.LOG.append('First action')
+            policies[:, :, 4] = 1 # unused (to get first observation)
+            return policies
+
+        colors = np.arange(self.num_colors)[:, None]
+        next_pos = self.learner_pos + DIR_TO_VEC[self.learner_dir]
+        front = self.learner_knowledge[:, next_pos[0], next_pos[1]][None, :]
+
+        # Subgoal (key) in front of the learner --> empty queues
+        key_in_front = (front == 2 + colors * 2 + 1) & active
+        for goal_color, rf_idx in zip(*np.nonzero(key_in_front)):
+            self.empty_queues(goal_color, rf_idx)
+        self.learner_reached_subgoal |= key_in_front
+        self.learner_going_to_subgoal &= ~key_in_front
+        policies[key_in_front, 3] = 1 # Pickup the subgoal (key)
+
+        # Goal (door) in front of the learner --> empty queues
+        door_in_front = ~key_in_front & (front == 2 + colors * 2) & self.learner_reached_subgoal & active
+        for goal_color, rf_idx in zip(*np.nonzero(door_in_front)):
+            self.empty_queues(goal_color, rf_idx)
+        self.learner_going_to_goal &= ~door_in_front
+        policies[door_in_front, 5] = 1 # Open the goal (door)
+
+        # Plan to follow or to compute
+        queued = np.array([[len(self.learner_queue_actions[goal_color][rf]) > 0 or len(self.learner_queue_transitions[goal_color][rf]) > 0
+                            for rf in self.rf_values] for goal_color in range(self.num_colors)], dtype=bool)
+        known = known_labels(self.learner_knowledge, 2 + 2 * self.num_colors)
+        known_goal, known_subgoal = known[:, 2::2].T, known[:, 3::2].T
+        to_subgoal = known_subgoal & ~self.learner_reached_subgoal
+        to_goal = ~to_subgoal & known_goal & self.learner_reached_subgoal
+        sequential = ~key_in_front & ~door_in_front & (queued | to_subgoal | to_goal) & active
+        for goal_color, rf_idx in zip(*np.nonzero(sequential)):
+            policies[goal_color, rf_idx] = self.learner_policy(goal_color, rf_idx)
+
+        # Nothing to do --> Action that maximizes the exploration
+        exploration = ~key_in_front & ~door_in_front & ~sequential & active
+        for rf_idx in np.nonzero(exploration.any(axis=0))[0]:
+            policies[exploration[:, rf_idx], rf_idx] = self.learner_exploration_policy(0, rf_idx)
+
+        return policies
+
     def add_actions(self, pos_dest: tuple, goal_color: int, rf_idx: int) -> None:
         receptive_field = self.rf_values[rf_idx]
         # Mapping position transition --> actions
         actions = map_actions(self.learner_pos, pos_dest, self.learner_dir)
         for a in actions:
-            self.learner_queue_actions[goal_color][receptive_field].put(a)
+            self.learner_queue_actions[goal_color][receptive_field].append(a)
 
     def obj_in_front(self, rf_idx: int, obj_idx: int) -> bool:
 
@@ -600,9 +1186,56 @@ class AlignedBayesianTeacher:
         elif self.learner_dir == 1:
             dy = 1
 
-        return self.learner_beliefs[rf_idx, self.learner_pos[0] + dx, self.learner_pos[1] + dy, obj_idx] == 1
+        return self.learner_knowledge[rf_idx, self.learner_pos[0] + dx, self.learner_pos[1] + dy] == obj_idx
         
-    def learner_policy(self, goal_color: int, rf_idx: int):
+    def plan_state(self, goal_color: int, rf_idx: int) -> tuple:
+        # Flags, plan queues and shortest paths of the hypothesis (and whether its plan uses the current obstacle grid)
+        receptive_field = self.rf_values[rf_idx]
+        path_subgoal = self.learner_shortest_path_subgoal[goal_color][receptive_field]
+        path_goal = self.learner_shortest_path_goal[goal_color][receptive_field]
+        return (self.learner_reached_subgoal[goal_color, rf_idx], self.learner_going_to_subgoal[goal_color, rf_idx],
+                self.learner_going_to_goal[goal_color, rf_idx],
+                self.learner_obstacle_version[goal_color, rf_idx] == self.knowledge_tracker.obstacle_versions[rf_idx],
+                tuple(self.learner_queue_actions[goal_color][receptive_field]),
+                tuple(self.learner_queue_transitions[goal_color][receptive_field]),
+                None if path_subgoal is None else tuple(path_subgoal), None if path_goal is None else tuple(path_goal))
+
+    def load_plan_state(self, goal_color: int, rf_idx: int, state: tuple) -> None:
+        receptive_field = self.rf_values[rf_idx]
+        reached_subgoal, going_to_subgoal, going_to_goal, current_version, actions, transitions, path_subgoal, path_goal = state
+        self.learner_reached_subgoal[goal_color, rf_idx] = reached_subgoal
+        self.learner_going_to_subgoal[goal_color, rf_idx] = going_to_subgoal
+        self.learner_going_to_goal[goal_color, rf_idx] = going_to_goal
+        if current_version:
+            self.learner_obstacle_version[goal_color, rf_idx] = self.knowledge_tracker.obstacle_versions[rf_idx]
+        self.learner_queue_actions[goal_color][receptive_field].clear()
+        self.learner_queue_actions[goal_color][receptive_field].extend(actions)
+        self.learner_queue_transitions[goal_color][receptive_field].clear()
+        self.learner_queue_transitions[goal_color][receptive_field].extend(transitions)
+        self.learner_shortest_path_subgoal[goal_color][receptive_field] = None if path_subgoal is None else deque(path_subgoal)
+        self.learner_shortest_path_goal[goal_color][receptive_field] = None if path_goal is None else deque(path_goal)
+
+    def learner_policy(self, goal_color: int, rf_idx: int) -> np.ndarray:
+        # The policy is a function of the knowledge of the rf, the pose, the rf (exploration) and the plan state of the
+        # hypothesis: same state in the table --> same policy and same plan state after (the table is cleared when the
+        # env changes, the exploration depends on the walls hiding the cells)
+        if self.policy_table is None:
+            return self.compute_learner_policy(goal_color, rf_idx)
+        key = (goal_color, self.rf_values[rf_idx], self.knowledge_tracker.knowledge_hash(rf_idx),
+               tuple(self.learner_pos) if self.learner_pos is not None else None, self.learner_dir, self.learner_step_count == 0,
+               self.plan_state(goal_color, rf_idx))
+        entry = self.policy_table.get(key)
+        if entry is None:
+            log_start = len(self.LOG)
+            proba_dist = self.compute_learner_policy(goal_color, rf_idx)
+            self.policy_table.put(key, (proba_dist.copy(), self.plan_state(goal_color, rf_idx), tuple(self.LOG[log_start:])))
+            return proba_dist
+        proba_dist, state, log = entry
+        self.load_plan_state(goal_color, rf_idx, state)
+        self.LOG.extend(log)
+        return proba_dist.copy()
+
+    def compute_learner_policy(self, goal_color: int, rf_idx: int) -> np.ndarray:
 
         receptive_field = self.rf_values[rf_idx]
             
@@ -620,10 +1253,8 @@ class AlignedBayesianTeacher:
             self.learner_reached_subgoal[goal_color, rf_idx] = True
             self.learner_going_to_subgoal[goal_color, rf_idx] = False
             # Subgoal (key) reached --> empty queues
-            while not self.learner_queue_transitions[goal_color][receptive_field].empty():
-                _ = self.learner_queue_transitions[goal_color][receptive_field].get()
-            while not self.learner_queue_actions[goal_color][receptive_field].empty():
-                _ = self.learner_queue_actions[goal_color][receptive_field].get()
+            self.learner_queue_transitions[goal_color][receptive_field].clear()
+            self.learner_queue_actions[goal_color][receptive_field].clear()
             proba_dist = np.zeros(self.Na)
             proba_dist[3] = 1 # Pickup the subgoal (key)
             return proba_dist
@@ -634,61 +1265,53 @@ class AlignedBayesianTeacher:
                 self.LOG.append(f' rf={receptive_field} GOAL in front')
             self.learner_going_to_goal[goal_color, rf_idx] = False
             # Goal (door) reached --> empty queues
-            while not self.learner_queue_transitions[goal_color][receptive_field].empty():
-                _ = self.learner_queue_transitions[goal_color][receptive_field].get()
-            while not self.learner_queue_actions[goal_color][receptive_field].empty():
-                _ = self.learner_queue_actions[goal_color][receptive_field].get()
+            self.learner_queue_transitions[goal_color][receptive_field].clear()
+            self.learner_queue_actions[goal_color][receptive_field].clear()
             proba_dist = np.zeros(self.Na)
             proba_dist[5] = 1 # Open the goal (door)
             return proba_dist
         
         # Action to be played
-        if not self.learner_queue_actions[goal_color][receptive_field].empty():
+        if len(self.learner_queue_actions[goal_color][receptive_field]) > 0:
             if goal_color == 0:
                 self.LOG.append(f' rf={receptive_field} action to be done')
-            action = self.learner_queue_actions[goal_color][receptive_field].get()
+            action = self.learner_queue_actions[goal_color][receptive_field].popleft()
             proba_dist = np.zeros(self.Na)
             proba_dist[action] = 1
             return proba_dist
         
         # Position to be reached
-        if not self.learner_queue_transitions[goal_color][receptive_field].empty():
+        if len(self.learner_queue_transitions[goal_color][receptive_field]) > 0:
             if goal_color == 0:
                 self.LOG.append(f' rf={receptive_field} position to be reached')
-            _, pos_dest = self.learner_queue_transitions[goal_color][receptive_field].get()
+            _, pos_dest = self.learner_queue_transitions[goal_color][receptive_field].popleft()
 
             # If not an obstacle --> add action to reach pos_dest
-            one_hot_wall = np.zeros(2 + self.num_colors * 2)
-            one_hot_wall[1] = 1
-            one_hot_goal = np.zeros(2 + self.num_colors * 2)
-            one_hot_goal[2 + goal_color * 2] = 1
-            # If not an obstacle --> add action to reach pos_dest
-            if not (np.all(self.learner_beliefs[rf_idx, pos_dest[0], pos_dest[1], :] == one_hot_wall) \
-                    or (np.all(self.learner_beliefs[rf_idx, pos_dest[0], pos_dest[1], :] == one_hot_goal) and not self.learner_reached_subgoal[goal_color, rf_idx])):
+            dest_knowledge = self.learner_knowledge[rf_idx, pos_dest[0], pos_dest[1]]
+            if not (dest_knowledge == WALL \
+                    or (dest_knowledge == 2 + goal_color * 2 and not self.learner_reached_subgoal[goal_color, rf_idx])):
                 self.add_actions(pos_dest=pos_dest, goal_color=goal_color, rf_idx=rf_idx)
 
             return self.learner_policy(goal_color, rf_idx)
 
 
         # If know where is the subgoal (key) & not already have subgoal (key) & not already going to the subgoal (key) --> go to the subgoal (key)
-        if (self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2 + 1] == 1).any() and \
+        if (self.learner_knowledge[rf_idx] == 2 + goal_color * 2 + 1).any() and \
             not self.learner_reached_subgoal[goal_color, rf_idx]:
             
-            subgoal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2 + 1] == 1)
+            subgoal_pos = np.where(self.learner_knowledge[rf_idx] == 2 + goal_color * 2 + 1)
             # Obstacle grid
-            one_hot_wall = np.zeros(2 + self.num_colors * 2)
-            one_hot_wall[0] = 1
-            grid = np.ones((self.gridsize, self.gridsize)) - np.all(self.learner_beliefs[rf_idx, ...] == one_hot_wall.reshape(1, 1, -1), axis=2)
+            grid = self.knowledge_tracker.obstacle_grid(rf_idx)
             # Check if new info
             compute_shortest_path = False
-            if np.any(grid != self.learner_obstacle_grid[goal_color, rf_idx]):
-                self.learner_obstacle_grid[goal_color, rf_idx] = grid.copy()
+            if self.knowledge_tracker.obstacle_versions[rf_idx] != self.learner_obstacle_version[goal_color, rf_idx]:
+                self.learner_obstacle_version[goal_color, rf_idx] = self.knowledge_tracker.obstacle_versions[rf_idx]
                 compute_shortest_path = True
             grid[subgoal_pos[0], subgoal_pos[1]] = 0
 
             # First time computing the shortest path
             if self.learner_shortest_path_subgoal[goal_color][receptive_field] is None:
-                self.learner_shortest_path_subgoal[goal_color][receptive_field] = SimpleQueue()
+                self.learner_shortest_path_subgoal[goal_color][receptive_field] = deque()
                 compute_shortest_path = True
             
             # If new info --> compute shortest path
@@ -696,41 +1319,37 @@ class AlignedBayesianTeacher:
                 path = A_star_algorithm(self.learner_pos, subgoal_pos, grid)
                 if path is not None:
                     # Empty previous path
-                    while not self.learner_shortest_path_subgoal[goal_color][receptive_field].empty():
-                        _ = self.learner_shortest_path_subgoal[goal_color][receptive_field].get()
-                    for transition in path:
-                        self.learner_shortest_path_subgoal[goal_color][receptive_field].put(transition)
+                    self.learner_shortest_path_subgoal[goal_color][receptive_field].clear()
+                    self.learner_shortest_path_subgoal[goal_color][receptive_field].extend(path)
             
-            if not self.learner_shortest_path_subgoal[goal_color][receptive_field].empty():
+            if len(self.learner_shortest_path_subgoal[goal_color][receptive_field]) > 0:
                 if goal_color == 0:
                     self.LOG.append(f'rf={receptive_field} going to the SUBGOAL')
                 # Add transition to go to subgoal (key)
-                transition = self.learner_shortest_path_subgoal[goal_color][receptive_field].get()
-                self.learner_queue_transitions[goal_color][receptive_field].put(transition)
+                transition = self.learner_shortest_path_subgoal[goal_color][receptive_field].popleft()
+                self.learner_queue_transitions[goal_color][receptive_field].append(transition)
                 # Set variable
                 self.learner_going_to_subgoal[goal_color, rf_idx] = True
                 # Return action
                 return self.learner_policy(goal_color, rf_idx)
 
         # If know where is the goal (door) & has subgoal (key) & not already going to the goal (door) --> go to the goal (door)
-        elif (self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2] == 1).any() and \
+        elif (self.learner_knowledge[rf_idx] == 2 + goal_color * 2).any() and \
               self.learner_reached_subgoal[goal_color, rf_idx]:
 
-            goal_pos = np.where(self.learner_beliefs[rf_idx, :, :, 2 + goal_color * 2] == 1)
+            goal_pos = np.where(self.learner_knowledge[rf_idx] == 2 + goal_color * 2)
             # Obstacle grid
-            one_hot_wall = np.zeros(2 + self.num_colors * 2)
-            one_hot_wall[0] = 1
-            grid = np.ones((self.gridsize, self.gridsize)) - np.all(self.learner_beliefs[rf_idx, ...] == one_hot_wall.reshape(1, 1, -1), axis=2)
+            grid = self.knowledge_tracker.obstacle_grid(rf_idx)
             # Check if new info
             compute_shortest_path = False
-            if np.any(grid != self.learner_obstacle_grid[goal_color, rf_idx]):
-                self.learner_obstacle_grid[goal_color, rf_idx] = grid.copy()
+            if self.knowledge_tracker.obstacle_versions[rf_idx] != self.learner_obstacle_version[goal_color, rf_idx]:
+                self.learner_obstacle_version[goal_color, rf_idx] = self.knowledge_tracker.obstacle_versions[rf_idx]
                 compute_shortest_path = True
             grid[goal_pos[0], goal_pos[1]] = 0
 
             # First time computing the shortest path
             if self.learner_shortest_path_goal[goal_color][receptive_field] is None:
-                self.learner_shortest_path_goal[goal_color][receptive_field] = SimpleQueue()
+                self.learner_shortest_path_goal[goal_color][receptive_field] = deque()
                 compute_shortest_path = True
             
             # If new info --> compute shortest path
@@ -738,17 +1357,15 @@ class AlignedBayesianTeacher:
                 path = A_star_algorithm(self.learner_pos, goal_pos, grid)
                 if path is not None:
                     # Empty previous path
-                    while not self.learner_shortest_path_goal[goal_color][receptive_field].empty():
-                        _ = self.learner_shortest_path_goal[goal_color][receptive_field].get()
-                    for transition in path:
-                        self.learner_shortest_path_goal[goal_color][receptive_field].put(transition)
+                    self.learner_shortest_path_goal[goal_color][receptive_field].clear()
+                    self.learner_shortest_path_goal[goal_color][receptive_field].extend(path)
             
-            if not self.learner_shortest_path_goal[goal_color][receptive_field].empty():
+            if len(self.learner_shortest_path_goal[goal_color][receptive_field]) > 0:
                 if goal_color == 0:
                     self.LOG.append(f' rf={receptive_field} going to the GOAL')
                 # Add transition to go to goal (door)
-                transition = self.learner_shortest_path_goal[goal_color][receptive_field].get()
-                self.learner_queue_transitions[goal_color][receptive_field].put(transition)
+                transition = self.learner_shortest_path_goal[goal_color][receptive_field].popleft()
+                self.learner_queue_transitions[goal_color][receptive_field].append(transition)
                 # Set variable
                 self.learner_going_to_goal[goal_color, rf_idx] = True
                 # Return action
@@ -759,107 +1376,133 @@ class AlignedBayesianTeacher:
             self.LOG.append(f'rf={receptive_field} Exploration')
         return self.learner_exploration_policy(goal_color, rf_idx)
         
+    def committed_steps_to_goal(self, goal_color: int, rf_idx: int) -> int | None:
+        # Number of actions until the learner opens the goal (door) if the end of the rollout is determined: the learner
+        # has the subgoal (key) and follows its plan to the goal, and no cell seen on the way can change its obstacle grid
+        # (hence no new shortest path). None otherwise
+        receptive_field = self.rf_values[rf_idx]
+        knowledge = self.learner_knowledge[rf_idx]
+        door, key = 2 + 2 * goal_color, 2 + 2 * goal_color + 1
+        if self.learner_step_count == 0 or not self.learner_reached_subgoal[goal_color, rf_idx] \
+           or self.learner_shortest_path_goal[goal_color][receptive_field] is None \
+           or self.learner_obstacle_version[goal_color, rf_idx] != self.knowledge_tracker.obstacle_versions[rf_idx]:
+            return None
+
+        # Same decisions as learner_policy on the poses of the plan
+        actions = deque(self.learner_queue_actions[goal_color][receptive_field])
+        transitions = deque(self.learner_queue_transitions[goal_color][receptive_field])
+        path = deque(self.learner_shortest_path_goal[goal_color][receptive_field])
+        pos, dir = (int(self.learner_pos[0]), int(self.learner_pos[1])), int(self.learner_dir)
+        poses = []
+        while True:
+            front = (pos[0] + DIR_VEC[dir][0], pos[1] + DIR_VEC[dir][1])
+            if knowledge[front] == key:
+                return None
+            if knowledge[front] == door:
+                break
+            if len(actions) > 0:
+                a = actions.popleft()
+            elif len(transitions) > 0:
+                _, pos_dest = transitions.popleft()
+                if knowledge[pos_dest[0], pos_dest[1]] != WALL:
+                    actions.extend(map_actions(pos, pos_dest, dir))
+                continue
+            elif len(path) > 0:
+                transitions.append(path.popleft())
+                continue
+            else:
+                return None
+            if a == 0:
+                dir = (dir - 1) % 4
+            elif a == 1:
+                dir = (dir + 1) % 4
+            elif a == 2 and knowledge[front] == EMPTY:
+                pos = front
+            else:
+                return None
+            poses.append((pos, dir))
+
+        # Cells the learner would see on the way (an obstacle in its knowledge that is empty in the world --> new plan)
+        world = get_world_labels(self.env).reshape(-1)
+        revealable = (knowledge.reshape(-1) != EMPTY) & (world == EMPTY)
+        for pos, dir in poses:
+            if revealable[self.knowledge_tracker.visible_cells(pos, dir, rf_idx)].any():
+                return None
+        return len(poses) + 1
+
+    def finish_rollout(self, goal_color: int, rf_idx: int, rng: np.random.Generator) -> float | None:
+        # Reward of the rollout computed in closed form if its end is determined (checked once per obstacle grid version),
+        # the random numbers of the remaining steps are drawn as if they were played. None if the rollout must go on
+        version = self.knowledge_tracker.obstacle_versions[rf_idx]
+        if not (self.learner_reached_subgoal[goal_color, rf_idx] and self.learner_going_to_goal[goal_color, rf_idx]) \
+           or self.learner_obstacle_version[goal_color, rf_idx] != version:
+            return None
+        if self.committed_check_version[goal_color, rf_idx] == version:
+            return None
+        self.committed_check_version[goal_color, rf_idx] = version
+        carrying = self.env.carrying
+        if carrying is None or carrying.type != 'key' or COLOR_TO_IDX[carrying.color] != goal_color + 1:
+            return None
+
+        steps = self.committed_steps_to_goal(goal_color, rf_idx)
+        if steps is None:
+            return None
+        num_played = min(steps, self.env.max_steps - self.env.step_count)
+        rng.random(num_played)
+        self.env.step_count += num_played
+        METRICS.count('AlignedBayesianTeacher.finished_rollouts')
+        METRICS.observe('AlignedBayesianTeacher.skipped_steps', num_played)
+        if num_played < steps:
+            # Truncated before opening the door
+            return 0
+        return self.env._reward()
+
+    @METRICS.timed('AlignedBayesianTeacher.update_knowledge')
     def update_knowledge(self, learner_pos: tuple, learner_dir: int, learner_step_count: int, rf_idx: int | None=None) -> None:
-        self.learner_pos = learner_pos
-        self.learner_dir = learner_dir
-        self.learner_step_count += 1
-        assert(self.learner_step_count == learner_step_count)
-        
-        if rf_idx is None:
-            for rf_idx in range(self.num_rf):
-                # Update what the learner knows about the env
-                self.update_learner_belief(rf_idx)
-        else:
-            self.update_learner_belief(rf_idx)
+        # Update what the learner knows about the env (all the receptive fields with an alive hypothesis at once)
+        # No-op if the step was already seen by a teacher sharing the tracker
+        self.knowledge_tracker.update(learner_pos, learner_dir, learner_step_count, rf_idx)
 
+    @METRICS.timed('AlignedBayesianTeacher.observe')
     def observe(self, action: int) -> None:
 
         self.LOG.append(f't={self.learner_step_count}')
         self.LOG.append(f'True action {action}')
 
+        # Predict policy of the learner for all the hypotheses
+        predicted_policies = self.learner_policies()
         for rf_idx in range(self.num_rf):
-            for goal_color in range(self.num_colors):
-                # Predict policy of the learner
-                predicted_policy = self.learner_policy(goal_color, rf_idx)
-                if goal_color == 0:
-                    self.LOG.append(f'rf {self.rf_values[rf_idx]} --> {predicted_policy}')
-                # Bayesian update
-                self.beliefs[goal_color, rf_idx] *= predicted_policy[action]
-              
-        self.beliefs /= self.beliefs.sum()
-        self.LOG.append(list(self.beliefs.copy()))
-
-    def predicted_reward(self, demo: list, goal_color: int, rf_idx: int) -> float:
-        current_receptve_field = self.env.agent_view_size
-        current_env_goal = self.env.agent_goal
-
-        # Reset env AND estimate beliefs of the learner
-        self.env.agent_view_size = self.rf_values[rf_idx]
-        self.env.agent_goal = goal_color + 1
-        self.env.reset_grid()
-        self.init_env(self.env)
-
-        self.learner_step_count = 0
-
-        if len(demo) > 0:
-            # Add first unused action to get the first observation
-            demo = [4] + demo
-        else:
-            demo = demo
-        
-        # Simulate the learner observing the demo
-        for a in demo:
-            action = Actions(a)
-            _, _, _, _, _ = self.env.step(action)
-            self.update_knowledge(self.env.agent_pos, self.env.agent_dir, self.env.step_count, rf_idx)
-        
-        # Simulate the learner playing on the env AFTER seen the demo
-        self.env.reset_grid()
-        self.learner_step_count = 0
-        terminated = False
-        while (not terminated) and (self.env.step_count < self.env.max_steps):
-            a = draw(self.learner_policy(goal_color, rf_idx))
-            action = Actions(a)
-            _, reward, terminated, _, _ = self.env.step(action)
-            self.update_knowledge(self.env.agent_pos, self.env.agent_dir, self.env.step_count, rf_idx)
-            
-        # Reset env
-        self.env.agent_view_size = current_receptve_field
-        self.env.agent_gaol = current_env_goal
-        self.env.reset_grid()
-
-        # Return the predicted reward
-        return reward
-    
-    def select_demo(self, l_max: int, cost_function: Callable[[int, int], float], all_demos: list | None = None) -> list:
-        goal_color_belief = np.sum(self.beliefs, axis=1)
-
-        if np.isclose(np.max(goal_color_belief), 1):
-            pred_goal_color = np.argmax(goal_color_belief)
-            demos = []
-            for rf in self.rf_values:
-                demo = generate_demo(self.env, rf, pred_goal_color)
-                demos.append(demo)
+            self.LOG.append(f'rf {self.rf_values[rf_idx]} --> {predicted_policies[0, rf_idx]}')
 
-        else:
-            demos = all_demos
-        
-        predicted_utility = []
-        for demo_idx, demo in enumerate(demos):
-            pred_u = 0
-            for pred_goal_color in range(self.num_colors):
-                for pred_rf_idx, _ in enumerate(self.rf_values):
-                    weight = self.beliefs[pred_goal_color, pred_rf_idx]
-                    if not np.isclose(weight, 0):
-                        hat_r = self.predicted_reward(demo, pred_goal_color, pred_rf_idx)
-                        cost = cost_function(len(demo), l_max)
-                        pred_u += (hat_r - cost) * weight
-            predicted_utility.append(pred_u)
+        # Bayesian update
+        self.beliefs *= predicted_policies[:, :, action]
 
-        argmax_set = np.where(np.isclose(predicted_utility, np.max(predicted_utility)))[0]
-        demo_idx = np.random.choice(argmax_set)
-
-        predicted_best_utility = np.max(predicted_utility)
+        self.beliefs /= self.beliefs.sum()
+        self.prune_hypotheses()
+        self.LOG.append(list(self.beliefs.copy()))
 
-        return demos[demo_idx], demo_idx, predicted_best_utility, demos
-    
\ No newline at end of file
+    @METRICS.timed('AlignedBayesianTeacher.predicted_reward_stats')
+    def predicted_reward_stats(self, demo: list, goal_color: int, rf_idx: int, num_samples: int=16, se_threshold: float | None = None,
+                               batch_size: int | None = None, rng: np.random.Generator | None = None) -> tuple:
+        # Mean reward, standard error and number of rollouts of up to num_samples learners after the same demo
+        # The rollouts are played one after the other (most of them end in closed form, see finish_rollout)
+        # (stop after the first batch of batch_size rollouts with a standard error below se_threshold)
+        rng = self.rng if rng is None else rng
+        batch_size = num_samples if batch_size is None else batch_size
+
+        rewards = []
+        standard_error = np.inf
+        while len(rewards) < num_samples:
+            for _ in range(min(batch_size, num_samples - len(rewards))):
+                rewards.append(self.predicted_reward(demo, goal_color, rf_idx, rng=rng))
+            if len(rewards) > 1:
+                standard_error = np.std(rewards, ddof=1) / np.sqrt(len(rewards))
+            if se_threshold is not None and standard_error <= se_threshold:
+                break
+
+        return np.mean(rewards), standard_error, len(rewards)
+
+    def config(self) -> dict:
+        # Constructor parameters (to rebuild the teacher in a worker process)
+        return dict(num_colors=self.num_colors, rf_values=self.rf_values_basic, Na=self.Na, add_full_obs=self.add_full_obs,
+                    policy_table_size=self.policy_table_size, prefix_trie=self.prefix_trie)
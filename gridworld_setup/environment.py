@@ -9,6 +9,8 @@ from minigrid.minigrid_env import MiniGridEnv
 
 import numpy as np
 
+from metrics import METRICS
+
 class MultiGoalsEnv(MiniGridEnv):
     def __init__(
         self,
@@ -19,18 +21,20 @@ class MultiGoalsEnv(MiniGridEnv):
         agent_start_dir: int=0,
         num_colors: int=4,
         max_steps: int | None = None,
+        rng: np.random.Generator | None = None,
         **kwargs,
     ):  
         self.agent_goal = agent_goal
+        # Random stream used to place the objects (fresh entropy if not given)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Incremented each time the objects of the grid may change (new grid, door toggled, key picked up)
+        self.grid_version = 0
         self.num_doors = num_colors
         self.agent_start_pos = agent_start_pos
         self.agent_start_dir = agent_start_dir
         self.agent_view_size = agent_view_size
 
-        if self.agent_view_size >= size:
-            self.see_through_walls = True
-        else:
-            self.see_through_walls = False
+        self.see_through_walls = self.view_sees_through_walls(agent_view_size, size)
 
         mission_space = MissionSpace(mission_func=self._gen_mission)
         
@@ -55,6 +59,7 @@ class MultiGoalsEnv(MiniGridEnv):
     def _gen_grid(self, width: int, height: int):
         # Create an empty grid
         self.grid = Grid(width, height)
+        self.grid_version += 1
         
         self.obj_idx = [self.agent_start_pos]
 
@@ -72,17 +77,17 @@ class MultiGoalsEnv(MiniGridEnv):
         for ii in range(self.num_doors):
 
             # Create door and key at random position
-            i_door, i_key = np.random.randint(1, self.width - 1, size=2)
-            j_door, j_key = np.random.randint(1, self.height - 1, size=2)
+            i_door, i_key = self.rng.integers(1, self.width - 1, size=2)
+            j_door, j_key = self.rng.integers(1, self.height - 1, size=2)
 
             # Ensure no other object at the position
             while (i_door, j_door) in self.obj_idx:
-                i_door = np.random.randint(1, self.width - 1)
-                j_door = np.random.randint(1, self.height - 1)
+                i_door = self.rng.integers(1, self.width - 1)
+                j_door = self.rng.integers(1, self.height - 1)
             self.obj_idx.append((i_door, j_door))
             while (i_key, j_key) in self.obj_idx:
-                i_key = np.random.randint(1, self.width - 1)
-                j_key = np.random.randint(1, self.height - 1)
+                i_key = self.rng.integers(1, self.width - 1)
+                j_key = self.rng.integers(1, self.height - 1)
             self.obj_idx.append((i_key, j_key))
 
             door = Door(IDX_TO_COLOR[ii+1], is_locked=True)
@@ -102,17 +107,28 @@ class MultiGoalsEnv(MiniGridEnv):
 
         self.mission = "Open the door with the right color"
 
+    @staticmethod
+    def view_sees_through_walls(agent_view_size: int, size: int) -> bool:
+        # Views covering the whole grid see through the walls
+        return agent_view_size >= size
+
+    def success_reward(self, step_count: int) -> float:
+        # Reward of opening the door of the goal after step_count steps
+        return 1 - 0.9 * (step_count / self.max_steps)
+
+    def _reward(self) -> float:
+        return self.success_reward(self.step_count)
+
+    @METRICS.timed('env.reset_grid')
     def reset_grid(self):
 
-        if self.agent_view_size >= self.height:
-            self.see_through_walls = True
-        else:
-            self.see_through_walls = False
+        self.see_through_walls = self.view_sees_through_walls(self.agent_view_size, self.height)
 
         self.carrying = None
         self.step_count = 0
 
         self.grid = Grid(self.width, self.height)
+        self.grid_version += 1
 
         # Place walls around
         for i in range(0, self.height):
@@ -148,6 +164,10 @@ class MultiGoalsEnv(MiniGridEnv):
     def step(self, action: Actions):
         obs, reward, terminated, truncated, info = super().step(action)
 
+        # Objects of the grid or object carried changed (caches keyed on the version are refreshed)
+        if action in [self.actions.pickup, self.actions.drop, self.actions.toggle]:
+            self.grid_version += 1
+
         if action == self.actions.toggle:
             if self.doors[self.agent_goal - 1].is_open:
                 reward = self._reward()
@@ -170,19 +190,21 @@ class MultiRoomsGoalsEnv(MiniGridEnv):
         num_colors: int=4,
         num_rooms: int=3,
         max_steps: int | None = None,
+        rng: np.random.Generator | None = None,
         **kwargs,
     ):  
         self.agent_goal = agent_goal
+        # Random stream used to place the objects (fresh entropy if not given)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Incremented each time the objects of the grid may change (new grid, door toggled, key picked up)
+        self.grid_version = 0
         self.num_doors = num_colors
         self.num_rooms = num_rooms
         self.agent_start_pos = agent_start_pos
         self.agent_start_dir = agent_start_dir
         self.agent_view_size = agent_view_size
 
-        if self.agent_view_size >= size:
-            self.see_through_walls = True
-        else:
-            self.see_through_walls = False
+        self.see_through_walls = self.view_sees_through_walls(agent_view_size, size)
 
         mission_space = MissionSpace(mission_func=self._gen_mission)
         
@@ -207,6 +229,7 @@ class MultiRoomsGoalsEnv(MiniGridEnv):
     def _gen_grid(self, width: int, height: int):
         # Create an empty grid
         self.grid = Grid(width, height)
+        self.grid_version += 1
         
         self.obj_idx = [self.agent_start_pos]
 
@@ -241,17 +264,17 @@ class MultiRoomsGoalsEnv(MiniGridEnv):
         for ii in range(self.num_doors):
 
             # Create door and key at random position
-            i_door, i_key = np.random.randint(1, self.width - 1, size=2)
-            j_door, j_key = np.random.randint(1, self.height - 1, size=2)
+            i_door, i_key = self.rng.integers(1, self.width - 1, size=2)
+            j_door, j_key = self.rng.integers(1, self.height - 1, size=2)
 
             # Ensure no other object at the position (and not in the first room)
             while ((i_door, j_door) in self.obj_idx) or ((i_door, j_door) in self.wall_idx) or ((i_door, j_door) in first_room_idx):
-                i_door = np.random.randint(1, self.width - 1)
-                j_door = np.random.randint(1, self.height - 1)
+                i_door = self.rng.integers(1, self.width - 1)
+                j_door = self.rng.integers(1, self.height - 1)
             self.obj_idx.append((i_door, j_door))
             while ((i_key, j_key) in self.obj_idx or ((i_key, j_key) in self.wall_idx)) or ((i_key, j_key) in first_room_idx):
-                i_key = np.random.randint(1, self.width - 1)
-                j_key = np.random.randint(1, self.height - 1)
+                i_key = self.rng.integers(1, self.width - 1)
+                j_key = self.rng.integers(1, self.height - 1)
             self.obj_idx.append((i_key, j_key))
 
             door = Door(IDX_TO_COLOR[ii+1], is_locked=True)
@@ -271,17 +294,28 @@ class MultiRoomsGoalsEnv(MiniGridEnv):
 
         self.mission = "Open the door with the right color"
 
+    @staticmethod
+    def view_sees_through_walls(agent_view_size: int, size: int) -> bool:
+        # Views covering the whole grid see through the walls
+        return agent_view_size >= size
+
+    def success_reward(self, step_count: int) -> float:
+        # Reward of opening the door of the goal after step_count steps
+        return 1 - 0.9 * (step_count / self.max_steps)
+
+    def _reward(self) -> float:
+        return self.success_reward(self.step_count)
+
+    @METRICS.timed('env.reset_grid')
     def reset_grid(self):
 
-        if self.agent_view_size >= self.height:
-            self.see_through_walls = True
-        else:
-            self.see_through_walls = False
+        self.see_through_walls = self.view_sees_through_walls(self.agent_view_size, self.height)
 
         self.carrying = None
         self.step_count = 0
 
         self.grid = Grid(self.width, self.height)
+        self.grid_version += 1
 
         # Place walls around
         for i in range(0, self.height):
@@ -320,6 +354,10 @@ class MultiRoomsGoalsEnv(MiniGridEnv):
     def step(self, action: Actions):
         obs, reward, terminated, truncated, info = super().step(action)
 
+        # Objects of the grid or object carried changed (caches keyed on the version are refreshed)
+        if action in [self.actions.pickup, self.actions.drop, self.actions.toggle]:
+            self.grid_version += 1
+
         if action == self.actions.toggle:
             if self.doors[self.agent_goal-1].is_open:
                 reward = self._reward()
@@ -20,10 +20,13 @@ class BayesianLearner:
                  save_render: bool=False,
                  max_steps: int | None = None,
                  env_type: str='MultiGoalsEnv',
-                 render_mode: str | None="rgb_array"
+                 render_mode: str | None="rgb_array",
+                 rng: np.random.Generator | None = None
                  ) -> None:
         
         self.render_mode = render_mode
+        # Random stream of the learner and its env (tie-breaking, layout generation)
+        self.rng = rng if rng is not None else np.random.default_rng()
 
         self.env_type = env_type
         self.grid_size = grid_size
@@ -92,7 +95,8 @@ class BayesianLearner:
                                     agent_start_dir=agent_start_dir,
                                     agent_view_size=self.receptive_field,
                                     num_colors=num_colors,
-                                    max_steps=self.max_steps)
+                                    max_steps=self.max_steps,
+                                    rng=self.rng)
             
         elif self.env_type == 'MultiRoomsGoalsEnv':
             self.env = MultiRoomsGoalsEnv(render_mode = self.render_mode,
@@ -102,7 +106,8 @@ class BayesianLearner:
                         agent_start_dir=agent_start_dir,
                         agent_view_size=self.receptive_field,
                         num_colors=num_colors,
-                        max_steps=self.max_steps)
+                        max_steps=self.max_steps,
+                        rng=self.rng)
         else:
             raise ValueError('Unknown environment type')
         
@@ -166,6 +171,7 @@ class BayesianLearner:
         self.shortest_path_subgoal = None
         self.shortest_path_goal = None
     
+    @METRICS.timed('BayesianLearner.play')
     def play(self, size: int=None) -> list:
         
         if size is None:
@@ -213,6 +219,7 @@ class BayesianLearner:
         return actions
 
 
+    @METRICS.timed('BayesianLearner.update_beliefs')
     def update_beliefs(self, obs: np.ndarray) -> None:
         f_vec = self.env.dir_vec
         r_vec = self.env.right_vec
@@ -252,38 +259,12 @@ class BayesianLearner:
                     self.beliefs[abs_i, abs_j, :] = np.array([1, 0, 0, 0])
     
     def compute_exploration_score(self, dir: int, pos: tuple) -> float:
-        f_vec = DIR_TO_VEC[dir]
-        dir_vec = DIR_TO_VEC[dir]
-        dx, dy = dir_vec
-        r_vec =  np.array((-dy, dx))
-        top_left = (
-            pos
-            + f_vec * (self.receptive_field - 1)
-            - r_vec * (self.receptive_field // 2)
-        )
+        # Compute what can be seen by the learner (walls always block the view)
+        cells = visible_cells(pos, dir, self.receptive_field, self.env, see_through=False)
         exploration_score = 0
-
-        # Compute what can be seen by the learner
-        topX, topY, _, _ = get_view(pos, dir, self.receptive_field)
-        grid = self.env.grid.slice(topX, topY, self.receptive_field, self.receptive_field)
-        for _ in range(dir + 1):
-            grid = grid.rotate_left()
-        vis_mask = grid.process_vis(agent_pos=(self.receptive_field // 2, self.receptive_field - 1))
-
-        # For each cell in the visibility mask
-        for vis_j in range(0, self.receptive_field):
-            for vis_i in range(0, self.receptive_field):
-
-                if not vis_mask[vis_i, vis_j]:
-                    continue
-
-                # Compute the world coordinates of this cell
-                abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-                if abs_i < 0 or abs_i >= self.env.width:
-                    continue
-                if abs_j < 0 or abs_j >= self.env.height:
-                    continue
-                exploration_score += Shannon_entropy(self.beliefs[abs_i, abs_j, :])
+        # For each visible cell
+        for cell in cells:
+            exploration_score += Shannon_entropy(self.beliefs.reshape(-1, 4)[cell])
 
         return exploration_score
         
@@ -296,7 +277,7 @@ class BayesianLearner:
             dist = np.array([Manhattan_dist(self.env.agent_pos, pos) for pos in zip(unexplored_pos[0], unexplored_pos[1])])
             # Closest unexplored locations
             argmin_set = np.where(np.isclose(dist, np.min(dist)))[0]
-            dest_idx = np.random.choice(argmin_set)
+            dest_idx = self.rng.choice(argmin_set)
             dest_pos = (unexplored_pos[0][dest_idx], unexplored_pos[1][dest_idx])
 
             # Obstacle grid
@@ -309,7 +290,7 @@ class BayesianLearner:
                 if path is None:
                     dist[dest_idx] = 10e10
                     argmin_set = np.where(np.isclose(dist, np.min(dist)))[0]
-                    dest_idx = np.random.choice(argmin_set)
+                    dest_idx = self.rng.choice(argmin_set)
                     dest_pos = (unexplored_pos[0][dest_idx], unexplored_pos[1][dest_idx])
                     grid = np.ones((self.env.width, self.env.height)) - np.all(self.beliefs == np.array([1., 0., 0., 0.]).reshape(1, 1, -1), axis=2)
                     grid[dest_pos[0], dest_pos[1]] = 0
@@ -347,7 +328,7 @@ class BayesianLearner:
 
         # If actions better than the others
         if len(argmax_set) < 3 or forced:
-            return np.random.choice(argmax_set)
+            return self.rng.choice(argmax_set)
         
         # If all the actions are equal --> select closest exploration goal
         else:
@@ -521,6 +502,7 @@ class BayesianLearner:
         # Action that maximizes the exploration
         return self.active_exploration_policy(forced=True)
     
+    @METRICS.timed('BayesianLearner.observe')
     def observe(self, traj: list, render_mode: str | None="rgb_array") -> None:
         if len(traj) > 0:
             # Add first unused action to get the first observation
@@ -11,6 +11,7 @@ sys.path.append('./../')
 
 from learner import BayesianLearner
 from utils import *
+from demo_library import DemoLibrary
 from minigrid.core.constants import OBJECT_TO_IDX
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -26,12 +27,17 @@ def parse_args():
     parser.add_argument('--grid_size_demo', '-gs_demo', type=int, default=45),
     parser.add_argument('--rf_values_basic', '-rf_val', type=list, default=[3,5,7]),
     parser.add_argument('--num_colors', '-nc', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--metrics', type=str, default=None, help='JSON file for the per split call counts and timings')
     args = parser.parse_args()
     return args
 
 if __name__ == '__main__':
     args = parse_args()
 
+    # Root of the random streams: independent streams for each data point
+    seed_seq = np.random.SeedSequence(args.seed)
+
     config_dict = dict(num_train = args.num_train, 
                        num_val = args.num_val, 
                        num_test = args.num_test,
@@ -39,7 +45,8 @@ if __name__ == '__main__':
                        GRID_SIZE_DEMO = args.grid_size_demo,
                        rf_values_basic = args.rf_values_basic,
                        start_idx = args.start_idx,
-                       num_colors=args.num_colors)
+                       num_colors=args.num_colors,
+                       seed=str(seed_seq.entropy))
     
     date = datetime.now().strftime("%m.%d.%Y")
     make_dirs(f'{args.save_folder}/dataset_{date}')
@@ -48,6 +55,11 @@ if __name__ == '__main__':
         json.dump(config_dict, f)
     print(f"Save dataset config in {f'{args.save_folder}/dataset_{date}/dataset_config.json'}")
     
+    # Where the time goes in each split (no overhead if disabled)
+    split_metrics = {}
+    if args.metrics is not None:
+        METRICS.enable()
+
     num_data = [args.num_train, args.num_val, args.num_test]
     names = ['train', 'val', 'test']
 
@@ -67,10 +79,12 @@ if __name__ == '__main__':
                     # for demo_goal_color in range(args.num_colors): 
                     for demo_idx, demo_rf in enumerate(rf_values_demo):
 
+                        obs_rng, demo_rng, data_rng = spawn_rngs(seed_seq, 3)
+
                         # Observation environemnt
                         learner = BayesianLearner(goal_color=goal_color, receptive_field=receptive_field, 
                                                 grid_size=args.grid_size, env_type='MultiGoalsEnv', 
-                                                num_colors=args.num_colors)
+                                                num_colors=args.num_colors, rng=obs_rng)
                         
                         images_obs_env = []
                         actions_obs_env = []
@@ -90,14 +104,14 @@ if __name__ == '__main__':
                         receptive_field = rf_values_demo[rf_idx]
                         learner = BayesianLearner(goal_color=goal_color, receptive_field=receptive_field, 
                                                 grid_size=args.grid_size_demo, env_type='MultiRoomsGoalsEnv',
-                                                num_colors=args.num_colors)
+                                                num_colors=args.num_colors, rng=demo_rng)
                                             
                         # Reset env
                         learner.reset()
                         learner.change_receptive_field(receptive_field)
 
-                        # Generate demo for predicted rf demo_rf (right goal_color)
-                        demo = generate_demo(learner.env, demo_rf, goal_color)
+                        # Generate demo for predicted rf demo_rf (right goal_color) from the analysis of the layout
+                        demo = DemoLibrary(learner.env, num_colors=args.num_colors, rng=data_rng).demo(demo_rf, goal_color)
                         
                         # Learner observes the demonstration
                         learner.observe(demo, render_mode=None)
@@ -122,7 +136,7 @@ if __name__ == '__main__':
 
                             actions_demo_env.append(traj[0])
 
-                        size_init_traj = np.random.randint(1, len(actions_demo_env)-1)
+                        size_init_traj = data_rng.integers(1, len(actions_demo_env)-1)
 
                         query_state = images_demo_env[size_init_traj]
                         futur_traj = actions_demo_env[size_init_traj]
@@ -136,3 +150,7 @@ if __name__ == '__main__':
                             pickle.dump(([(images_obs_env, actions_obs_env), (images_demo, demo), (images_demo_env, actions_demo_env)], futur_traj, query_state), f)
 
                         data_idx += 1
+
+        if METRICS.enabled:
+            split_metrics[name] = METRICS.snapshot(reset=True)
+            METRICS.dump(args.metrics, config=config_dict, splits=split_metrics)
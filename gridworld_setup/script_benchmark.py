@@ -0,0 +1,284 @@
+from __future__ import annotations
+import warnings
+
+import numpy as np
+import argparse
+import time
+
+from typing import Callable
+
+from queue import PriorityQueue
+import heapq
+
+from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
+from learner import BayesianLearner
+from learner_knowledge import LearnerKnowledgeTracker
+from utils import *
+
+warnings.filterwarnings("ignore", category=RuntimeWarning)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser('Benchmark of the planning utilities')
+    parser.add_argument('--bench', type=str, default='astar', choices=['astar', 'distance', 'dynamic', 'layout', 'pose', 'visibility'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[15, 45])
+    parser.add_argument('--num_queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    return args
+
+##
+# Reference implementations (as before the optimisations)
+##
+
+def legacy_A_star_algorithm(start: tuple, goal: tuple, grid: np.ndarray) -> list | None:
+
+    rows, cols = grid.shape
+    visited = np.zeros((rows, cols), dtype=bool)
+
+    parent = {}
+    g_scores = np.inf * np.ones((rows, cols))
+    g_scores[start] = 0
+    f_scores = np.inf * np.ones((rows, cols))
+    f_scores[start] = Manhattan_dist(start, goal)
+
+    queue = PriorityQueue()
+    queue.put((f_scores[start], start))
+
+    while not queue.empty():
+        _, current = queue.get()
+
+        if current == goal:
+            successive_pos = []
+            while current in parent:
+                previous = parent[current]
+                successive_pos.append((previous, current))
+                current = previous
+            return successive_pos[::-1]
+
+        visited[current] = True
+
+        for neighbor in get_neighbors(current, grid):
+            if visited[neighbor]:
+                continue
+
+            g_score = g_scores[current] + 1
+            if g_score < g_scores[neighbor]:
+                parent[neighbor] = current
+                g_scores[neighbor] = g_score
+                f_scores[neighbor] = g_score + Manhattan_dist(neighbor, goal)
+                queue.put((f_scores[neighbor], neighbor))
+
+    return None
+
+def legacy_Dijkstra(grid: np.ndarray, g_x: int, g_y: int) -> np.ndarray:
+    rows, cols = grid.shape
+
+    distance = np.full_like(grid, np.inf)
+    distance[g_x, g_y] = 0
+
+    heap = [(0, g_x, g_y)]
+
+    while heap:
+        dist, x, y = heapq.heappop(heap)
+
+        if dist > distance[x, y]:
+            continue
+
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            nx, ny = x + dx, y + dy
+
+            if 0 <= nx < rows and 0 <= ny < cols and grid[nx, ny] != 1:
+                cost = dist + 1
+                if cost < distance[nx, ny]:
+                    distance[nx, ny] = cost
+                    heapq.heappush(heap, (cost, nx, ny))
+
+    return distance
+
+def legacy_obj_in_view(agent_pos: tuple, agent_dir: int, receptive_field: int, obj_pos: tuple, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> bool:
+
+    _, vis_mask = compute_learner_obs(agent_pos, agent_dir, receptive_field, env)
+
+    f_vec = DIR_TO_VEC[agent_dir]
+    dx, dy = f_vec
+    r_vec =  np.array((-dy, dx))
+    top_left = (
+        agent_pos
+        + f_vec * (receptive_field - 1)
+        - r_vec * (receptive_field // 2)
+    )
+
+    # For each cell in the visibility mask
+    for vis_j in range(0, receptive_field):
+        for vis_i in range(0, receptive_field):
+            
+            if not vis_mask[vis_i, vis_j]:
+                continue
+
+            # Compute the world coordinates of this cell
+            abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
+            if (abs_i, abs_j) == obj_pos:
+                return True
+
+    return False
+
+##
+# Benchmarks
+##
+
+def make_env(size: int) -> MultiGoalsEnv | MultiRoomsGoalsEnv:
+    # Same layouts as the experiments: simple env for observation, rooms env for demonstration
+    if size < 30:
+        env = MultiGoalsEnv(agent_goal=1, agent_view_size=3, size=size, agent_start_pos=(size//2, size-2), agent_start_dir=3, rng=np.random.default_rng(size))
+    else:
+        env = MultiRoomsGoalsEnv(agent_goal=1, agent_view_size=3, size=size, agent_start_pos=(size//2, size-2), agent_start_dir=3, rng=np.random.default_rng(size))
+    env.reset()
+    return env
+
+def make_layout(size: int) -> np.ndarray:
+    obstacle_grid, _, _ = generate_grid(make_env(size))
+    return np.array(obstacle_grid, dtype=float)
+
+def timeit(fun: Callable, queries: list) -> tuple:
+    t0 = time.perf_counter()
+    results = [fun(*q) for q in queries]
+    return time.perf_counter() - t0, results
+
+def bench_astar(size: int, num_queries: int) -> None:
+    grid = make_layout(size)
+    free_cells = np.argwhere(grid == 0)
+    idx = np.random.randint(0, len(free_cells), size=(num_queries, 2))
+    queries = [(tuple(free_cells[a]), tuple(free_cells[b]), grid) for a, b in idx]
+
+    t_legacy, legacy_paths = timeit(legacy_A_star_algorithm, queries)
+    t_new, new_paths = timeit(A_star_algorithm, queries)
+
+    same = all(p == q for p, q in zip(legacy_paths, new_paths))
+    print(f'A* {size}x{size}: legacy {1e3 * t_legacy / num_queries:.3f} ms/query | '
+          f'engine {1e3 * t_new / num_queries:.3f} ms/query | '
+          f'speedup x{t_legacy / t_new:.1f} | same paths {same}')
+
+def bench_distance(size: int, num_queries: int, num_goals: int=8) -> None:
+    grid = make_layout(size)
+    free_cells = np.argwhere(grid == 0)
+    goals = [free_cells[np.random.randint(0, len(free_cells), size=num_goals)] for _ in range(num_queries)]
+
+    t_legacy, legacy_dist = timeit(lambda g: np.stack([legacy_Dijkstra(grid, x, y) for x, y in g]), [(g,) for g in goals])
+    t_single, _ = timeit(lambda g: np.stack([distance_field(grid, x, y) for x, y in g]), [(g,) for g in goals])
+    t_batch, batch_dist = timeit(lambda g: distance_fields(grid, g), [(g,) for g in goals])
+
+    same = all(np.array_equal(np.where(d == UNREACHABLE, np.inf, d), l) for d, l in zip(batch_dist, legacy_dist))
+    print(f'Distance {size}x{size} ({num_goals} goals): legacy {1e3 * t_legacy / num_queries:.3f} ms | '
+          f'BFS {1e3 * t_single / num_queries:.3f} ms (x{t_legacy / t_single:.1f}) | '
+          f'batched BFS {1e3 * t_batch / num_queries:.3f} ms (x{t_legacy / t_batch:.1f}) | same distances {same}')
+
+def bench_dynamic(size: int, num_queries: int, rf_values: list=[3, 5, 7], num_colors: int=4) -> None:
+    # Distance fields to all the keys and doors on the obstacle grid of each rf hypothesis during one observed episode
+    # (at most num_queries steps): full recompute at each change vs repair of the changed cells
+    env_type = 'MultiGoalsEnv' if size < 30 else 'MultiRoomsGoalsEnv'
+    learner = BayesianLearner(goal_color=0, receptive_field=rf_values[0], grid_size=size, env_type=env_type, rng=np.random.default_rng(size))
+    tracker = LearnerKnowledgeTracker(learner.env, rf_values=rf_values)
+    _, _, goals, subgoals = initial_layout(learner.env, num_colors)
+    targets = [tuple(obj) for obj in np.concatenate((goals, subgoals)).astype(int).tolist()]
+
+    fields = None
+    t_full, t_dynamic = 0., 0.
+    num_updates, same = 0, True
+    step = 0
+    while not learner.terminated and step < num_queries:
+        new_cells = tracker.update(learner.env.agent_pos, learner.env.agent_dir, step)
+        grids = [tracker.obstacle_grid(rf_idx) for rf_idx in range(tracker.num_rf)]
+        if fields is None:
+            fields = [[DynamicPoseDistanceField(grid, target) for target in targets] for grid in grids]
+
+        for rf_idx in np.nonzero(new_cells)[0]:
+            t0 = time.perf_counter()
+            stack = np.repeat(grids[rf_idx][None], len(targets), axis=0)
+            for kk, (x, y) in enumerate(targets):
+                stack[kk, x, y] = 0
+            full = pose_distance_fields(stack, targets)
+            t1 = time.perf_counter()
+            for field in fields[rf_idx]:
+                field.sync(grids[rf_idx])
+            t2 = time.perf_counter()
+
+            t_full += t1 - t0
+            t_dynamic += t2 - t1
+            num_updates += 1
+            same &= all(np.array_equal(field.distance, full[kk]) for kk, field in enumerate(fields[rf_idx]))
+
+        learner.play(size=1)
+        step += 1
+
+    num_repaired = np.mean([field.num_repaired_states / max(field.num_repairs, 1) for rf_fields in fields for field in rf_fields])
+    print(f'Dynamic {size}x{size} ({step} steps, {num_updates} updates, {len(targets)} targets): '
+          f'full recompute {1e3 * t_full / num_updates:.3f} ms/update | '
+          f'repair {1e3 * t_dynamic / num_updates:.3f} ms/update (x{t_full / t_dynamic:.1f}, {num_repaired:.0f} states/field) | same distances {same}')
+
+def bench_layout(size: int, num_queries: int) -> None:
+    grid = make_layout(size)
+    free_cells = np.argwhere(grid == 0)
+    idx = np.random.randint(0, len(free_cells), size=(num_queries, 2))
+    queries = [(tuple(free_cells[a]), tuple(free_cells[b])) for a, b in idx]
+
+    t_build = time.perf_counter()
+    layout = LayoutAnalysis(grid)
+    t_build = time.perf_counter() - t_build
+
+    engine = AStar(grid.shape)
+    t_astar, astar_paths = timeit(lambda s, g: engine.search(s, g, grid), queries)
+    t_table, table_paths = timeit(layout.straight_path, queries)
+
+    same = all(len(p) == len(q) for p, q in zip(astar_paths, table_paths))
+    print(f'Layout {size}x{size} ({layout.num_free} free cells): build {1e3 * t_build:.1f} ms, '
+          f'{layout.distances.nbytes / 2**20:.1f} MB | A* {1e3 * t_astar / num_queries:.3f} ms/path | '
+          f'table {1e3 * t_table / num_queries:.3f} ms/path (x{t_astar / t_table:.1f}) | same lengths {same}')
+
+def bench_pose(size: int, num_queries: int, num_goals: int=8) -> None:
+    grid = make_layout(size)
+    free_cells = np.argwhere(grid == 0)
+    goals = [free_cells[np.random.randint(0, len(free_cells), size=num_goals)] for _ in range(num_queries)]
+
+    t_pos, pos_dist = timeit(lambda g: distance_fields(grid, g), [(g,) for g in goals])
+    t_pose, pose_dist = timeit(lambda g: pose_distance_fields(grid, g), [(g,) for g in goals])
+
+    # Entering a cell takes at least as many actions as cells on the path
+    consistent = all(np.all(pose.min(axis=1) >= pos) for pos, pose in zip(pos_dist, pose_dist))
+    print(f'Pose {size}x{size} ({num_goals} goals): positions {1e3 * t_pos / num_queries:.3f} ms | '
+          f'(x, y, dir) states {1e3 * t_pose / num_queries:.3f} ms | consistent {consistent}')
+
+def bench_visibility(size: int, num_queries: int, rf_values: list=[3, 5, 7]) -> None:
+    env = make_env(size)
+    free_cells = np.argwhere(make_layout(size) == 0)
+    # Walk-like queries: a few positions seen many times (as in generate_traj and the teachers)
+    idx = np.random.randint(0, len(free_cells), size=num_queries // 10 + 1)
+    queries = [(tuple(free_cells[idx[q % len(idx)]]), q % 4, rf_values[q % len(rf_values)], tuple(free_cells[np.random.randint(0, len(free_cells))]), env)
+               for q in range(num_queries)]
+
+    t_legacy, legacy_vis = timeit(legacy_obj_in_view, queries)
+    t_atlas, atlas_vis = timeit(obj_in_view, queries)
+
+    same = legacy_vis == atlas_vis
+    print(f'Visibility {size}x{size}: legacy {1e3 * t_legacy / num_queries:.3f} ms/query | '
+          f'atlas {1e3 * t_atlas / num_queries:.3f} ms/query (x{t_legacy / t_atlas:.1f}) | '
+          f'{get_visibility_atlas(env).stats()} | same {same}')
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    np.random.seed(args.seed)
+
+    for size in args.sizes:
+        if args.bench == 'astar':
+            bench_astar(size, args.num_queries)
+        elif args.bench == 'distance':
+            bench_distance(size, args.num_queries)
+        elif args.bench == 'dynamic':
+            bench_dynamic(size, args.num_queries)
+        elif args.bench == 'layout':
+            bench_layout(size, args.num_queries)
+        elif args.bench == 'pose':
+            bench_pose(size, args.num_queries)
+        elif args.bench == 'visibility':
+            bench_visibility(size, args.num_queries)
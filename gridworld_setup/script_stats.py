@@ -7,11 +7,15 @@ import argparse
 
 from tqdm import trange
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 from learner import BayesianLearner
 from bayesian_ToM.bayesian_teacher import AlignedBayesianTeacher, BayesianTeacher
 from utils import *
 from utils_viz import *
+from demo_library import DemoLibrary
+from learner_knowledge import LearnerKnowledgeTracker
+from reward_memo import RewardMemo
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
@@ -23,7 +27,18 @@ def parse_args():
     parser.add_argument('--alpha', type=float, default=0.8)
     parser.add_argument('--max_obs', type=int, default=-1)
     parser.add_argument('--num_trials', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--metrics', type=str, default=None, help='JSON file for the per trial call counts and timings (those of the workers included)')
+    parser.add_argument('--num_workers', type=int, default=0, help='Processes evaluating the demos (0: sequential)')
+    parser.add_argument('--reward_memo', type=str, default=None, help='sqlite file of the predicted rewards (reused by the runs with the same seed)')
+    parser.add_argument('--policy_table_size', type=int, default=0, help='Learner policies kept by each teacher (0: no table, hits/misses in the metrics)')
+    parser.add_argument('--prefix_trie', type=int, default=1, help='Demos sharing a prefix observed once by the teachers (0: one rollout per demo from scratch)')
+    parser.add_argument('--belief_epsilon', type=float, default=0., help='Hypotheses of the Boltzmann teacher pruned below this belief (0: exact posterior)')
+    parser.add_argument('--num_samples', type=int, default=1, help='Rollouts of the Boltzmann teacher per demo and hypothesis (maximum with --racing)')
+    parser.add_argument('--racing', type=int, default=0, help='Demos of the Boltzmann teacher raced on paired rollouts, the worst ones eliminated early (needs --num_samples >= 2)')
     args = parser.parse_args()
+    if args.racing and args.num_samples < 2:
+        parser.error('--racing needs --num_samples >= 2')
     return args
 
 if __name__ == '__main__':
@@ -65,6 +80,23 @@ if __name__ == '__main__':
     make_dirs(save_folder)
     save_filename = save_folder + f'/obs_{GRID_SIZE}_demo_{GRID_SIZE_DEMO}_norm_linear_{alpha}_max_obs_{max_obs}_num_trials_{N}_{date}.pickle'
 
+    # Root of the random streams: one independent stream per trial (print the entropy to replay the run)
+    seed_seq = np.random.SeedSequence(args.seed)
+    print(f'Seed {seed_seq.entropy}')
+
+    # Demos evaluated in worker processes (same results as the sequential evaluation)
+    pool = ProcessPoolExecutor(args.num_workers) if args.num_workers > 0 else None
+
+    # Predicted rewards of the previous runs (resumed sweeps only simulate the new tasks)
+    reward_memo = RewardMemo(args.reward_memo) if args.reward_memo is not None else None
+    if reward_memo is not None:
+        METRICS.add_source('reward_memo', reward_memo.stats)
+
+    # Where the time goes in each trial (no overhead if disabled)
+    trial_metrics = []
+    if args.metrics is not None:
+        METRICS.enable()
+
     DICT_UTIL = {}
     DICT_UTIL[lambd] = {}
     DICT_UTIL['omniscient'] = {}
@@ -85,12 +117,21 @@ if __name__ == '__main__':
             DICT_UTIL['uniform_sampling'][goal_color, receptive_field] = []
             DICT_UTIL['uniform_model'][goal_color, receptive_field] = []
 
-            for _ in trange(N):
+            trial_seqs = seed_seq.spawn(N)
+            for trial in trange(N):
+                # One stream per consumer (the first four streams are the ones of the previous versions)
+                learner_rng, demo_learner_rng, teacher_rng, baseline_rng, aligned_teacher_rng, demo_library_rng = spawn_rngs(trial_seqs[trial], 6)
                 # print(f'Learner: rf={receptive_field} goal_color={IDX_TO_COLOR[goal_color+1]}')
                 # Test teacher utility
-                learner = BayesianLearner(goal_color=goal_color, receptive_field=receptive_field, grid_size=GRID_SIZE, env_type='MultiGoalsEnv')
-                teacher = BayesianTeacher(env=learner.env, lambd=lambd, rf_values=rf_values_basic)
-                aligned_teacher = AlignedBayesianTeacher(env=learner.env, rf_values=rf_values_basic)
+                learner = BayesianLearner(goal_color=goal_color, receptive_field=receptive_field, grid_size=GRID_SIZE, env_type='MultiGoalsEnv', rng=learner_rng)
+                # Both teachers observe the same learner: what it knows about the env is tracked once for both
+                knowledge_tracker = LearnerKnowledgeTracker(learner.env, rf_values=rf_values_basic)
+                teacher = BayesianTeacher(env=learner.env, lambd=lambd, rf_values=rf_values_basic, rng=teacher_rng, knowledge_tracker=knowledge_tracker,
+                                          reward_memo=reward_memo, policy_table_size=args.policy_table_size,
+                                          belief_epsilon=args.belief_epsilon, prefix_trie=bool(args.prefix_trie))
+                aligned_teacher = AlignedBayesianTeacher(env=learner.env, rf_values=rf_values_basic, rng=aligned_teacher_rng, knowledge_tracker=knowledge_tracker,
+                                                         reward_memo=reward_memo, policy_table_size=args.policy_table_size,
+                                                         prefix_trie=bool(args.prefix_trie))
 
                 # Teacher observes the learner during one full episode on the first simple env
                 ii = 0
@@ -105,8 +146,7 @@ if __name__ == '__main__':
                     agent_dir = learner.env.agent_dir
                     learner_dir_list.append(agent_dir)
 
-                    teacher.update_knowledge(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
-                    aligned_teacher.update_knowledge(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
+                    knowledge_tracker.update(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
 
                     traj = learner.play(size=1)
                     learner_action_list.append(traj[0])
@@ -118,28 +158,19 @@ if __name__ == '__main__':
 
                 # Teacher use ToM to predict the utility of each demo for this particular learner --> select the more relevant demo
                 learner = BayesianLearner(goal_color=goal_color, receptive_field=rf_values_demo[rf_idx], \
-                                        grid_size=GRID_SIZE_DEMO, env_type='MultiRoomsGoalsEnv')
+                                        grid_size=GRID_SIZE_DEMO, env_type='MultiRoomsGoalsEnv', rng=demo_learner_rng)
                 aligned_teacher.init_env(learner.env)
                 teacher.init_env(learner.env)
                 
-                # Compute all the demonstrations
-                all_demos = []
-                l_max = 0
-                # Random demos
-                for n_obj in range(3, 9):
-                    demo = generate_random_demo(learner.env, n_obj=n_obj)
-                    all_demos.append(demo)
-                    l_max = np.max([len(demo), l_max])
-                # Learner-specific demos
-                for gc in range(num_colors):
-                    for rf in rf_values_demo[:-1]:
-                        demo = generate_demo(learner.env, rf, gc)
-                        all_demos.append(demo)
-                        l_max = np.max([len(demo), l_max])
-                all_demos.append([]) # Full obs
+                # Compute all the demonstrations from one analysis of the layout (same list as the demos built one by one)
+                demo_library = DemoLibrary(learner.env, num_colors=num_colors, rng=demo_library_rng)
+                # Random demos, learner-specific demos and full obs (no demo)
+                all_demos = demo_library.build(rf_values=rf_values_demo[:-1], n_obj_values=range(3, 9))
+                l_max = np.max(demo_library.lengths)
 
                 ## Rationality principle teacher
-                selected_demo, demo_idx, predicted_best_utility, demos = teacher.select_demo(l_max, cost_fun, all_demos)
+                selected_demo, demo_idx, predicted_best_utility, demos = teacher.select_demo(l_max, cost_fun, all_demos, demo_library=demo_library, pool=pool,
+                                                                                             num_samples=args.num_samples, racing=bool(args.racing))
 
                 # Learner "observes" the demo
                 learner.observe(selected_demo)
@@ -157,10 +188,12 @@ if __name__ == '__main__':
                 true_utility = np.zeros((num_colors, len(rf_values_demo), len(all_demos)))
                 true_reward = np.zeros((num_colors, len(rf_values_demo), len(all_demos)))
 
+                tasks = [(demo, gc, ii) for gc in range(num_colors) for ii, rf in enumerate(rf_values_demo) for demo in all_demos]
+                rewards = iter(aligned_teacher.predicted_rewards(tasks, pool))
                 for gc in range(num_colors):
                     for ii, rf in enumerate(rf_values_demo):
                         for jj, demo in enumerate(all_demos):
-                            reward = aligned_teacher.predicted_reward(demo, gc, ii)
+                            reward = next(rewards)
 
                             true_reward[gc, ii, jj] = reward
                             true_utility[gc, ii, jj] = reward - cost_fun(len(demo), l_max)
@@ -196,14 +229,14 @@ if __name__ == '__main__':
                 DICT_UTIL['reward_opt_non_adaptive'][goal_color, receptive_field].append(utility)
 
                 ## Uniform sample
-                selected_demo_idx = np.random.randint(0, len(all_demos))
+                selected_demo_idx = baseline_rng.integers(0, len(all_demos))
 
                 utility = true_utility[goal_color, rf_idx, selected_demo_idx]
                 DICT_UTIL['uniform_sampling'][goal_color, receptive_field].append(utility)
 
                 ## Uniform model
-                pred_goal = np.random.randint(0, num_colors)
-                pred_rf_idx = np.random.randint(0, len(rf_values))
+                pred_goal = baseline_rng.integers(0, num_colors)
+                pred_rf_idx = baseline_rng.integers(0, len(rf_values))
                 pred_rf = rf_values_demo[pred_rf_idx]
 
                 selected_demo_idx = np.argmax(true_utility[pred_goal, pred_rf_idx, :])
@@ -211,5 +244,15 @@ if __name__ == '__main__':
                 utility = true_utility[goal_color, rf_idx, selected_demo_idx]
                 DICT_UTIL['uniform_model'][goal_color, receptive_field].append(utility)
 
+                if METRICS.enabled:
+                    trial_metrics.append(dict(goal_color=goal_color, receptive_field=int(receptive_field), trial=trial, **METRICS.snapshot(reset=True)))
+
             with open(save_filename, 'wb') as f:
-                    pickle.dump(DICT_UTIL, f)
\ No newline at end of file
+                    pickle.dump(DICT_UTIL, f)
+            if METRICS.enabled:
+                METRICS.dump(args.metrics, trials=trial_metrics)
+
+    if pool is not None:
+        pool.shutdown()
+    if reward_memo is not None:
+        reward_memo.close()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Same imports as the scripts: the tools and the gridworld_setup modules are imported by name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'tools'), ROOT]
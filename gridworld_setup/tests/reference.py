@@ -0,0 +1,333 @@
+import numpy as np
+import copy
+import heapq
+from collections import deque
+from queue import PriorityQueue
+
+from minigrid.core.constants import DIR_TO_VEC
+from minigrid.core.actions import Actions
+
+# Unchanged since the first version
+from utils import get_view, map_actions
+
+##
+# Reference implementations of the first version of the planning utilities (the optimized ones must agree with them)
+##
+
+def Manhattan_dist(position, goal):
+    return abs(position[0] - goal[0]) + abs(position[1] - goal[1])
+
+def get_neighbors(position, grid):
+    rows, cols = grid.shape
+    i, j = position
+    neighbors = []
+    for action in [(-1, 0), (1, 0), (0, 1), (0, -1)]:
+        new_i = i + action[0]
+        new_j = j + action[1]
+        if 0 <= new_i < rows and 0 <= new_j < cols and grid[new_i, new_j] != 1:
+            neighbors.append((new_i, new_j))
+    return neighbors
+
+def A_star_algorithm(start: tuple, goal: tuple, grid: np.ndarray) -> list | None:
+    rows, cols = grid.shape
+    visited = np.zeros((rows, cols), dtype=bool)
+
+    parent = {}
+    g_scores = np.inf * np.ones((rows, cols))
+    g_scores[start] = 0
+    f_scores = np.inf * np.ones((rows, cols))
+    f_scores[start] = Manhattan_dist(start, goal)
+
+    queue = PriorityQueue()
+    queue.put((f_scores[start], start))
+
+    while not queue.empty():
+        _, current = queue.get()
+
+        if current == goal:
+            successive_pos = []
+            while current in parent:
+                previous = parent[current]
+                successive_pos.append((previous, current))
+                current = previous
+            return successive_pos[::-1]
+
+        visited[current] = True
+
+        for neighbor in get_neighbors(current, grid):
+            if visited[neighbor]:
+                continue
+
+            g_score = g_scores[current] + 1
+            if g_score < g_scores[neighbor]:
+                parent[neighbor] = current
+                g_scores[neighbor] = g_score
+                f_scores[neighbor] = g_score + Manhattan_dist(neighbor, goal)
+                queue.put((f_scores[neighbor], neighbor))
+
+    return None
+
+def Dijkstra(grid: np.ndarray, g_x: int, g_y: int) -> np.ndarray:
+    rows, cols = grid.shape
+
+    distance = np.full_like(grid, np.inf, dtype=float)
+    distance[g_x, g_y] = 0
+
+    heap = [(0, g_x, g_y)]
+    while heap:
+        dist, x, y = heapq.heappop(heap)
+        if dist > distance[x, y]:
+            continue
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < rows and 0 <= ny < cols and grid[nx, ny] != 1:
+                cost = dist + 1
+                if cost < distance[nx, ny]:
+                    distance[nx, ny] = cost
+                    heapq.heappush(heap, (cost, nx, ny))
+
+    return distance
+
+def random_grids(seed: int, num_grids: int, size: int=12, density: float=0.3) -> list:
+    rng = np.random.default_rng(seed)
+    return [(rng.random((size, size)) < density).astype(float) for _ in range(num_grids)]
+
+def compute_opt_length(env, goal_color: int) -> int:
+    prev_agent_view_size = env.agent_view_size
+
+    gridsize = env.height
+    env.agent_view_size = gridsize
+    env.reset_grid()
+
+    env_image = np.ones((gridsize, gridsize))
+    obs = env.grid.encode(np.ones((gridsize, gridsize)))
+    for abs_j in range(0, gridsize):
+        for abs_i in range(0, gridsize):
+            color_idx = obs[abs_i, abs_j, 1]
+            if obs[abs_i, abs_j, 0] == 4 and color_idx == goal_color + 1:
+                value = 3
+                goal_pos = (abs_i, abs_j)
+            elif obs[abs_i, abs_j, 0] == 5 and color_idx == goal_color + 1:
+                value = 2
+                subgoal_pos = (abs_i, abs_j)
+            elif obs[abs_i, abs_j, 0] in [2, 5, 4]:
+                value = 1
+            else:
+                value = 0
+            env_image[abs_i, abs_j] = value
+
+    obstacle_grid = (env_image == 1)
+    obstacle_grid[goal_pos[0], goal_pos[1]] = 1
+
+    length_opt_path = 0
+    agent_dir = env.agent_start_dir
+    path_subgoal = A_star_algorithm(env.agent_start_pos, subgoal_pos, obstacle_grid)
+    obstacle_grid[goal_pos[0], goal_pos[1]] = 0
+    path_goal = A_star_algorithm(subgoal_pos, goal_pos, obstacle_grid)
+    for path in (path_subgoal, path_goal):
+        for trans in path:
+            for a in map_actions(trans[0], trans[1], agent_dir):
+                if a == 0:
+                    agent_dir = (agent_dir - 1) % 4
+                elif a == 1:
+                    agent_dir = (agent_dir + 1) % 4
+                length_opt_path += 1
+
+    env.agent_view_size = prev_agent_view_size
+    env.reset_grid()
+
+    return length_opt_path
+
+def obj_in_view(agent_pos: tuple, agent_dir: int, receptive_field: int, obj_pos: tuple, env) -> bool:
+    topX, topY, _, _ = get_view(agent_pos, agent_dir, receptive_field)
+
+    grid = env.grid.slice(topX, topY, receptive_field, receptive_field)
+    for _ in range(agent_dir + 1):
+        grid = grid.rotate_left()
+
+    if env.see_through_walls:
+        vis_mask = np.ones(shape=(grid.width, grid.height), dtype=bool)
+    else:
+        vis_mask = grid.process_vis(agent_pos=(receptive_field // 2, receptive_field - 1))
+
+    f_vec = DIR_TO_VEC[agent_dir]
+    dx, dy = DIR_TO_VEC[agent_dir]
+    r_vec = np.array((-dy, dx))
+    top_left = agent_pos + f_vec * (receptive_field - 1) - r_vec * (receptive_field // 2)
+
+    for vis_j in range(0, receptive_field):
+        for vis_i in range(0, receptive_field):
+            if not vis_mask[vis_i, vis_j]:
+                continue
+            abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
+            if (abs_i, abs_j) == obj_pos:
+                return True
+    return False
+
+def generate_grid(env, num_colors: int=4) -> tuple:
+    gridsize = env.height
+    env_image = np.ones((gridsize, gridsize))
+    obs = env.grid.encode(np.ones((gridsize, gridsize)))
+
+    subgoals_pos = np.zeros((num_colors, 2))
+    goals_pos = np.zeros((num_colors, 2))
+    for abs_j in range(0, gridsize):
+        for abs_i in range(0, gridsize):
+            color_idx = obs[abs_i, abs_j, 1]
+            if obs[abs_i, abs_j, 0] == 4:
+                value = 3
+                goals_pos[color_idx - 1, :] = (abs_i, abs_j)
+            elif obs[abs_i, abs_j, 0] == 5:
+                value = 2
+                subgoals_pos[color_idx - 1, :] = (abs_i, abs_j)
+            elif obs[abs_i, abs_j, 0] in [2, 5, 4]:
+                value = 1
+            else:
+                value = 0
+            env_image[abs_i, abs_j] = value
+    return (env_image != 0), goals_pos, subgoals_pos
+
+def generate_traj(env, dest_pos: tuple, rf: int, grid: np.ndarray) -> list:
+    obstacle_grid = grid.copy()
+    obstacle_grid[dest_pos[0], dest_pos[1]] = 0
+    path = A_star_algorithm(env.agent_pos, dest_pos, obstacle_grid)
+
+    traj = []
+    ii = 0
+    while not obj_in_view(env.agent_pos, env.agent_dir, rf, dest_pos, env):
+        transition = path[ii]
+        for a in map_actions(env.agent_pos, transition[1], env.agent_dir):
+            env.step(Actions(a))
+            traj.append(a)
+            if obj_in_view(env.agent_pos, env.agent_dir, rf, dest_pos, env):
+                break
+        ii += 1
+    return traj
+
+def generate_demo(env, rf: int, goal_color: int) -> list:
+    prev_agent_view_size = env.agent_view_size
+
+    env.agent_view_size = env.height
+    env.reset_grid()
+    obstacle_grid, goals, subgoals = generate_grid(env)
+    goal_pos = tuple(goals[goal_color, :].astype(int))
+    subgoal_pos = tuple(subgoals[goal_color, :].astype(int))
+
+    env.agent_view_size = rf
+    env.reset_grid()
+
+    subgoal_dist = Dijkstra(np.array(obstacle_grid, dtype='float'), subgoal_pos[0], subgoal_pos[1])[env.agent_pos[0], env.agent_pos[0]]
+    goal_dist = Dijkstra(np.array(obstacle_grid, dtype='float'), goal_pos[0], goal_pos[1])[env.agent_pos[0], env.agent_pos[0]]
+    goals_order = [subgoal_pos, goal_pos] if subgoal_dist < goal_dist else [goal_pos, subgoal_pos]
+
+    traj = []
+    for g in goals_order:
+        traj += generate_traj(env, dest_pos=g, rf=rf, grid=obstacle_grid)
+
+    env.agent_view_size = prev_agent_view_size
+    env.reset_grid()
+    return traj
+
+##
+# Brute-force searches stepping the env (ground truth of the action-count distances)
+##
+
+def pose_distances(env, goal: tuple) -> np.ndarray:
+    # (4, H, W) number of turn left / turn right / forward actions of the env from each state [dir, x, y] to enter the goal cell
+    # (moving forward into the goal cell when it is an object), UNREACHABLE (np.iinfo(np.int16).max) if it cannot be entered
+    env = copy.deepcopy(env)
+    env.gen_obs = lambda: None
+    unreachable = np.iinfo(np.int16).max
+    states = [(x, y, dir) for x in range(env.width) for y in range(env.height) for dir in range(4)
+              if env.grid.get(x, y) is None or (x, y) == tuple(goal)]
+    successors = {}
+    for x, y, dir in states:
+        successors[(x, y, dir)] = []
+        for action in (Actions.left, Actions.right, Actions.forward):
+            env.agent_pos, env.agent_dir, env.step_count = (x, y), dir, 0
+            front = tuple(env.front_pos)
+            if (x, y) != tuple(goal):
+                env.step(action)
+            if action == Actions.forward and front == tuple(goal):
+                successors[(x, y, dir)].append(None)
+            else:
+                successors[(x, y, dir)].append((*env.agent_pos, env.agent_dir))
+
+    distance = np.full((4, env.width, env.height), unreachable, dtype=np.int16)
+    for x, y, dir in states:
+        # BFS from the state until the goal cell is entered
+        seen, queue = {(x, y, dir)}, deque([((x, y, dir), 0)])
+        while queue:
+            state, dist = queue.popleft()
+            if state is None or state[:2] == tuple(goal):
+                distance[dir, x, y] = dist
+                break
+            for next_state in successors[state]:
+                if next_state not in seen:
+                    seen.add(next_state)
+                    queue.append((next_state, dist + 1))
+    return distance
+
+def min_actions(env, goal_color: int) -> int | None:
+    # Minimal number of actions (turn left / turn right / forward / pickup / toggle) to open the door of goal_color from the start
+    # state of the env, BFS over the states of the env (None if it cannot be opened)
+    env = copy.deepcopy(env)
+    env.agent_goal = goal_color + 1
+    env.reset_grid()
+    env.max_steps = np.iinfo(np.int32).max
+    env.gen_obs = lambda: None
+    # The grids are only copied when an object can change (pickup, toggle)
+    start = (tuple(env.agent_start_pos), env.agent_start_dir, (env.grid, None, env.doors))
+    seen, queue = set(), deque([(start, 0)])
+    while queue:
+        (pos, dir, objects), dist = queue.popleft()
+        for action in (Actions.left, Actions.right, Actions.forward, Actions.pickup, Actions.toggle):
+            env.grid, env.carrying, env.doors = objects if action in (Actions.left, Actions.right, Actions.forward) else copy.deepcopy(objects)
+            env.agent_pos, env.agent_dir, env.step_count = pos, dir, 0
+            _, _, terminated, _, _ = env.step(action)
+            if terminated:
+                return dist + 1
+            key = (tuple(env.agent_pos), env.agent_dir, env.grid.encode().tobytes(), None if env.carrying is None else env.carrying.color)
+            if key not in seen:
+                seen.add(key)
+                queue.append(((tuple(env.agent_pos), env.agent_dir, (env.grid, env.carrying, env.doors)), dist + 1))
+    return None
+
+def make_env(env_type: str, size: int, seed: int, agent_view_size: int=3):
+    # Env with the objects placed by a seeded first reset (same as the learners of the experiments)
+    from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
+    env_class = MultiGoalsEnv if env_type == 'MultiGoalsEnv' else MultiRoomsGoalsEnv
+    env = env_class(agent_goal=1, agent_view_size=agent_view_size, size=size, rng=np.random.default_rng(seed))
+    env.reset()
+    return env
+
+# Layouts of the checks: simple env (observation) and rooms env (demonstration)
+ENV_CONFIGS = [('MultiGoalsEnv', 15), ('MultiRoomsGoalsEnv', 45)]
+# Small layouts of the brute-force searches
+SMALL_ENV_CONFIGS = [('MultiGoalsEnv', 7), ('MultiGoalsEnv', 9), ('MultiRoomsGoalsEnv', 11)]
+
+def observed_teachers(seed: int, num_obs: int=8, demo_env_type: str='MultiRoomsGoalsEnv', demo_size: int=15, **teacher_kwargs) -> tuple:
+    # Both teachers after observing a learner on a simple env, then moved to a demonstration env
+    from learner import BayesianLearner
+    from learner_knowledge import LearnerKnowledgeTracker
+    from bayesian_ToM.bayesian_teacher import BayesianTeacher, AlignedBayesianTeacher
+    from utils import spawn_rngs
+
+    learner_rng, demo_learner_rng, teacher_rng, aligned_teacher_rng = spawn_rngs(seed, 4)
+    learner = BayesianLearner(goal_color=seed % 4, receptive_field=5, grid_size=15, rng=learner_rng)
+    tracker = LearnerKnowledgeTracker(learner.env, rf_values=[3, 5, 7])
+    teacher = BayesianTeacher(env=learner.env, lambd=0.01, rf_values=[3, 5, 7], rng=teacher_rng, knowledge_tracker=tracker, **teacher_kwargs)
+    aligned_teacher = AlignedBayesianTeacher(env=learner.env, rf_values=[3, 5, 7], rng=aligned_teacher_rng, knowledge_tracker=tracker,
+                                             **{k: v for k, v in teacher_kwargs.items() if k != 'belief_epsilon'})
+    ii = 0
+    while not learner.terminated and ii < num_obs:
+        tracker.update(learner_pos=learner.env.agent_pos, learner_dir=learner.env.agent_dir, learner_step_count=ii)
+        action = learner.play(size=1)[0]
+        teacher.observe(action)
+        aligned_teacher.observe(action)
+        ii += 1
+
+    demo_learner = BayesianLearner(goal_color=1, receptive_field=5, grid_size=demo_size, env_type=demo_env_type, rng=demo_learner_rng)
+    teacher.init_env(demo_learner.env)
+    aligned_teacher.init_env(demo_learner.env)
+    return teacher, aligned_teacher, demo_learner.env
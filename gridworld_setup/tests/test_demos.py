@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import reference
+from layout import LayoutAnalysis
+from demo_library import DemoLibrary
+from utils import generate_demo, generate_demo_all, initial_layout, synthesize_traj, get_layout_atlas
+
+@pytest.mark.parametrize('env_type, size', reference.ENV_CONFIGS)
+@pytest.mark.parametrize('rf', [3, 5])
+def test_demos_match_reference(env_type, size, rf):
+    env = reference.make_env(env_type, size, seed=2)
+    obstacle_grid, _, _, _ = initial_layout(env)
+    layout = LayoutAnalysis(obstacle_grid)
+    library = DemoLibrary(env, layout=layout)
+    for goal_color in range(4):
+        expected = reference.generate_demo(env, rf, goal_color)
+        assert generate_demo(env, rf, goal_color) == expected
+        assert generate_demo(env, rf, goal_color, layout=layout) == expected
+        assert library.demo(rf, goal_color) == expected
+    # (the first version of generate_demo_all loops forever when an object is not reachable from (x, x))
+    expected = generate_demo_all(env, rf)
+    assert generate_demo_all(env, rf, layout=layout) == expected
+    assert library.demo_all(rf) == expected
+
+def test_demo_full_view_sees_through_walls():
+    # A view as large as the grid sees through the walls (as the env does)
+    env = reference.make_env('MultiRoomsGoalsEnv', 15, seed=3)
+    for goal_color in range(4):
+        assert generate_demo(env, 15, goal_color) == reference.generate_demo(env, 15, goal_color)
+
+def test_unreachable_object_raises():
+    obstacle_grid = np.zeros((7, 7), dtype=bool)
+    obstacle_grid[:, 3] = True
+    atlas = get_layout_atlas(obstacle_grid)
+    with pytest.raises(ValueError):
+        synthesize_traj(obstacle_grid, atlas, ((1, 1), 0), (5, 5), 3, False)
+
+@pytest.mark.parametrize('dedupe', [False, True])
+def test_library_build_order(dedupe):
+    env = reference.make_env('MultiRoomsGoalsEnv', 25, seed=7)
+    rf_values = [3, 5, 7]
+    library = DemoLibrary(env, rng=np.random.default_rng(8), dedupe=dedupe)
+    demos = library.build(rf_values=rf_values, n_obj_values=range(3, 9))
+    random_demos = demos[:6]
+    expected = random_demos + [generate_demo(env, rf, goal_color) for goal_color in range(4) for rf in rf_values] + [[]]
+    if dedupe:
+        unique = []
+        for demo in expected:
+            if demo not in unique:
+                unique.append(demo)
+        expected = unique
+    assert demos == expected
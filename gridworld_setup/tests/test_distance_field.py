@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import reference
+from layout import LayoutAnalysis
+from distance_field import UNREACHABLE, DynamicPoseDistanceField, distance_field, distance_fields, pose_distance_fields
+from utils import Dijkstra, initial_layout
+
+def as_dijkstra(distance: np.ndarray) -> np.ndarray:
+    # Distances as the reference (float, np.inf for the unreachable cells)
+    distance = distance.astype(float)
+    distance[distance == UNREACHABLE] = np.inf
+    return distance
+
+def test_distance_fields_match_dijkstra():
+    for grid in reference.random_grids(1, 40):
+        rng = np.random.default_rng(int(grid.sum()))
+        # Goals on free cells and on obstacles (the goal is the source even when it is an obstacle)
+        goals = rng.integers(0, grid.shape[0], size=(5, 2))
+        fields = distance_fields(grid, goals)
+        for (g_x, g_y), field in zip(goals.tolist(), fields):
+            expected = reference.Dijkstra(grid, g_x, g_y)
+            assert np.array_equal(as_dijkstra(field), expected)
+            assert np.array_equal(as_dijkstra(distance_field(grid, g_x, g_y)), expected)
+            assert np.array_equal(Dijkstra(grid, g_x, g_y), expected)
+
+@pytest.mark.parametrize('env_type, size', reference.ENV_CONFIGS)
+def test_layout_distance_fields_match_dijkstra(env_type, size):
+    env = reference.make_env(env_type, size, seed=1)
+    obstacle_grid, _, goals, subgoals = initial_layout(env)
+    layout = LayoutAnalysis(obstacle_grid)
+    objects = np.concatenate((goals, subgoals)).astype(int)
+    grid = obstacle_grid.astype(float)
+    for obj, field in zip(objects.tolist(), layout.distance_fields(objects)):
+        assert np.array_equal(as_dijkstra(field), reference.Dijkstra(grid, *obj))
+
+def test_dynamic_pose_distance_field_matches_recomputation():
+    for grid in reference.random_grids(2, 20, size=10):
+        rng = np.random.default_rng(int(grid.sum()))
+        goal = tuple(rng.integers(0, grid.shape[0], size=2).tolist())
+        field = DynamicPoseDistanceField(grid, goal)
+        assert np.array_equal(field.distance, pose_distance_fields(grid, [goal])[0])
+        for _ in range(10):
+            # Random cells blocked or opened, sometimes the goal cell (always the source)
+            cells = rng.integers(0, grid.shape[0], size=(rng.integers(1, 6), 2))
+            if rng.random() < 0.2:
+                cells[0] = goal
+            new_grid = grid.copy()
+            new_grid[cells[:, 0], cells[:, 1]] = rng.random(len(cells)) < 0.5
+            if rng.random() < 0.5:
+                field.sync(new_grid)
+            else:
+                # Only the listed cells are repaired: the cells changed out of the list are not seen until a sync
+                listed = cells[:max(1, len(cells) - 1)]
+                field.update(listed, new_grid)
+                seen_grid = grid.copy()
+                seen_grid[listed[:, 0], listed[:, 1]] = new_grid[listed[:, 0], listed[:, 1]]
+                assert np.array_equal(field.distance, pose_distance_fields(seen_grid, [goal])[0])
+                field.sync(new_grid)
+            grid = new_grid
+            assert np.array_equal(field.distance, pose_distance_fields(grid, [goal])[0])
+            assert field.dist == field.distance.reshape(-1).tolist()
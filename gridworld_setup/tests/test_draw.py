@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from utils import draw, draw_batch
+
+def test_draw_batch_matches_draw():
+    rng = np.random.default_rng(0)
+    proba_dists = rng.dirichlet(np.ones(6), size=50)
+    rng_1, rng_2 = np.random.default_rng(2), np.random.default_rng(2)
+    expected = [draw(p, rng_1) for p in proba_dists]
+    assert draw_batch(proba_dists, rng_2).tolist() == expected
+
+def test_draw_needs_a_stream():
+    with pytest.raises(TypeError):
+        draw(np.ones(4) / 4)
+    with pytest.raises(TypeError):
+        draw_batch(np.ones((2, 4)) / 4)
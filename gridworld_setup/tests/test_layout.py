@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from minigrid.core.constants import DIR_TO_VEC
+
+import reference
+from layout import LayoutAnalysis
+from distance_field import UNREACHABLE, pose_distance_fields, pose_successor_distances
+from utils import compute_opt_length, initial_layout, distance_fields
+
+@pytest.mark.parametrize('env_type, size', reference.ENV_CONFIGS)
+def test_layout_path_is_astar_path(env_type, size):
+    env = reference.make_env(env_type, size, seed=0)
+    obstacle_grid, _, goals, subgoals = initial_layout(env)
+    layout = LayoutAnalysis(obstacle_grid)
+    start = tuple(env.agent_start_pos)
+    for obj in np.concatenate((goals, subgoals)).astype(int).tolist():
+        grid = obstacle_grid.astype(float)
+        grid[obj[0], obj[1]] = 0
+        expected = reference.A_star_algorithm(start, tuple(obj), grid)
+        assert layout.path(start, obj) == expected
+        straight = layout.straight_path(start, obj)
+        assert (straight is None) == (expected is None)
+        if expected is not None:
+            assert len(straight) == len(expected)
+
+@pytest.mark.parametrize('env_type, size', reference.ENV_CONFIGS)
+def test_layout_distance_fields(env_type, size):
+    env = reference.make_env(env_type, size, seed=1)
+    obstacle_grid, _, goals, subgoals = initial_layout(env)
+    layout = LayoutAnalysis(obstacle_grid)
+    objects = np.concatenate((goals, subgoals)).astype(int)
+    assert np.array_equal(layout.distance_fields(objects), distance_fields(obstacle_grid, objects))
+
+@pytest.mark.parametrize('env_type, size', reference.ENV_CONFIGS)
+def test_compute_opt_length(env_type, size):
+    for seed in range(3):
+        env = reference.make_env(env_type, size, seed)
+        layout = LayoutAnalysis(initial_layout(env)[0])
+        for goal_color in range(4):
+            expected = reference.compute_opt_length(env, goal_color)
+            assert compute_opt_length(env, goal_color) == expected
+            assert compute_opt_length(env, goal_color, layout=layout) == expected
+
+@pytest.mark.parametrize('env_type, size', reference.SMALL_ENV_CONFIGS)
+def test_pose_distance_fields_match_brute_force(env_type, size):
+    env = reference.make_env(env_type, size, seed=0)
+    obstacle_grid, _, goals, subgoals = initial_layout(env)
+    objects = np.concatenate((goals, subgoals)).astype(int).tolist() + [list(env.agent_start_pos)]
+    for obj, field in zip(objects, pose_distance_fields(obstacle_grid, objects)):
+        expected = reference.pose_distances(env, tuple(obj))
+        assert np.array_equal(field, expected)
+        # Pose lookup of the greedy policy: distances of the states reached by turn left, turn right and forward
+        for dir, x, y in np.argwhere(expected != UNREACHABLE).tolist():
+            if obstacle_grid[x, y] == 1:
+                continue
+            left, right, forward = pose_successor_distances(field, (x, y), dir)
+            assert left == expected[(dir - 1) % 4, x, y] and right == expected[(dir + 1) % 4, x, y]
+            front_x, front_y = x + DIR_TO_VEC[dir][0], y + DIR_TO_VEC[dir][1]
+            assert forward == expected[dir, front_x, front_y]
+
+@pytest.mark.parametrize('env_type, size', reference.SMALL_ENV_CONFIGS)
+def test_exact_opt_length_is_min_actions(env_type, size):
+    for seed in range(2):
+        env = reference.make_env(env_type, size, seed)
+        for goal_color in range(4):
+            expected = reference.min_actions(env, goal_color)
+            length = compute_opt_length(env, goal_color, exact=True)
+            assert length == (UNREACHABLE if expected is None else expected)
@@ -0,0 +1,80 @@
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import reference
+from metrics import METRICS, MetricsRegistry
+from bayesian_ToM.bayesian_teacher import evaluate_predicted_rewards
+
+def record(metrics: MetricsRegistry) -> None:
+    metrics.count('calls')
+    metrics.count('calls', 2)
+    metrics.add_time('step', 0.5)
+    with metrics.timer('block'):
+        pass
+    metrics.timed('fun')(lambda: None)()
+    for value in (0, 0.3, 1, 3, 4, 5):
+        metrics.observe('length', value)
+
+def test_disabled_metrics_record_nothing():
+    metrics = MetricsRegistry()
+    record(metrics)
+    assert metrics.snapshot() == dict(counters={}, timers={}, histograms={}, sources={})
+
+def test_enabled_metrics(tmp_path):
+    metrics = MetricsRegistry(enabled=True)
+    metrics.add_source('cache', lambda: dict(hits=1))
+    record(metrics)
+    metrics.add_time('step', 1.5)
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'calls': 3}
+    assert snapshot['timers']['step'] == dict(calls=2, total_s=2., mean_s=1., max_s=1.5)
+    assert snapshot['timers']['block']['calls'] == 1 and snapshot['timers']['fun']['calls'] == 1
+    # Buckets with power of two upper bounds (0 for the values <= 0)
+    assert snapshot['histograms']['length'] == dict(count=6, mean=13.3 / 6, min=0, max=5, buckets={'0': 1, '0.5': 1, '2': 1, '4': 1, '8': 2})
+    assert snapshot['sources'] == {'cache': dict(hits=1)}
+
+    path = tmp_path / 'metrics.json'
+    metrics.dump(str(path), trials=[dict(trial=0)])
+    assert json.loads(path.read_text()) == dict(trials=[dict(trial=0)], metrics=snapshot)
+
+    metrics.snapshot(reset=True)
+    assert metrics.snapshot() == dict(counters={}, timers={}, histograms={}, sources={'cache': dict(hits=1)})
+
+def test_merged_metrics():
+    worker = MetricsRegistry(enabled=True)
+    record(worker)
+    metrics = MetricsRegistry(enabled=True)
+    record(metrics)
+    metrics.merge(dict(worker.snapshot(), pid=12))
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == {'calls': 6}
+    assert snapshot['timers']['step'] == dict(calls=2, total_s=1., mean_s=0.5, max_s=0.5)
+    assert snapshot['histograms']['length']['buckets'] == {'0': 2, '0.5': 2, '2': 2, '4': 2, '8': 4}
+    assert snapshot['worker_sources'] == {'12': {}}
+
+def test_pool_metrics_are_merged():
+    # The metrics recorded in the pool workers are merged in the main process: same counts as without a pool (one shard:
+    # same tasks observed along the trie of the demo prefixes)
+    teacher = reference.observed_teachers(seed=0)[0]
+    tasks = [(demo, goal_color, goal_color % 3) for demo in ([2, 2, 1], [1, 2, 2, 2]) for goal_color in range(4)]
+    snapshots = []
+    METRICS.enable()
+    try:
+        for pool in (None, ProcessPoolExecutor(1)):
+            METRICS.reset()
+            evaluate_predicted_rewards(teacher, tasks, pool=pool, num_shards=1, rngs=[np.random.default_rng(kk) for kk in range(len(tasks))])
+            snapshots.append(METRICS.snapshot(reset=True))
+            if pool is not None:
+                pool.shutdown()
+    finally:
+        METRICS.disable()
+        METRICS.worker_sources.clear()
+    main, pooled = snapshots
+    assert pooled['counters'] == main['counters']
+    # The worker also resets the grid of the env it builds from the layout
+    pooled['timers']['env.reset_grid']['calls'] -= 1
+    assert {name: timer['calls'] for name, timer in pooled['timers'].items()} == {name: timer['calls'] for name, timer in main['timers'].items()}
+    assert pooled['histograms']['BayesianTeacher.rollout_length'] == main['histograms']['BayesianTeacher.rollout_length']
+    assert main['histograms']['BayesianTeacher.rollout_length']['count'] == len(tasks)
+    assert [sources['planning_cache']['misses'] > 0 for sources in pooled['worker_sources'].values()] == [True]
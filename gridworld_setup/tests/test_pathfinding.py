@@ -0,0 +1,66 @@
+import numpy as np
+import tracemalloc
+
+import reference
+from pathfinding import AStar
+from utils import A_star_algorithm, PLANNING_CACHE, ENTRY_NBYTES, PlanningCache, grid_hash, key_nbytes, path_nbytes
+
+def test_astar_matches_reference():
+    engine = AStar((12, 12))
+    rng = np.random.default_rng(0)
+    for grid in reference.random_grids(0, 40):
+        free = np.argwhere(grid != 1)
+        for _ in range(5):
+            start, goal = (tuple(int(v) for v in free[kk]) for kk in rng.choice(len(free), 2))
+            expected = reference.A_star_algorithm(start, goal, grid)
+            # Same buffers reused for all the searches
+            assert engine.search(start, goal, grid) == expected
+            assert A_star_algorithm(start, goal, grid) == expected
+
+def test_astar_cached_path_is_not_shared():
+    PLANNING_CACHE.clear()
+    grid = np.zeros((6, 6))
+    path = A_star_algorithm((0, 0), (5, 5), grid)
+    path.append(None)
+    assert A_star_algorithm((0, 0), (5, 5), grid) == reference.A_star_algorithm((0, 0), (5, 5), grid)
+
+def test_planning_cache_eviction_and_stats():
+    cache = PlanningCache(max_bytes=3 * (ENTRY_NBYTES + key_nbytes(('k', 0)) + 100))
+    for kk in range(3):
+        cache.put(('k', kk), kk, nbytes=100)
+    assert cache.get(('k', 0)) == 0 and cache.get(('k', 3)) is None
+    # Least recently used entry evicted (k 1: k 0 was just read)
+    cache.put(('k', 3), 3, nbytes=100)
+    assert cache.get(('k', 1)) is None and cache.get(('k', 0)) == 0 and cache.get(('k', 3)) == 3
+    assert cache.stats() == dict(hits=3, misses=2, hit_rate=0.6, evictions=1, entries=3, nbytes=cache.max_bytes)
+    # Replaced entry counted once, an entry larger than the budget is kept alone
+    cache.put(('k', 3), 3, nbytes=100)
+    assert cache.nbytes == cache.max_bytes
+    cache.put(('k', 4), 4, nbytes=cache.max_bytes)
+    assert list(cache.entries) == [('k', 4)] and cache.evictions == 4
+
+def test_planning_cache_budget_holds():
+    # Memory of the cached A* paths measured with tracemalloc: within the budget of the cache
+    rng = np.random.default_rng(1)
+    engine = AStar((25, 25))
+    grid = np.zeros((25, 25))
+    entries = []
+    for kk in range(2000):
+        start, goal = tuple(int(v) for v in rng.integers(0, 25, 2)), tuple(int(v) for v in rng.integers(0, 25, 2))
+        key = ('astar', grid_hash(grid + kk)) + start + goal
+        entries.append((key, tuple(engine.search(start, goal, grid))))
+
+    cache = PlanningCache(max_bytes=2**20)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for key, path in entries:
+            cache.put(key, path, nbytes=path_nbytes(path))
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    kept = set(cache.entries)
+    size = sum(key_nbytes(key) + path_nbytes(path) for key, path in entries if key in kept)
+    assert cache.evictions > 0 and cache.nbytes <= cache.max_bytes
+    # Memory added by the cache (slots, pairs and counters; keys and paths are shared with the list) within the estimate
+    assert used <= cache.nbytes - size
@@ -0,0 +1,234 @@
+import copy
+import numpy as np
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+
+import reference
+from demo_library import DemoLibrary
+from learner import BayesianLearner
+from learner_knowledge import LearnerKnowledgeTracker
+from reward_memo import RewardMemo
+from bayesian_ToM.bayesian_teacher import BayesianTeacher, AlignedBayesianTeacher, evaluate_predicted_rewards, race_demos
+
+def demo_tasks(env, seed: int=0) -> list:
+    demos = DemoLibrary(env, rng=np.random.default_rng(seed)).build(rf_values=[3, 5, 7], n_obj_values=range(3, 5))
+    return [(demo, goal_color, rf_idx) for demo in demos for goal_color in (0, 2) for rf_idx in (0, 2)]
+
+def test_predicted_rewards_same_with_a_pool():
+    # Each task draws from its own stream spawned from the teacher stream: same rewards in the main process or in a pool
+    teachers = reference.observed_teachers(seed=0)[:2]
+    pool_teachers = reference.observed_teachers(seed=0)[:2]
+    tasks = demo_tasks(teachers[0].env)
+    with ProcessPoolExecutor(1) as pool:
+        for teacher, pool_teacher in zip(teachers, pool_teachers):
+            assert teacher.predicted_rewards(tasks) == pool_teacher.predicted_rewards(tasks, pool)
+
+def test_lockstep_rollout_matches_env_rollout():
+    # A single lockstep sample draws the same random numbers as the rollout stepping the env: same reward
+    teacher, _, env = reference.observed_teachers(seed=1)
+    rewards = []
+    for kk, (demo, goal_color, rf_idx) in enumerate(demo_tasks(env)):
+        reward = teacher.predicted_reward(demo, goal_color, rf_idx, rng=np.random.default_rng(kk))
+        stats = teacher.predicted_reward_stats(demo, goal_color, rf_idx, num_samples=1, rng=np.random.default_rng(kk))
+        assert stats[0] == pytest.approx(reward)
+        rewards.append(reward)
+    # Some of the rollouts open the door
+    assert max(rewards) > 0
+
+def test_aligned_predicted_reward_stats():
+    _, aligned_teacher, env = reference.observed_teachers(seed=1)
+    demo, goal_color, rf_idx = demo_tasks(env)[3]
+    rng = np.random.default_rng(0)
+    expected = [aligned_teacher.predicted_reward(demo, goal_color, rf_idx, rng=rng) for _ in range(3)]
+    mean, _, num_rollouts = aligned_teacher.predicted_reward_stats(demo, goal_color, rf_idx, num_samples=3, rng=np.random.default_rng(0))
+    assert num_rollouts == 3 and mean == pytest.approx(np.mean(expected))
+
+@pytest.mark.parametrize('teacher_idx', [0, 1])
+def test_prefix_trie_matches_predicted_reward(teacher_idx):
+    # Rewards along the trie of the demo prefixes, without the trie and from predicted_reward with the same streams
+    teacher = reference.observed_teachers(seed=2)[teacher_idx]
+    tasks = demo_tasks(teacher.env) + [([2, 2, 1], 3, 1)]
+    expected = [teacher.predicted_reward(*task, rng=np.random.default_rng(kk)) for kk, task in enumerate(tasks)]
+    for prefix_trie in (True, False):
+        teacher.prefix_trie = prefix_trie
+        rngs = [np.random.default_rng(kk) for kk in range(len(tasks))]
+        assert evaluate_predicted_rewards(teacher, tasks, rngs=rngs) == pytest.approx(expected)
+
+def observe_learner(seed: int, shared: bool, rollouts: bool, num_obs: int=8) -> tuple:
+    # Both teachers observing the same learner with a shared tracker or a tracker each, with or without predicted rewards
+    # between the observed steps (played on an identical env: the rollouts reset the env of the teachers)
+    steps = []
+    learner = BayesianLearner(goal_color=seed % 4, receptive_field=5, grid_size=15, rng=np.random.default_rng(seed))
+    while not learner.terminated and len(steps) < num_obs:
+        pos, dir = learner.env.agent_pos, learner.env.agent_dir
+        steps.append((pos, dir, learner.play(size=1)[0]))
+
+    env = BayesianLearner(goal_color=seed % 4, receptive_field=5, grid_size=15, rng=np.random.default_rng(seed)).env
+    trackers = [LearnerKnowledgeTracker(env, rf_values=[3, 5, 7]) for _ in range(1 if shared else 2)]
+    teachers = [BayesianTeacher(env=env, lambd=0.01, rf_values=[3, 5, 7], rng=np.random.default_rng(0), knowledge_tracker=trackers[0]),
+                AlignedBayesianTeacher(env=env, rf_values=[3, 5, 7], rng=np.random.default_rng(0), knowledge_tracker=trackers[-1])]
+    for ii, (pos, dir, action) in enumerate(steps):
+        for tracker in trackers:
+            tracker.update(learner_pos=pos, learner_dir=dir, learner_step_count=ii)
+        for teacher in teachers:
+            teacher.observe(action)
+            if rollouts:
+                teacher.predicted_reward([2, 2, 1], ii % 4, ii % 4, rng=np.random.default_rng(ii))
+    return teachers, trackers
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_rollouts_keep_the_observed_learner(seed):
+    # The rollouts use a private tracker: the teachers sharing a tracker keep the beliefs of teachers with a tracker each
+    owned_teachers, _ = observe_learner(seed, shared=False, rollouts=False)
+    teachers, (tracker,) = observe_learner(seed, shared=True, rollouts=True)
+    for teacher, owned_teacher in zip(teachers, owned_teachers):
+        assert teacher.knowledge_tracker is tracker and teacher in tracker.subscribers
+        assert np.allclose(teacher.beliefs, owned_teacher.beliefs)
+        assert np.array_equal(teacher.active_hypotheses, owned_teacher.active_hypotheses)
+        tasks = demo_tasks(teacher.env)[:8]
+        assert teacher.predicted_rewards(tasks) == pytest.approx(owned_teacher.predicted_rewards(tasks))
+
+@pytest.mark.parametrize('teacher_idx', [0, 1])
+def test_policy_table_same_rewards(teacher_idx):
+    # Same rollouts with and without the table of learner policies (the rollouts revisit the states of the table)
+    rewards = []
+    for policy_table_size in (0, 20000):
+        teacher = reference.observed_teachers(seed=3, policy_table_size=policy_table_size)[teacher_idx]
+        tasks = demo_tasks(teacher.env, seed=3)
+        rewards.append([teacher.predicted_reward(*task, rng=np.random.default_rng(kk)) for kk, task in enumerate(tasks)])
+        rewards[-1] += [teacher.predicted_reward_stats(*task, num_samples=4, rng=np.random.default_rng(kk))[0] for kk, task in enumerate(tasks[:8])]
+    assert teacher.policy_table.hits > 0
+    assert rewards[0] == rewards[1]
+
+@pytest.mark.parametrize('seed', [0, 2])
+def test_pruned_beliefs_are_conditioned_plain_beliefs(seed):
+    # Pruning keeps the posterior of the plain teacher conditioned on the alive hypotheses
+    plain_teacher = reference.observed_teachers(seed=seed, num_obs=12)[0]
+    teacher = reference.observed_teachers(seed=seed, num_obs=12, belief_epsilon=1e-3)[0]
+    alive = teacher.active_hypotheses
+    assert not alive.all() and alive[np.unravel_index(np.argmax(plain_teacher.beliefs), alive.shape)]
+    expected = np.where(alive, plain_teacher.beliefs, 0)
+    assert np.allclose(teacher.beliefs, expected / expected.sum())
+    # Without epsilon only the hypotheses with a zero belief die
+    assert (plain_teacher.beliefs[~plain_teacher.active_hypotheses] == 0).all()
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_learner_policies_stack_learner_policy(seed):
+    # The batched policies of the alive hypotheses are the policies of the hypotheses one by one from the same state
+    learner = BayesianLearner(goal_color=seed % 4, receptive_field=5, grid_size=15, rng=np.random.default_rng(seed))
+    tracker = LearnerKnowledgeTracker(learner.env, rf_values=[3, 5, 7])
+    teachers = [BayesianTeacher(env=learner.env, lambd=0.01, rf_values=[3, 5, 7], rng=np.random.default_rng(0), knowledge_tracker=tracker),
+                AlignedBayesianTeacher(env=learner.env, rf_values=[3, 5, 7], rng=np.random.default_rng(0), knowledge_tracker=tracker)]
+    ii = 0
+    while not learner.terminated and ii < 20:
+        tracker.update(learner_pos=learner.env.agent_pos, learner_dir=learner.env.agent_dir, learner_step_count=ii)
+        action = learner.play(size=1)[0]
+        for teacher in teachers:
+            batched = copy.deepcopy(teacher).learner_policies()
+            one_by_one = copy.deepcopy(teacher)
+            expected = np.zeros_like(batched)
+            for goal_color, rf_idx in np.argwhere(teacher.active_hypotheses):
+                expected[goal_color, rf_idx] = one_by_one.learner_policy(goal_color, rf_idx)
+            assert np.allclose(batched, expected)
+            teacher.observe(action)
+        ii += 1
+    assert ii > 8
+
+@pytest.mark.parametrize('teacher_idx, seed', [(0, 2), (1, 0)])
+def test_race_selects_the_exhaustive_argmax(teacher_idx, seed):
+    # The race keeps the best demo of the exhaustive evaluation on the same paired samples, with fewer rollouts
+    teacher = reference.observed_teachers(seed=seed)[teacher_idx]
+    library = DemoLibrary(teacher.env, rng=np.random.default_rng(seed))
+    demos = library.build(rf_values=[3, 5, 7], n_obj_values=range(3, 5))[::2]
+    costs = 0.8 * np.array([len(demo) for demo in demos]) / np.max(library.lengths)
+    hypotheses = [(goal_color, rf_idx) for goal_color, rf_idx in np.argwhere(teacher.beliefs > 0).tolist()]
+    weights = np.array([teacher.beliefs[goal_color, rf_idx] for goal_color, rf_idx in hypotheses])
+
+    # Exhaustive: the 8 samples of the race (two batches of 4 seeds per hypothesis) for all the demos
+    rng = np.random.default_rng(seed)
+    seeds = np.concatenate([rng.integers(np.iinfo(np.int64).max, size=(4, len(hypotheses))) for _ in range(2)]).reshape(-1)
+    tasks = [(demo, goal_color, rf_idx) for demo in demos for _ in range(8) for goal_color, rf_idx in hypotheses]
+    rngs = [np.random.default_rng(seed) for _ in demos for seed in seeds]
+    rewards = np.array(evaluate_predicted_rewards(teacher, tasks, rngs=rngs)).reshape(len(demos), 8, len(hypotheses))
+    utility = ((rewards - costs[:, None, None]) @ weights).mean(axis=1)
+
+    teacher.rng = np.random.default_rng(seed)
+    demo_idx, _, num_rollouts = race_demos(teacher, demos, hypotheses, costs, max_samples=8)
+    assert demo_idx == np.argmax(utility)
+    assert num_rollouts < len(tasks)
+
+def test_race_needs_two_samples():
+    teacher, _, env = reference.observed_teachers(seed=0)
+    with pytest.raises(ValueError):
+        teacher.select_demo(10, lambda x, l: 0., demo_tasks(env)[0][:1], num_samples=1, racing=True)
+
+@pytest.mark.parametrize('teacher_idx', [0, 1])
+def test_reward_memo_second_run_hits(tmp_path, teacher_idx):
+    # A second run on the same file finds all the rewards of the first one (same tasks and streams --> same rewards)
+    path = str(tmp_path / 'rewards.sqlite')
+    teacher = reference.observed_teachers(seed=0)[teacher_idx]
+    tasks = demo_tasks(teacher.env)[:8]
+    expected = teacher.predicted_rewards(tasks)
+    for run in range(2):
+        memo = RewardMemo(path)
+        teacher = reference.observed_teachers(seed=0, reward_memo=memo)[teacher_idx]
+        assert teacher.predicted_rewards(tasks) == expected
+        assert (memo.hits, memo.misses) == ((0, len(tasks)) if run == 0 else (len(tasks), 0))
+        assert len(memo) == len(tasks)
+        memo.close()
+
+def memo_round_trip(memo: RewardMemo, keys: list) -> tuple:
+    # In a child process: rewards of the parent, then new rewards for the parent
+    found = memo.get_many(keys)
+    memo.put_many([(key + '-child', reward + 1) for key, reward in found.items()])
+    return found, memo.pid
+
+def test_reward_memo_across_processes(tmp_path):
+    # The pickled memo reconnects in the child process (the connection of the parent is not shared)
+    memo = RewardMemo(str(tmp_path / 'rewards.sqlite'))
+    memo.put_many([('a', 0.5), ('b', 1.)])
+    with ProcessPoolExecutor(1) as pool:
+        found, child_pid = pool.submit(memo_round_trip, memo, ['a', 'b', 'c']).result()
+    assert found == {'a': 0.5, 'b': 1.}
+    assert child_pid != memo.pid
+    assert memo.get_many(['a-child', 'b-child']) == {'a-child': 1.5, 'b-child': 2.}
+    memo.close()
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_finished_rollouts_match_simulation(seed):
+    # The rollouts ended in closed form give the reward and the stream state of the rollouts played to the end
+    _, teacher, env = reference.observed_teachers(seed=seed)
+    finish_rollout = teacher.finish_rollout
+    finished = []
+    def recorded_finish_rollout(goal_color, rf_idx, rng):
+        # Steps of the rollout before and after the closed form
+        start = teacher.env.step_count
+        reward = finish_rollout(goal_color, rf_idx, rng)
+        if reward is not None:
+            finished.append((start, teacher.env.step_count, reward))
+        return reward
+
+    def check(task, kk):
+        rngs = [np.random.default_rng(kk), np.random.default_rng(kk)]
+        teacher.finish_rollout = recorded_finish_rollout
+        reward = teacher.predicted_reward(*task, rng=rngs[0])
+        teacher.finish_rollout = lambda goal_color, rf_idx, rng: None
+        assert teacher.predicted_reward(*task, rng=rngs[1]) == reward
+        assert rngs[0].bit_generator.state == rngs[1].bit_generator.state
+
+    tasks = [(demo, goal_color, rf_idx) for demo, _, _ in demo_tasks(env)[::12] for goal_color in range(4) for rf_idx in range(3)]
+    cuts = []
+    for kk, task in enumerate(tasks):
+        check(task, kk)
+        if len(finished) > 0 and finished[-1][1] - finished[-1][0] > 1:
+            # Episode cut by max_steps in the middle of the closed form part
+            cuts.append((task, kk, finished.pop()[1] - 1))
+    assert len(cuts) > 0
+
+    default_max_steps = env.max_steps
+    for task, kk, max_steps in cuts:
+        env.max_steps = max_steps
+        num_finished = len(finished)
+        check(task, kk)
+        assert finished[num_finished:] == [(finished[-1][0], max_steps, 0)]
+    env.max_steps = default_max_steps
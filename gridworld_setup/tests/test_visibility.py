@@ -0,0 +1,76 @@
+import numpy as np
+import sys
+import threading
+import pytest
+from minigrid.core.world_object import Key
+
+import reference
+from distance_field import DIR_VEC
+from visibility import VisibilityAtlas, view_cells
+from utils import get_visibility_atlas, get_world_encoding, visible_cells
+
+def minigrid_visible_cells(env) -> list:
+    # Flat indices of the world cells of the minigrid observation of the agent
+    _, vis_mask = env.gen_obs_grid()
+    cells_x, cells_y = view_cells(env.agent_pos, env.agent_dir, env.agent_view_size)
+    in_grid = (cells_x >= 0) & (cells_x < env.width) & (cells_y >= 0) & (cells_y < env.height)
+    visible = vis_mask & in_grid
+    return sorted((cells_x[visible] * env.height + cells_y[visible]).tolist())
+
+@pytest.mark.parametrize('env_type, size', [('MultiGoalsEnv', 15), ('MultiRoomsGoalsEnv', 25)])
+@pytest.mark.parametrize('agent_view_size', [3, 5, 7])
+def test_atlas_matches_gen_obs(env_type, size, agent_view_size):
+    env = reference.make_env(env_type, size, seed=4, agent_view_size=agent_view_size)
+    rng = np.random.default_rng(5)
+    for _ in range(200):
+        env.agent_pos = (int(rng.integers(1, size - 1)), int(rng.integers(1, size - 1)))
+        env.agent_dir = int(rng.integers(0, 4))
+        cells = visible_cells(env.agent_pos, env.agent_dir, agent_view_size, env)
+        assert cells.tolist() == minigrid_visible_cells(env)
+
+def test_caches_follow_pickup_and_drop():
+    env = reference.make_env('MultiRoomsGoalsEnv', 25, seed=6, agent_view_size=5)
+    key_pos = next((x, y) for x in range(env.width) for y in range(env.height) if isinstance(env.grid.get(x, y), Key))
+    # Agent on a free cell next to the key, facing it
+    env.agent_dir = next(d for d in range(4) if env.grid.get(key_pos[0] - DIR_VEC[d][0], key_pos[1] - DIR_VEC[d][1]) is None)
+    env.agent_pos = (key_pos[0] - DIR_VEC[env.agent_dir][0], key_pos[1] - DIR_VEC[env.agent_dir][1])
+    for action in [env.actions.pickup, env.actions.drop]:
+        version = env.grid_version
+        get_visibility_atlas(env)
+        env.step(action)
+        assert env.grid_version != version
+        assert np.array_equal(get_world_encoding(env), env.grid.encode())
+        assert visible_cells(env.agent_pos, env.agent_dir, 5, env).tolist() == minigrid_visible_cells(env)
+
+def test_atlas_reads_during_updates():
+    # Readers racing with opacity updates (and compactions) always get the cells of one of the opacities
+    rng = np.random.default_rng(9)
+    opacities = [rng.random((15, 15)) < 0.3 for _ in range(2)]
+    expected = [VisibilityAtlas(opacity) for opacity in opacities]
+    atlas = VisibilityAtlas(opacities[0])
+    poses = [(int(x), int(y), int(d)) for x, y, d in zip(rng.integers(0, 15, 300), rng.integers(0, 15, 300), rng.integers(0, 4, 300))]
+    errors = []
+
+    def read():
+        for _ in range(5):
+            for x, y, d in poses:
+                cells = atlas.visible_cells((x, y), d, 5).tolist()
+                if all(cells != ref.visible_cells((x, y), d, 5).tolist() for ref in expected):
+                    errors.append((x, y, d))
+
+    # Thread switches as often as possible
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        kk = 0
+        while any(thread.is_alive() for thread in threads):
+            kk += 1
+            atlas.update_opacity(opacities[kk % 2])
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert not errors
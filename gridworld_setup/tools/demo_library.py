@@ -0,0 +1,126 @@
+import numpy as np
+import hashlib
+
+from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
+from utils import cached_distance_fields, get_layout_atlas, initial_layout, synthesize_visit
+from layout import LayoutAnalysis
+
+def demo_hash(demo: list) -> str:
+    # Content hash of a sequence of actions
+    return hashlib.blake2b(np.asarray(demo, dtype=np.int8).tobytes(), digest_size=8).hexdigest()
+
+def common_prefix_length(demo_1: list, demo_2: list) -> int:
+    # Number of leading actions shared by two demos
+    length = 0
+    for a_1, a_2 in zip(demo_1, demo_2):
+        if a_1 != a_2:
+            break
+        length += 1
+    return length
+
+##
+# All the demonstrations of one layout built from a single analysis of the layout
+##
+
+class DemoLibrary:
+
+    def __init__(self,
+                 env: MultiGoalsEnv | MultiRoomsGoalsEnv,
+                 num_colors: int=4,
+                 layout: LayoutAnalysis | None=None,
+                 rng: np.random.Generator | None=None,
+                 dedupe: bool=False
+                 ) -> None:
+        self.num_colors = num_colors
+        # dedupe=True: identical demos are stored once (the indices and the number of demos then differ from the
+        # list of demos built one by one)
+        self.dedupe = dedupe
+        self.layout = layout
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        assert(env.height == env.width)
+
+        # Analyse the initial layout once (teacher has full observability), the env itself is never stepped nor reset
+        self.obstacle_grid, self.opacity, self.goals, self.subgoals = initial_layout(env, num_colors)
+        self.atlas = get_layout_atlas(self.opacity)
+        self.start = (env.agent_start_pos, env.agent_start_dir)
+        # see_through_walls setting of the env for each view size
+        self.view_sees_through_walls = env.view_sees_through_walls
+        self.size = env.height
+
+        # Objects: goals (doors) of each color then subgoals (keys) of each color
+        self.objects = [tuple(obj) for obj in np.concatenate((self.goals, self.subgoals)).astype(int).tolist()]
+        # Distance maps to all the objects (same obstacle grid)
+        if layout is not None:
+            self.objects_dist = layout.distance_fields(self.objects)
+        else:
+            self.objects_dist = cached_distance_fields(self.obstacle_grid, self.objects)
+
+        # Demos (action sequences) and their content hash
+        self.demos = []
+        self.hashes = []
+        # Content hash --> index of the first demo with this content
+        self.index = {}
+        # Demo family key (e.g. ('demo', rf, goal_color)) --> index of the demo
+        self.families = {}
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.array([len(demo) for demo in self.demos], dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.demos)
+
+    def add(self, demo: list) -> int:
+        # Index of the demo in the library (identical action sequences are stored once if dedupe)
+        h = demo_hash(demo)
+        if self.dedupe and h in self.index:
+            return self.index[h]
+        self.index.setdefault(h, len(self.demos))
+        self.demos.append(list(demo))
+        self.hashes.append(h)
+        return len(self.demos) - 1
+
+    def _synthesize(self, objects_idx: list, rf: int, by_path: bool) -> int:
+        objects = [self.objects[idx] for idx in objects_idx]
+        objects_dist = self.objects_dist[objects_idx] if by_path else None
+        return self.add(synthesize_visit(self.obstacle_grid, self.atlas, self.start, objects, rf, self.view_sees_through_walls(rf, self.size), objects_dist, self.layout))
+
+    def _family(self, key: tuple, objects_idx: list, rf: int, by_path: bool) -> int:
+        if key not in self.families:
+            self.families[key] = self._synthesize(objects_idx, rf, by_path)
+        return self.families[key]
+
+    def demo(self, rf: int, goal_color: int) -> list:
+        # Same as generate_demo: subgoal (key) and goal (door) of the color, closest first
+        idx = self._family(('demo', int(rf), int(goal_color)), [goal_color, self.num_colors + goal_color], rf, by_path=True)
+        return self.demos[idx]
+
+    def demo_all(self, min_rf: int=3) -> list:
+        # Same as generate_demo_all: all the objects, always going to the closest one
+        idx = self._family(('all', int(min_rf)), list(range(len(self.objects))), min_rf, by_path=True)
+        return self.demos[idx]
+
+    def random_demo(self, n_obj: int, min_rf: int=3) -> list:
+        # Same as generate_random_demo: n_obj random objects, always going to the closest one (Manhattan distance)
+        objects_idx = self.rng.choice(len(self.objects), size=n_obj, replace=False).tolist()
+        idx = self._synthesize(objects_idx, min_rf, by_path=False)
+        return self.demos[idx]
+
+    def build(self,
+              rf_values: list,
+              n_obj_values: list=range(3, 9),
+              add_all: bool=False,
+              add_empty: bool=True
+              ) -> list:
+        # Random demos, learner-specific demos (per color and rf), all-objects demo and no demo (full obs)
+        for n_obj in n_obj_values:
+            self.random_demo(n_obj)
+        for goal_color in range(self.num_colors):
+            for rf in rf_values:
+                self.demo(rf, goal_color)
+        if add_all:
+            self.demo_all()
+        if add_empty:
+            self.add([])
+        return self.demos
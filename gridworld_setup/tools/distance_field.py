@@ -0,0 +1,266 @@
+from __future__ import annotations
+import numpy as np
+import heapq
+
+# Distance of the cells that cannot be reached from the source
+UNREACHABLE = np.iinfo(np.int16).max
+
+# Forward move of each direction (same as minigrid DIR_TO_VEC)
+DIR_VEC = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+##
+# Unit-cost distance transform on the 4-connected grid (BFS wavefront with NumPy)
+##
+
+def distance_fields(grid: np.ndarray, goals: list | np.ndarray) -> np.ndarray:
+    # Grid with 0 if empty cell 1 if object (i.e. obstacle)
+    # Returns the (K, H, W) int16 distance to each of the K goals (UNREACHABLE if not reachable)
+    rows, cols = grid.shape
+    goals = np.asarray(goals, dtype=int).reshape(-1, 2)
+    num_goals = goals.shape[0]
+
+    free = np.broadcast_to(grid != 1, (num_goals, rows, cols))
+
+    distance = np.full((num_goals, rows, cols), UNREACHABLE, dtype=np.int16)
+    frontier = np.zeros((num_goals, rows, cols), dtype=bool)
+    frontier[np.arange(num_goals), goals[:, 0], goals[:, 1]] = True
+    # The goal itself is the source even when it is an obstacle
+    reached = frontier.copy()
+    distance[frontier] = 0
+
+    next_frontier = np.empty_like(frontier)
+    dist = 0
+    while frontier.any():
+        dist += 1
+        # Expand the wavefront in the 4 directions
+        next_frontier.fill(False)
+        next_frontier[:, 1:, :] |= frontier[:, :-1, :]
+        next_frontier[:, :-1, :] |= frontier[:, 1:, :]
+        next_frontier[:, :, 1:] |= frontier[:, :, :-1]
+        next_frontier[:, :, :-1] |= frontier[:, :, 1:]
+        # Only free cells not reached yet
+        next_frontier &= free
+        next_frontier &= ~reached
+
+        reached |= next_frontier
+        np.copyto(distance, dist, where=next_frontier)
+        frontier, next_frontier = next_frontier, frontier
+
+    return distance
+
+def distance_field(grid: np.ndarray, g_x: int, g_y: int) -> np.ndarray:
+    return distance_fields(grid, [(g_x, g_y)])[0]
+
+##
+# Action-count distance transform over the (x, y, dir) states (turn left / turn right / forward)
+##
+
+def pose_distance_fields(grid: np.ndarray, goals: list | np.ndarray) -> np.ndarray:
+    # Grid with 0 if empty cell 1 if object (i.e. obstacle), or (K, H, W) stack with one grid per goal
+    # Goals are (x, y) to enter the cell with any direction or (x, y, dir) to enter it with a given direction
+    # Returns the (K, 4, H, W) int16 number of actions from each state [dir, x, y] to each of the K goals
+    rows, cols = grid.shape[-2:]
+    goals = np.asarray(goals, dtype=int)
+    goals = goals.reshape(goals.shape[0], -1)
+    num_goals = goals.shape[0]
+
+    if grid.ndim == 3:
+        free = np.broadcast_to((grid != 1)[:, None], (num_goals, 4, rows, cols))
+    else:
+        free = np.broadcast_to(grid != 1, (num_goals, 4, rows, cols))
+
+    distance = np.full((num_goals, 4, rows, cols), UNREACHABLE, dtype=np.int16)
+    frontier = np.zeros((num_goals, 4, rows, cols), dtype=bool)
+    for kk, goal in enumerate(goals.tolist()):
+        if len(goal) == 3:
+            frontier[kk, goal[2], goal[0], goal[1]] = True
+        else:
+            frontier[kk, :, goal[0], goal[1]] = True
+    # The goal states are the sources even when the goal is an obstacle
+    reached = frontier.copy()
+    distance[frontier] = 0
+
+    next_frontier = np.empty_like(frontier)
+    dist = 0
+    while frontier.any():
+        dist += 1
+        # Predecessors by turning: turn left from dir+1, turn right from dir-1
+        next_frontier[:, 1:] = frontier[:, :-1]
+        next_frontier[:, 0] = frontier[:, 3]
+        next_frontier[:, :-1] |= frontier[:, 1:]
+        next_frontier[:, 3] |= frontier[:, 0]
+        # Predecessors by moving forward (one cell behind, same dir as in DIR_TO_VEC)
+        next_frontier[:, 0, :-1, :] |= frontier[:, 0, 1:, :]
+        next_frontier[:, 1, :, :-1] |= frontier[:, 1, :, 1:]
+        next_frontier[:, 2, 1:, :] |= frontier[:, 2, :-1, :]
+        next_frontier[:, 3, :, 1:] |= frontier[:, 3, :, :-1]
+        # Only states on free cells not reached yet
+        next_frontier &= free
+        next_frontier &= ~reached
+
+        reached |= next_frontier
+        np.copyto(distance, dist, where=next_frontier)
+        frontier, next_frontier = next_frontier, frontier
+
+    return distance
+
+def pose_successor_distances(field: np.ndarray, pos: tuple, dir: int) -> np.ndarray:
+    # Distance of the states reached by turn left, turn right and forward from (pos, dir) in a (4, H, W) field
+    # Moving forward into an obstacle is not a successor (UNREACHABLE)
+    next_x, next_y = pos[0] + DIR_VEC[dir][0], pos[1] + DIR_VEC[dir][1]
+    forward = UNREACHABLE
+    if 0 <= next_x < field.shape[1] and 0 <= next_y < field.shape[2]:
+        forward = field[dir, next_x, next_y]
+    return np.array([field[(dir - 1) % 4, pos[0], pos[1]], field[(dir + 1) % 4, pos[0], pos[1]], forward], dtype=np.int16)
+
+##
+# Action-count distance field to one goal repaired in place when cells of the grid change (same result as pose_distance_fields)
+##
+
+# Grid shape --> successor and predecessor states of each (dir, x, y) state (flat index dir * H * W + x * W + y)
+_POSE_GRAPHS = {}
+
+def pose_graph(shape: tuple) -> tuple:
+    graph = _POSE_GRAPHS.get(shape)
+    if graph is None:
+        rows, cols = shape
+        size = rows * cols
+        successors, predecessors = [], []
+        for dir in range(4):
+            dx, dy = DIR_VEC[dir]
+            for x in range(rows):
+                for y in range(cols):
+                    cell = x * cols + y
+                    # Turn left, turn right, forward (if in the grid)
+                    succ = [((dir + 3) % 4) * size + cell, ((dir + 1) % 4) * size + cell]
+                    if 0 <= x + dx < rows and 0 <= y + dy < cols:
+                        succ.append(dir * size + (x + dx) * cols + y + dy)
+                    pred = [((dir + 1) % 4) * size + cell, ((dir + 3) % 4) * size + cell]
+                    if 0 <= x - dx < rows and 0 <= y - dy < cols:
+                        pred.append(dir * size + (x - dx) * cols + y - dy)
+                    successors.append(tuple(succ))
+                    predecessors.append(tuple(pred))
+        graph = (successors, predecessors)
+        _POSE_GRAPHS[shape] = graph
+    return graph
+
+class DynamicPoseDistanceField:
+
+    def __init__(self, grid: np.ndarray, goal: tuple, distance: np.ndarray | None=None, field: np.ndarray | None=None) -> None:
+        # distance: (4, H, W) int16 C-contiguous array updated in place (e.g. a view of a larger array of fields)
+        # field: the (4, H, W) field of the goal on the grid if already computed
+        self.shape = grid.shape
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.goal_cell = self.goal[0] * self.shape[1] + self.goal[1]
+        self.free = np.asarray(grid) != 1
+
+        if field is None:
+            field = pose_distance_fields(grid, [self.goal])[0]
+        if distance is None:
+            distance = np.empty((4,) + self.shape, dtype=np.int16)
+        assert(distance.flags.c_contiguous and distance.shape == (4,) + self.shape)
+        distance[...] = field
+        self.distance = distance
+
+        # Python copies of the distances and of the free cells for the repairs (the array is only written back)
+        self.dist = distance.reshape(-1).tolist()
+        self.free_cells = self.free.reshape(-1).tolist()
+
+        self.num_repairs = 0
+        self.num_repaired_states = 0
+
+    def copy(self, distance: np.ndarray | None=None) -> DynamicPoseDistanceField:
+        # Independent copy (distance: array the copy updates in place)
+        field = DynamicPoseDistanceField.__new__(DynamicPoseDistanceField)
+        field.__dict__.update(self.__dict__)
+        if distance is None:
+            distance = np.empty_like(self.distance)
+        distance[...] = self.distance
+        field.distance = distance
+        field.free = self.free.copy()
+        field.dist = list(self.dist)
+        field.free_cells = list(self.free_cells)
+        return field
+
+    def sync(self, grid: np.ndarray) -> int:
+        # Repair the field for the cells whose obstacle status differs from the grid of the last update
+        changed = np.argwhere((np.asarray(grid) != 1) != self.free)
+        return self.update(changed, grid)
+
+    def update(self, changed_cells: list | np.ndarray, grid: np.ndarray) -> int:
+        # Cells that became obstacles can only increase the distances (decremental BFS: states that lost all their
+        # shortest successors are reset then repaired from their neighbours), cells that became free can only decrease
+        # them (incremental BFS from these cells). Returns the number of states whose distance changed
+        rows, cols = self.shape
+        size = rows * cols
+        goal_cell = self.goal_cell
+        dist, free = self.dist, self.free_cells
+
+        blocked, opened = [], []
+        for x, y in np.asarray(changed_cells, dtype=int).reshape(-1, 2).tolist():
+            cell = x * cols + y
+            is_free = bool(grid[x, y] != 1)
+            if cell == goal_cell or is_free == free[cell]:
+                continue
+            free[cell] = is_free
+            self.free[x, y] = is_free
+            if is_free:
+                opened.append(cell)
+            else:
+                blocked.append(cell)
+        if len(blocked) + len(opened) == 0:
+            return 0
+        successors, predecessors = pose_graph(self.shape)
+
+        # Decremental step: states whose distance is no longer supported (visited by increasing old distance)
+        affected = set()
+        heap = []
+        for cell in blocked:
+            for s in range(cell, 4 * size, size):
+                if dist[s] != UNREACHABLE:
+                    affected.add(s)
+                    heap.append((dist[s], s))
+        heapq.heapify(heap)
+        while heap:
+            d, u = heapq.heappop(heap)
+            for p in predecessors[u]:
+                if dist[p] != d + 1 or p in affected or p % size == goal_cell:
+                    continue
+                if not any(dist[v] == d and v not in affected for v in successors[p]):
+                    affected.add(p)
+                    heapq.heappush(heap, (d + 1, p))
+        old = {s: dist[s] for s in affected}
+        for s in affected:
+            dist[s] = UNREACHABLE
+
+        # Incremental step: reset states and states of the opened cells take their best successor, then the
+        # decreases are propagated to the predecessors
+        heap = []
+        for s in list(affected) + [s for cell in opened for s in range(cell, 4 * size, size)]:
+            if not free[s % size]:
+                continue
+            best = min(dist[v] for v in successors[s]) + 1
+            if best <= UNREACHABLE and best < dist[s]:
+                old.setdefault(s, dist[s])
+                dist[s] = best
+                heap.append((best, s))
+        heapq.heapify(heap)
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            d += 1
+            for p in predecessors[u]:
+                if d < dist[p] and free[p % size] and p % size != goal_cell:
+                    old.setdefault(p, dist[p])
+                    dist[p] = d
+                    heapq.heappush(heap, (d, p))
+
+        # Write back the states whose distance changed
+        changed = [s for s, d in old.items() if dist[s] != d]
+        flat = self.distance.reshape(-1)
+        flat[changed] = [dist[s] for s in changed]
+
+        self.num_repairs += 1
+        self.num_repaired_states += len(changed)
+        return len(changed)
@@ -0,0 +1,206 @@
+import numpy as np
+
+from distance_field import DIR_VEC, UNREACHABLE, distance_fields, pose_distance_fields
+from pathfinding import AStar
+
+##
+# Objects of a layout and optimal episode length of each goal color (vectorized over the cells and the colors)
+##
+
+def layout_objects(encoding: np.ndarray, num_colors: int=4) -> tuple:
+    # (W, H, 3) minigrid encoding of the full grid --> obstacle grid (walls, doors and keys) and position of the
+    # goal (door) and subgoal (key) of each color, same as generate_grid
+    types, colors = encoding[:, :, 0], encoding[:, :, 1]
+    obstacle_grid = np.isin(types, (2, 4, 5))
+
+    goals_pos = np.zeros((num_colors, 2))
+    subgoals_pos = np.zeros((num_colors, 2))
+    for obj_type, obj_pos in ((4, goals_pos), (5, subgoals_pos)):
+        xs, ys = np.nonzero(types.T == obj_type)[::-1]
+        obj_pos[colors[xs, ys] - 1] = np.stack((xs, ys), axis=1)
+
+    return obstacle_grid, goals_pos, subgoals_pos
+
+def optimal_lengths(obstacle_grid: np.ndarray, goals_pos: np.ndarray, subgoals_pos: np.ndarray, start_pos: tuple, start_dir: int) -> np.ndarray:
+    # Exact number of actions to pick up the subgoal (key) then open the goal (door) of each color from the start state
+    # (UNREACHABLE if the task cannot be done), all the colors in one batch of (x, y, dir) distance transforms
+    num_colors = goals_pos.shape[0]
+    goals_pos = goals_pos.astype(int)
+    subgoals_pos = subgoals_pos.astype(int)
+
+    # Obstacle grid of each color before the pickup (its key and its door are obstacles) and after (its key is free)
+    grids = np.repeat(np.asarray(obstacle_grid, dtype=bool)[None], num_colors, axis=0)
+    grids[np.arange(num_colors), subgoals_pos[:, 0], subgoals_pos[:, 1]] = True
+    grids[np.arange(num_colors), goals_pos[:, 0], goals_pos[:, 1]] = True
+    free_key_grids = grids.copy()
+    free_key_grids[np.arange(num_colors), subgoals_pos[:, 0], subgoals_pos[:, 1]] = False
+
+    # Subgoal entered with each direction (4 goals per color), then goal entered with any direction
+    # The subgoal is an obstacle, so it is only entered by moving forward from the cell in front of it
+    subgoals = [tuple(subgoals_pos[color]) + (dir,) for color in range(num_colors) for dir in range(4)]
+    subgoal_dist = pose_distance_fields(np.repeat(grids, 4, axis=0), subgoals).reshape(num_colors, 4, 4, *grids.shape[1:])
+    goal_dist = pose_distance_fields(free_key_grids, goals_pos)
+
+    # [color, dir]: start --> subgoal entered with dir --> goal
+    # Entering the subgoal costs the same action as picking it up, but the learner stays in front of it (facing it)
+    to_subgoal = subgoal_dist[:, :, start_dir, start_pos[0], start_pos[1]].astype(int)
+    front_x = subgoals_pos[:, None, 0] - np.array(DIR_VEC)[None, :, 0]
+    front_y = subgoals_pos[:, None, 1] - np.array(DIR_VEC)[None, :, 1]
+    to_goal = goal_dist[np.arange(num_colors)[:, None], np.arange(4)[None, :], front_x, front_y].astype(int)
+    lengths = np.where((to_subgoal == UNREACHABLE) | (to_goal == UNREACHABLE), UNREACHABLE, to_subgoal + to_goal)
+    return lengths.min(axis=1)
+
+def analyse_layout(encoding: np.ndarray, start_pos: tuple, start_dir: int, num_colors: int=4) -> tuple:
+    # Obstacle grid, goals (doors), subgoals (keys) and optimal episode length of each goal color
+    obstacle_grid, goals_pos, subgoals_pos = layout_objects(encoding, num_colors)
+    lengths = optimal_lengths(obstacle_grid, goals_pos, subgoals_pos, start_pos, start_dir)
+    return obstacle_grid, goals_pos, subgoals_pos, lengths
+
+##
+# All-pairs shortest paths on a static layout (fully known env)
+##
+
+class LayoutAnalysis:
+
+    def __init__(self, obstacle_grid: np.ndarray, chunk_size: int=128) -> None:
+        # Grid with 0 if empty cell 1 if object (i.e. obstacle)
+        self.obstacle_grid = np.array(obstacle_grid == 1)
+        self.shape = self.obstacle_grid.shape
+        rows, cols = self.shape
+
+        # Index of each free cell in the distance table (-1 for obstacles)
+        self.free_cells = np.argwhere(~self.obstacle_grid)
+        self.num_free = self.free_cells.shape[0]
+        self.cell_index = np.full(self.shape, -1, dtype=np.int32)
+        self.cell_index[self.free_cells[:, 0], self.free_cells[:, 1]] = np.arange(self.num_free)
+
+        # Free neighbors of each cell (left, right, move up, move down as in get_neighbors)
+        self.offsets = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+        self.neighbors = {}
+        for i, j in self.free_cells.tolist():
+            self.neighbors[(i, j)] = [(i + di, j + dj) for di, dj in self.offsets
+                                      if 0 <= i + di < rows and 0 <= j + dj < cols and not self.obstacle_grid[i + di, j + dj]]
+
+        # (F, F) int16 table of the distances between free cells, computed by batches of BFS sources
+        self.distances = np.empty((self.num_free, self.num_free), dtype=np.int16)
+        for start in range(0, self.num_free, chunk_size):
+            sources = self.free_cells[start:start + chunk_size]
+            fields = distance_fields(self.obstacle_grid, sources)
+            self.distances[start:start + chunk_size] = fields[:, self.free_cells[:, 0], self.free_cells[:, 1]]
+
+        # A* paths already searched on the layout: (start, goal) --> path
+        self.astar = AStar(self.shape)
+        self.paths = {}
+
+    def _endpoints(self, pos: tuple) -> tuple:
+        # Table indices a path ending at pos can go through: pos itself if free, else its free neighbors
+        i, j = int(pos[0]), int(pos[1])
+        if not self.obstacle_grid[i, j]:
+            return np.array([self.cell_index[i, j]]), 0
+        rows, cols = self.shape
+        idx = [self.cell_index[i + di, j + dj] for di, dj in self.offsets
+               if 0 <= i + di < rows and 0 <= j + dj < cols and not self.obstacle_grid[i + di, j + dj]]
+        return np.array(idx, dtype=np.int32), 1
+
+    def _goal_distances(self, goal: tuple) -> np.ndarray:
+        # Distance of every free cell to the goal (column of the table)
+        goal_idx, goal_cost = self._endpoints(goal)
+        if len(goal_idx) == 0:
+            return np.full(self.num_free, UNREACHABLE, dtype=np.int16)
+        dist = self.distances[goal_idx].min(axis=0)
+        if goal_cost > 0:
+            dist = np.where(dist == UNREACHABLE, UNREACHABLE, dist + goal_cost).astype(np.int16)
+        return dist
+
+    def distance(self, start: tuple, goal: tuple) -> int:
+        # Same as distance_fields(obstacle_grid, [goal])[0][start]: the goal is a source even if it is an obstacle
+        s_x, s_y = int(start[0]), int(start[1])
+        if (s_x, s_y) == (int(goal[0]), int(goal[1])):
+            return 0
+        if self.obstacle_grid[s_x, s_y]:
+            return UNREACHABLE
+        goal_idx, goal_cost = self._endpoints(goal)
+        if len(goal_idx) == 0:
+            return UNREACHABLE
+        dist = int(self.distances[self.cell_index[s_x, s_y], goal_idx].min())
+        if dist == UNREACHABLE:
+            return UNREACHABLE
+        return dist + goal_cost
+
+    def distance_fields(self, goals: list | np.ndarray) -> np.ndarray:
+        # Same as distance_fields(obstacle_grid, goals) but read from the table
+        goals = np.asarray(goals, dtype=int).reshape(-1, 2)
+        fields = np.full((goals.shape[0],) + self.shape, UNREACHABLE, dtype=np.int16)
+        for kk, goal in enumerate(goals):
+            fields[kk, self.free_cells[:, 0], self.free_cells[:, 1]] = self._goal_distances(goal)
+            fields[kk, goal[0], goal[1]] = 0
+        return fields
+
+    def next_hop(self, pos: tuple, goal: tuple) -> tuple | None:
+        # Next position on a shortest path from pos to goal (None if unreachable or already there)
+        path = self.straight_path(pos, goal, max_length=1)
+        if path is None or len(path) == 0:
+            return None
+        return path[0][1]
+
+    def path(self, start: tuple, goal: tuple) -> list | None:
+        # Same path as A_star_algorithm on the obstacle grid with the goal cell freed (as in generate_traj),
+        # searched once per (start, goal) pair of the layout
+        start = (int(start[0]), int(start[1]))
+        goal = (int(goal[0]), int(goal[1]))
+        if (start, goal) not in self.paths:
+            grid = self.obstacle_grid.astype(float)
+            grid[goal] = 0
+            path = self.astar.search(start, goal, grid)
+            self.paths[start, goal] = None if path is None else tuple(path)
+        path = self.paths[start, goal]
+        return None if path is None else list(path)
+
+    def straight_path(self, start: tuple, goal: tuple, max_length: int | None=None) -> list | None:
+        # A shortest path read from the table in the A_star_algorithm format (list of (previous, next) positions)
+        # Same length as path but ties are broken by keeping the current heading (fewer turns), so it is not the A* path
+        start = (int(start[0]), int(start[1]))
+        goal = (int(goal[0]), int(goal[1]))
+        if start == goal:
+            return []
+        if abs(start[0] - goal[0]) + abs(start[1] - goal[1]) == 1:
+            return [(start, goal)]
+
+        goal_dist = self._goal_distances(goal).tolist()
+        cell_index = self.cell_index
+
+        successive_pos = []
+        current = start
+        if self.obstacle_grid[start]:
+            # As in A*, the start can be an obstacle (e.g. picked up key): first step to its closest free neighbor
+            start_idx, _ = self._endpoints(start)
+            if len(start_idx) == 0:
+                return None
+            dist, next_idx = min((goal_dist[idx], idx) for idx in start_idx.tolist())
+            if dist == UNREACHABLE:
+                return None
+            current = tuple(self.free_cells[next_idx].tolist())
+            successive_pos.append((start, current))
+        else:
+            dist = goal_dist[cell_index[start]]
+            if dist == UNREACHABLE:
+                return None
+
+        # Follow the neighbors one step closer to the goal, keeping the same heading when possible (fewer turns)
+        previous = successive_pos[-1][0] if successive_pos else None
+        while dist > 1 and (max_length is None or len(successive_pos) < max_length):
+            neighbor = None
+            if previous is not None:
+                straight = (2 * current[0] - previous[0], 2 * current[1] - previous[1])
+                if straight in self.neighbors[current] and goal_dist[cell_index[straight]] == dist - 1:
+                    neighbor = straight
+            if neighbor is None:
+                for neighbor in self.neighbors[current]:
+                    if goal_dist[cell_index[neighbor]] == dist - 1:
+                        break
+            successive_pos.append((current, neighbor))
+            previous, current = current, neighbor
+            dist -= 1
+        if dist == 1 and (max_length is None or len(successive_pos) < max_length):
+            successive_pos.append((current, goal))
+        return successive_pos
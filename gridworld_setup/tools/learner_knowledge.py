@@ -0,0 +1,147 @@
+from __future__ import annotations
+import numpy as np
+import hashlib
+
+from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
+from utils import METRICS, EMPTY, UNKNOWN, reveal_cells, visible_cells
+
+##
+# What an observed learner knows about the env for each receptive field hypothesis (shared by the teacher models)
+##
+
+class LearnerKnowledgeTracker:
+
+    def __init__(self,
+                 env: MultiGoalsEnv | MultiRoomsGoalsEnv,
+                 rf_values: np.ndarray=np.array([3,5,7]),
+                 add_full_obs: bool=True
+                 ) -> None:
+        self.env = env
+        self.gridsize = self.env.height
+        if add_full_obs:
+            self.rf_values = np.concatenate((rf_values, np.array([self.gridsize])))
+        else:
+            self.rf_values = rf_values
+        self.num_rf = len(self.rf_values)
+
+        # What the learner knows about each cell for each receptive field hypothesis (UNKNOWN, EMPTY, WALL, goal or subgoal)
+        self.knowledge = np.full((self.num_rf, self.gridsize, self.gridsize), UNKNOWN, dtype=np.int8)
+        # Obstacle grid of each receptive field (every cell not known to be empty), stored once for all the goal colors
+        # and its version (incremented at each change)
+        self.obstacle_grids = np.ones((self.num_rf, self.gridsize, self.gridsize), dtype=bool)
+        self.obstacle_versions = np.zeros(self.num_rf, dtype=int)
+        # Content hash of the knowledge map of each rf (None: to be computed)
+        self.knowledge_hashes = [None] * self.num_rf
+
+        self.pos = None
+        self.dir = None
+        self.step_count = -1
+        # Content of the cells seen by the learner when it differs from the grid of the env (e.g. simulated learner)
+        self.labels = None
+
+        # Teacher models notified of the newly revealed cells (on_knowledge_update)
+        self.subscribers = []
+
+    def copy(self) -> LearnerKnowledgeTracker:
+        # Independent copy with the same subscribers
+        tracker = LearnerKnowledgeTracker.__new__(LearnerKnowledgeTracker)
+        tracker.__dict__.update(self.__dict__)
+        for name in ('knowledge', 'obstacle_grids', 'obstacle_versions'):
+            setattr(tracker, name, getattr(self, name).copy())
+        tracker.labels = None if self.labels is None else self.labels.copy()
+        tracker.knowledge_hashes = list(self.knowledge_hashes)
+        tracker.subscribers = list(self.subscribers)
+        return tracker
+
+    def reset(self, rf_idx: int | None=None) -> None:
+        # Nothing known (all the receptive fields or only rf_idx) and no learner seen yet, in place
+        rows = slice(None) if rf_idx is None else rf_idx
+        self.knowledge[rows] = UNKNOWN
+        self.obstacle_grids[rows] = True
+        self.obstacle_versions[rows] = 0
+        self.invalidate_hashes(rf_idx)
+        self.pos = None
+        self.dir = None
+        self.step_count = -1
+        self.labels = None
+
+    def copy_from(self, tracker: LearnerKnowledgeTracker, rf_idx: int | None=None) -> None:
+        # Same knowledge (all the receptive fields or only rf_idx) and learner state as the tracker, in place
+        rows = slice(None) if rf_idx is None else rf_idx
+        self.knowledge[rows] = tracker.knowledge[rows]
+        self.obstacle_grids[rows] = tracker.obstacle_grids[rows]
+        self.obstacle_versions[rows] = tracker.obstacle_versions[rows]
+        if rf_idx is None:
+            self.knowledge_hashes = list(tracker.knowledge_hashes)
+        else:
+            self.knowledge_hashes[rf_idx] = tracker.knowledge_hashes[rf_idx]
+        self.pos = tracker.pos
+        self.dir = tracker.dir
+        self.step_count = tracker.step_count
+        self.labels = tracker.labels
+
+    def subscribe(self, subscriber) -> None:
+        if subscriber not in self.subscribers:
+            self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber) -> None:
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    @METRICS.timed('LearnerKnowledgeTracker.update')
+    def update(self, learner_pos: tuple, learner_dir: int, learner_step_count: int, rf_idx: int | None=None) -> np.ndarray:
+        # Learner seen at (pos, dir): reveal the cells of the view for the receptive fields still alive for a subscriber
+        # (or only rf_idx). Returns the number of newly revealed cells per receptive field
+        if learner_step_count == self.step_count:
+            # Step already processed (e.g. by another teacher sharing the tracker)
+            return np.zeros(self.num_rf, dtype=int)
+
+        self.pos = learner_pos
+        self.dir = learner_dir
+        self.step_count += 1
+        assert(self.step_count == learner_step_count)
+
+        rf_indices = np.nonzero(self.active_rfs())[0].tolist() if rf_idx is None else [rf_idx]
+        new_cells = np.zeros(self.num_rf, dtype=int)
+        if len(rf_indices) > 0:
+            new_cells[rf_indices] = reveal_cells(self.knowledge, self.rf_values, rf_indices, self.pos, self.dir, self.env, self.labels)
+
+        for rf in np.nonzero(new_cells)[0]:
+            self.knowledge_hashes[rf] = None
+            grid = self.knowledge[rf] != EMPTY
+            if np.any(grid != self.obstacle_grids[rf]):
+                self.obstacle_grids[rf] = grid
+                self.obstacle_versions[rf] += 1
+
+        for subscriber in self.subscribers:
+            subscriber.on_knowledge_update(new_cells)
+
+        return new_cells
+
+    def active_rfs(self) -> np.ndarray:
+        # Receptive fields with a hypothesis still alive for one of the subscribers (all of them without subscriber)
+        # The knowledge of the other ones is no longer updated
+        if len(self.subscribers) == 0:
+            return np.ones(self.num_rf, dtype=bool)
+        return np.any([subscriber.active_rfs() for subscriber in self.subscribers], axis=0)
+
+    def invalidate_hashes(self, rf_idx: int | None=None) -> None:
+        # To be called when the knowledge maps are written directly
+        if rf_idx is None:
+            self.knowledge_hashes = [None] * self.num_rf
+        else:
+            self.knowledge_hashes[rf_idx] = None
+
+    def knowledge_hash(self, rf_idx: int) -> bytes:
+        # Content hash of the knowledge map of the rf (computed once per change)
+        if self.knowledge_hashes[rf_idx] is None:
+            self.knowledge_hashes[rf_idx] = hashlib.blake2b(self.knowledge[rf_idx].tobytes(), digest_size=16).digest()
+        return self.knowledge_hashes[rf_idx]
+
+    def visible_cells(self, pos: tuple, dir: int, rf_idx: int) -> np.ndarray:
+        # Flat indices (x * height + y) of the cells the learner would see from (pos, dir)
+        return visible_cells(pos, dir, self.rf_values[rf_idx], self.env)
+
+    def obstacle_grid(self, rf_idx: int) -> np.ndarray:
+        # Every cell not known to be empty is an obstacle (copy)
+        return self.obstacle_grids[rf_idx].astype(float)
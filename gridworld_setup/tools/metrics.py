@@ -0,0 +1,153 @@
+import json
+import math
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+##
+# Counters, cumulative timers and histograms of the hot functions (only a flag test when disabled)
+##
+
+class MetricsRegistry:
+
+    def __init__(self, enabled: bool=False) -> None:
+        self.enabled = enabled
+        self.lock = threading.Lock()
+
+        # name --> count
+        self.counters = {}
+        # name --> [calls, total time (s), max time (s)]
+        self.timers = {}
+        # name --> [count, sum, min, max, {power of two upper bound: count}]
+        self.histograms = {}
+        # name --> function returning a dict of stats (e.g. cache hits), read at each snapshot
+        self.sources = {}
+        # pid --> last stats of the sources of a worker process (merged from its snapshots)
+        self.worker_sources = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def count(self, name: str, value: int=1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def observe(self, name: str, value: float) -> None:
+        # Add a value to the histogram (buckets with power of two upper bounds)
+        if not self.enabled:
+            return
+        bucket = 0 if value <= 0 else 2 ** math.frexp(value)[1]
+        with self.lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = [0, 0., value, value, {}]
+                self.histograms[name] = hist
+            hist[0] += 1
+            hist[1] += value
+            hist[2] = min(hist[2], value)
+            hist[3] = max(hist[3], value)
+            hist[4][bucket] = hist[4].get(bucket, 0) + 1
+
+    def timed(self, name: str):
+        # Decorator: number of calls and cumulative time of the function
+        def decorator(fun):
+            @wraps(fun)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fun(*args, **kwargs)
+                t0 = time.perf_counter()
+                try:
+                    return fun(*args, **kwargs)
+                finally:
+                    self.add_time(name, time.perf_counter() - t0)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def timer(self, name: str):
+        # Cumulative time of a block (not meant for the inner loops)
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def add_source(self, name: str, stats_fun) -> None:
+        self.sources[name] = stats_fun
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+            self.histograms = {}
+
+    def snapshot(self, reset: bool=False) -> dict:
+        with self.lock:
+            snapshot = dict(counters=dict(self.counters),
+                            timers={name: dict(calls=calls, total_s=total, mean_s=total / calls, max_s=max_s)
+                                    for name, (calls, total, max_s) in self.timers.items()},
+                            histograms={name: dict(count=count, mean=total / count, min=min_v, max=max_v,
+                                                   buckets={str(b): n for b, n in sorted(buckets.items())})
+                                        for name, (count, total, min_v, max_v, buckets) in self.histograms.items()})
+        snapshot['sources'] = {name: stats_fun() for name, stats_fun in self.sources.items()}
+        if len(self.worker_sources) > 0:
+            snapshot['worker_sources'] = {str(pid): sources for pid, sources in self.worker_sources.items()}
+        if reset:
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        # Add the snapshot of another process (e.g. a pool worker, taken with reset=True) to the metrics of this one
+        # The sources are cumulative: the last ones of each worker process are kept (snapshot['pid'])
+        if not self.enabled:
+            return
+        with self.lock:
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, timer in snapshot['timers'].items():
+                current = self.timers.setdefault(name, [0, 0., 0.])
+                current[0] += timer['calls']
+                current[1] += timer['total_s']
+                current[2] = max(current[2], timer['max_s'])
+            for name, hist in snapshot['histograms'].items():
+                current = self.histograms.setdefault(name, [0, 0., hist['min'], hist['max'], {}])
+                current[0] += hist['count']
+                current[1] += hist['mean'] * hist['count']
+                current[2] = min(current[2], hist['min'])
+                current[3] = max(current[3], hist['max'])
+                for bucket, count in hist['buckets'].items():
+                    bucket = float(bucket)
+                    bucket = int(bucket) if bucket.is_integer() else bucket
+                    current[4][bucket] = current[4].get(bucket, 0) + count
+            if 'pid' in snapshot:
+                self.worker_sources[snapshot['pid']] = snapshot['sources']
+
+    def dump(self, path: str, **extra) -> None:
+        # JSON file with the current snapshot and the extra entries (e.g. per trial snapshots)
+        data = dict(extra)
+        data['metrics'] = self.snapshot()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, default=float)
+
+METRICS = MetricsRegistry()
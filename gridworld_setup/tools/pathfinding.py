@@ -0,0 +1,99 @@
+import numpy as np
+import heapq
+
+##
+# A* engine bound to a grid shape (buffers allocated once, reused by every search)
+##
+
+class AStar:
+
+    def __init__(self, shape: tuple) -> None:
+        self.shape = tuple(shape)
+        self.rows, self.cols = self.shape
+        self.size = self.rows * self.cols
+
+        # Flat buffers indexed by i * cols + j
+        self.g_scores = np.zeros(self.size, dtype=np.int32)
+        self.parent = np.full(self.size, -1, dtype=np.int32)
+        # Generation stamps: a cell belongs to the current search iff its stamp equals self.generation
+        self.seen_stamp = np.zeros(self.size, dtype=np.int32)
+        self.closed_stamp = np.zeros(self.size, dtype=np.int32)
+        self.generation = 0
+        # Free cells of the grid of the current search (filled in place)
+        self.free = np.zeros(self.size, dtype=bool)
+
+        # Memoryviews give fast scalar access to the numpy buffers in the search loop
+        self._g = memoryview(self.g_scores)
+        self._parent = memoryview(self.parent)
+        self._seen = memoryview(self.seen_stamp)
+        self._closed = memoryview(self.closed_stamp)
+        self._free = memoryview(self.free)
+
+        # Cell coordinates of each flat index
+        self._x = [idx // self.cols for idx in range(self.size)]
+        self._y = [idx % self.cols for idx in range(self.size)]
+
+        # Precomputed neighbors (left, right, move up, move down as in get_neighbors)
+        offsets = [(-1, 0), (1, 0), (0, 1), (0, -1)]
+        self.neighbors = []
+        for idx in range(self.size):
+            i, j = self._x[idx], self._y[idx]
+            self.neighbors.append(tuple((i + di) * self.cols + (j + dj) for di, dj in offsets
+                                        if 0 <= i + di < self.rows and 0 <= j + dj < self.cols))
+
+    def _next_generation(self) -> int:
+        self.generation += 1
+        # Stamps overflow --> clear the buffers and restart the counter
+        if self.generation == np.iinfo(np.int32).max:
+            self.seen_stamp.fill(0)
+            self.closed_stamp.fill(0)
+            self.generation = 1
+        return self.generation
+
+    def search(self, start: tuple, goal: tuple, grid: np.ndarray) -> list | None:
+        # Grid with 0 if empty cell 1 if object (i.e. obstacle)
+        assert(grid.shape == self.shape)
+        np.not_equal(grid, 1, out=self.free.reshape(self.shape))
+        free = self._free
+
+        gen = self._next_generation()
+        g, parent, seen, closed = self._g, self._parent, self._seen, self._closed
+        xs, ys, neighbors = self._x, self._y, self.neighbors
+        cols = self.cols
+
+        g_x, g_y = int(goal[0]), int(goal[1])
+        goal_idx = g_x * cols + g_y
+        start_idx = int(start[0]) * cols + int(start[1])
+
+        seen[start_idx] = gen
+        g[start_idx] = 0
+        parent[start_idx] = -1
+
+        # Ties on the f-score are broken on the flat index, i.e. on the (i, j) position
+        heap = [(abs(xs[start_idx] - g_x) + abs(ys[start_idx] - g_y), start_idx)]
+        while heap:
+            _, current = heapq.heappop(heap)
+
+            if current == goal_idx:
+                # Reconstruct the sequence of actions from goal to start
+                successive_pos = []
+                while parent[current] != -1:
+                    previous = parent[current]
+                    successive_pos.append(((xs[previous], ys[previous]), (xs[current], ys[current])))
+                    current = previous
+                return successive_pos[::-1]
+
+            closed[current] = gen
+
+            g_score = g[current] + 1 # Cost of moving to the neighbor is 1
+            for neighbor in neighbors[current]:
+                if not free[neighbor] or closed[neighbor] == gen:
+                    continue
+                if seen[neighbor] != gen or g_score < g[neighbor]:
+                    seen[neighbor] = gen
+                    parent[neighbor] = current
+                    g[neighbor] = g_score
+                    heapq.heappush(heap, (g_score + abs(xs[neighbor] - g_x) + abs(ys[neighbor] - g_y), neighbor))
+
+        # If the goal is not reachable
+        return None
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+from metrics import METRICS
+
+##
+# Bounded transposition table of the learner policies (least recently used entries evicted first)
+##
+
+class PolicyTable:
+
+    def __init__(self, max_size: int=20000, name: str='PolicyTable') -> None:
+        self.max_size = max_size
+        self.name = name
+        # key --> value (most recently used last)
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key):
+        # Value of the key (None if not in the table)
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            METRICS.count(self.name + '.misses')
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        METRICS.count(self.name + '.hits')
+        return value
+
+    def put(self, key, value) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            METRICS.count(self.name + '.evictions')
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return dict(size=len(self.entries), hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    hit_rate=self.hits / total if total > 0 else 0.)
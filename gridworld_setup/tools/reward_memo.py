@@ -0,0 +1,84 @@
+import os
+import hashlib
+import sqlite3
+import numpy as np
+
+from utils import METRICS
+from demo_library import demo_hash
+
+##
+# Predicted rewards stored on disk (sqlite), shared by the processes and the runs evaluating the same tasks
+##
+
+def rng_key(rng: np.random.Generator) -> str:
+    # Content hash of the state of a random stream (same state --> same simulated learner)
+    return hashlib.blake2b(repr(rng.bit_generator.state).encode(), digest_size=16).hexdigest()
+
+class RewardMemo:
+
+    def __init__(self, path: str, timeout: float=60.) -> None:
+        self.path = path
+        self.timeout = timeout
+        # Connection of the current process (opened on first use, never pickled)
+        self.connection = None
+        self.pid = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        state = dict(self.__dict__)
+        state['connection'] = None
+        state['pid'] = None
+        return state
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # Concurrent readers with one writer
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS rewards (key TEXT PRIMARY KEY, reward REAL NOT NULL)')
+            self.connection.commit()
+            self.pid = os.getpid()
+        return self.connection
+
+    def close(self) -> None:
+        if self.connection is not None and self.pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+        self.pid = None
+
+    @staticmethod
+    def key(layout_hash: str, demo: list, goal_color: int, rf_idx: int, teacher_key: str, rng: np.random.Generator, options: dict | None=None) -> str:
+        # (layout, demo, goal, rf, teacher type and parameters, random stream of the learner, reward options)
+        content = repr((layout_hash, demo_hash(demo), int(goal_color), int(rf_idx), teacher_key, rng_key(rng), sorted((options or {}).items())))
+        return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        # key --> reward of the keys already stored
+        connection = self.connect()
+        found = {}
+        unique_keys = list(set(keys))
+        for start in range(0, len(unique_keys), 500):
+            chunk = unique_keys[start:start + 500]
+            query = 'SELECT key, reward FROM rewards WHERE key IN ({})'.format(','.join('?' * len(chunk)))
+            found.update(connection.execute(query, chunk).fetchall())
+        num_hits = sum(key in found for key in keys)
+        self.hits += num_hits
+        self.misses += len(keys) - num_hits
+        METRICS.count('RewardMemo.hits', num_hits)
+        METRICS.count('RewardMemo.misses', len(keys) - num_hits)
+        return found
+
+    def put_many(self, items: list) -> None:
+        # (key, reward) pairs (a key already stored keeps its reward)
+        connection = self.connect()
+        with connection:
+            connection.executemany('INSERT OR IGNORE INTO rewards (key, reward) VALUES (?, ?)', [(key, float(reward)) for key, reward in items])
+
+    def __len__(self) -> int:
+        return self.connect().execute('SELECT COUNT(*) FROM rewards').fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hits / total if total > 0 else 0.)
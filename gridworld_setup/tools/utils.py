@@ -3,12 +3,20 @@ import os
 from minigrid.core.constants import DIR_TO_VEC
 from minigrid.core.actions import Actions
 from typing import Tuple, List
-import random
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
 
 from environment import MultiGoalsEnv, MultiRoomsGoalsEnv
+from pathfinding import AStar
+from distance_field import DIR_VEC, UNREACHABLE, DynamicPoseDistanceField, distance_field, distance_fields, pose_distance_fields, pose_successor_distances
+from layout import LayoutAnalysis, analyse_layout, layout_objects, optimal_lengths
+from visibility import VisibilityAtlas, opacity_grid
+from metrics import METRICS, MetricsRegistry
 
-from queue import PriorityQueue
-import heapq
+# A* engines are not shared between threads (one set of buffers per thread)
+_ASTAR_ENGINES = threading.local()
 
 def make_dirs(path):
     try:
@@ -17,15 +25,26 @@ def make_dirs(path):
         if not os.path.isdir(path):
             raise
 
-def draw(proba_dist: np.array) -> int:
+def spawn_rngs(seed: int | np.random.SeedSequence | None, num_streams: int) -> list:
+    # Independent random streams (e.g. one per trial or worker) derived from one root seed
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(num_streams)]
+
+def draw(proba_dist: np.array, rng: np.random.Generator) -> int:
+    # The random stream is always given (draws must be reproducible from the seed of the experiment)
     assert(np.isclose(proba_dist.sum(), 1.))
-    rand_num = np.random.uniform(0, 1)
+    # First index whose cumulative probability reaches the random number
     cum_prob = np.cumsum(proba_dist)
-    for idx, _ in enumerate(proba_dist):
-        if cum_prob[idx] >= rand_num:
-            selected_idx = idx
-            break
-    return selected_idx
+    selected_idx = np.searchsorted(cum_prob, rng.random(), side='left')
+    return int(min(selected_idx, len(proba_dist) - 1))
+
+def draw_batch(proba_dists: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    # Same as draw for each row of a (S, Na) array (one random number per row, in order)
+    assert(np.allclose(proba_dists.sum(axis=1), 1.))
+    cum_prob = np.cumsum(proba_dists, axis=1)
+    selected_idx = np.sum(cum_prob < rng.random(len(proba_dists))[:, None], axis=1)
+    return np.minimum(selected_idx, proba_dists.shape[1] - 1)
 
 def Shannon_entropy(proba_dist: np.array, axis: int=None) -> float | np.ndarray:
     # Compute the Shannon Entropy 
@@ -54,73 +73,184 @@ def get_neighbors(position, grid):
 
     return neighbors
 
+##
+# Shortest paths and distance maps (fronted by a content-addressed LRU cache)
+##
+
+def grid_hash(grid: np.ndarray) -> bytes:
+    # Only the obstacles (cells equal to 1) matter for the planning functions
+    obstacles = np.packbits(np.asarray(grid) == 1)
+    return hashlib.blake2b(obstacles.tobytes() + str(grid.shape).encode(), digest_size=16).digest()
+
+# Bytes of an entry besides its value and its key: the (value, nbytes) pair, the nbytes int and the slot of the OrderedDict
+# (about 250 measured with tracemalloc on a cache with evictions)
+ENTRY_NBYTES = 280
+
+def key_nbytes(key: tuple) -> int:
+    # Tuple and digest (the coordinates are small ints shared by the interpreter)
+    return sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key if isinstance(part, bytes))
+
+def path_nbytes(path: tuple) -> int:
+    # Tuple of (x, y) tuples of small ints
+    return sys.getsizeof(path) + sum(sys.getsizeof(pos) for pos in path)
+
+def cache_array(field: np.ndarray) -> tuple:
+    # Read-only copy owning its data (a view would keep its whole batch alive after the eviction) and its size with the header
+    field = np.array(field)
+    field.flags.writeable = False
+    return field, sys.getsizeof(field)
+
+class PlanningCache:
+    # LRU cache of the planning results under a byte budget: nbytes of an entry is the size of its value, the key and
+    # the entry itself are added (ENTRY_NBYTES), the budget holds as long as there are at least 2 entries
+
+    def __init__(self, max_bytes: int=64 * 2**20) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        # Shared by all the threads of the worker process
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, nbytes: int) -> None:
+        nbytes += ENTRY_NBYTES + key_nbytes(key)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            # Evict least recently used entries until under budget
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, old_nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= old_nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            num_requests = self.hits + self.misses
+            return dict(hits=self.hits,
+                        misses=self.misses,
+                        hit_rate=self.hits / num_requests if num_requests > 0 else 0.,
+                        evictions=self.evictions,
+                        entries=len(self.entries),
+                        nbytes=self.nbytes)
+
+PLANNING_CACHE = PlanningCache()
+METRICS.add_source('planning_cache', PLANNING_CACHE.stats)
+
+# Marks an unreachable goal in the cache (A* returned None)
+_NO_PATH = object()
+
+def get_astar(shape: tuple) -> AStar:
+    # One A* engine per grid shape (its buffers are reused by every search)
+    if not hasattr(_ASTAR_ENGINES, 'engines'):
+        _ASTAR_ENGINES.engines = {}
+    engine = _ASTAR_ENGINES.engines.get(shape)
+    if engine is None:
+        engine = AStar(shape)
+        _ASTAR_ENGINES.engines[shape] = engine
+    return engine
+
+@METRICS.timed('A_star_algorithm')
 def A_star_algorithm(start: tuple, goal: tuple, grid: np.ndarray) -> list | None:
-
     # Grid with 0 if empty cell 1 if object (i.e. obstacle)
-    rows, cols = grid.shape
-    visited = np.zeros((rows, cols), dtype=bool)
-    
-    parent = {}
-    g_scores = np.inf * np.ones((rows, cols))
-    g_scores[start] = 0
-    f_scores = np.inf * np.ones((rows, cols))
-    f_scores[start] = Manhattan_dist(start, goal)
-
-    queue = PriorityQueue()
-    queue.put((f_scores[start], start))
-
-    while not queue.empty():
-        _, current = queue.get()
-
-        if current == goal:
-            # Reconstruct the sequence of actions from goal to start
-            successive_pos = []
-            while current in parent:
-                previous = parent[current]
-                successive_pos.append((previous, current))
-                current = previous
-            return successive_pos[::-1]
-
-        visited[current] = True
-
-        for neighbor in get_neighbors(current, grid):
-            if visited[neighbor]:
-                continue
-
-            g_score = g_scores[current] + 1  # Cost of moving to the neighbor is 1
-            if g_score < g_scores[neighbor]:
-                parent[neighbor] = current
-                g_scores[neighbor] = g_score
-                f_scores[neighbor] = g_score + Manhattan_dist(neighbor, goal)
-                queue.put((f_scores[neighbor], neighbor))
-
-    # If the goal is not reachable
-    return None
-
+    s_x, s_y = np.asarray(start, dtype=int).reshape(2)
+    g_x, g_y = np.asarray(goal, dtype=int).reshape(2)
+    key = ('astar', grid_hash(grid), s_x, s_y, g_x, g_y)
+
+    path = PLANNING_CACHE.get(key)
+    if path is None:
+        path = get_astar(grid.shape).search((s_x, s_y), (g_x, g_y), grid)
+        path = _NO_PATH if path is None else tuple(path)
+        PLANNING_CACHE.put(key, path, nbytes=0 if path is _NO_PATH else path_nbytes(path))
+
+    if path is _NO_PATH:
+        return None
+    return list(path)
+
+@METRICS.timed('cached_distance_fields')
+def cached_distance_fields(grid: np.ndarray, goals: list | np.ndarray) -> np.ndarray:
+    # Same as distance_fields: (K, H, W) int16 distance to each goal, only the missing goals are computed
+    goals = np.asarray(goals, dtype=int).reshape(-1, 2)
+    g_hash = grid_hash(grid)
+    keys = [('distance', g_hash, g_x, g_y) for g_x, g_y in goals.tolist()]
+
+    fields = [PLANNING_CACHE.get(key) for key in keys]
+    missing = [kk for kk, field in enumerate(fields) if field is None]
+    if len(missing) > 0:
+        new_fields = distance_fields(grid, goals[missing])
+        for kk, field in zip(missing, new_fields):
+            field, nbytes = cache_array(field)
+            PLANNING_CACHE.put(keys[kk], field, nbytes=nbytes)
+            fields[kk] = field
+
+    return np.stack(fields)
+
+@METRICS.timed('cached_pose_distance_fields')
+def cached_pose_distance_fields(grid: np.ndarray, goals: list | np.ndarray) -> np.ndarray:
+    # Same as pose_distance_fields: (K, 4, H, W) int16 number of actions to each goal (x, y) or (x, y, dir)
+    goals = np.asarray(goals, dtype=int)
+    goals = [tuple(goal) for goal in goals.reshape(goals.shape[0], -1).tolist()]
+    g_hash = grid_hash(grid)
+    keys = [('pose', g_hash) + goal for goal in goals]
+
+    fields = [PLANNING_CACHE.get(key) for key in keys]
+    missing = [kk for kk, field in enumerate(fields) if field is None]
+    # Goals with and without direction cannot be batched in the same array
+    for goal_len in set(len(goals[kk]) for kk in missing):
+        batch = [kk for kk in missing if len(goals[kk]) == goal_len]
+        new_fields = pose_distance_fields(grid, [goals[kk] for kk in batch])
+        for kk, field in zip(batch, new_fields):
+            field, nbytes = cache_array(field)
+            PLANNING_CACHE.put(keys[kk], field, nbytes=nbytes)
+            fields[kk] = field
+
+    return np.stack(fields)
+
+@METRICS.timed('cached_target_pose_distance_fields')
+def cached_target_pose_distance_fields(grid: np.ndarray, targets: list | np.ndarray) -> np.ndarray:
+    # Same as cached_pose_distance_fields on the grid with the target cell freed, for each of the K (x, y) targets
+    # (same cache entries) and the missing fields computed in one multi-target batch: (K, 4, H, W) int16
+    targets = [tuple(target) for target in np.asarray(targets, dtype=int).reshape(-1, 2).tolist()]
+    grids = np.repeat(np.asarray(grid)[None], len(targets), axis=0)
+    for kk, (x, y) in enumerate(targets):
+        grids[kk, x, y] = 0
+    keys = [('pose', grid_hash(grids[kk])) + target for kk, target in enumerate(targets)]
+
+    fields = [PLANNING_CACHE.get(key) for key in keys]
+    missing = [kk for kk, field in enumerate(fields) if field is None]
+    if len(missing) > 0:
+        new_fields = pose_distance_fields(grids[missing], [targets[kk] for kk in missing])
+        for kk, field in zip(missing, new_fields):
+            field, nbytes = cache_array(field)
+            PLANNING_CACHE.put(keys[kk], field, nbytes=nbytes)
+            fields[kk] = field
+
+    return np.stack(fields)
+
+@METRICS.timed('Dijkstra')
 def Dijkstra(grid: np.ndarray, g_x: int, g_y: int) -> np.ndarray:
-    rows, cols = grid.shape
-
-    distance = np.full_like(grid, np.inf)
-    distance[g_x, g_y] = 0
-
-    heap = [(0, g_x, g_y)]
-
-    while heap:
-        dist, x, y = heapq.heappop(heap)
-
-        if dist > distance[x, y]:
-            continue
-
-        # Check neighbors
-        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
-            nx, ny = x + dx, y + dy
-
-            if 0 <= nx < rows and 0 <= ny < cols and grid[nx, ny] != 1:
-                cost = dist + 1  # Assuming each cell has a cost of 1
-                if cost < distance[nx, ny]:
-                    distance[nx, ny] = cost
-                    heapq.heappush(heap, (cost, nx, ny))
-
+    # Unit-cost distance to (g_x, g_y) as float with np.inf for unreachable cells
+    distance = cached_distance_fields(grid, [(g_x, g_y)])[0].astype(float)
+    distance[distance == UNREACHABLE] = np.inf
     return distance
 
 def map_actions(learner_pos: tuple, pos_dest: tuple, learner_dir: int) -> list:
@@ -211,43 +341,84 @@ def get_view(agent_pos: tuple, agent_dir: int, receptive_field: int) -> tuple:
 
     return (topX, topY, botX, botY)
 
-def obj_in_view(agent_pos: tuple, agent_dir: int, receptive_field: int, obj_pos: tuple, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> bool:
-    
-    topX, topY, _, _ = get_view(agent_pos, agent_dir, receptive_field)
-    
-    grid = env.grid.slice(topX, topY, receptive_field, receptive_field)
-    for _ in range(agent_dir + 1):
-        grid = grid.rotate_left()
-
-    if env.see_through_walls:
-        vis_mask = np.ones(shape=(grid.width, grid.height), dtype=bool)
-    else:
-        vis_mask = grid.process_vis(agent_pos=(receptive_field // 2, receptive_field - 1))
+##
+# Visibility atlas and encoding of the current grid of an env (rebuilt when the objects change)
+##
+
+def get_visibility_atlas(env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> VisibilityAtlas:
+    atlas = getattr(env, 'visibility_atlas', None)
+    if atlas is None:
+        atlas = VisibilityAtlas(opacity_grid(env.grid))
+        env.visibility_atlas = atlas
+    elif atlas.grid_version != env.grid_version:
+        # Only the entries seeing a door that opened/closed are dropped
+        atlas.update_opacity(opacity_grid(env.grid))
+    atlas.grid_version = env.grid_version
+    return atlas
+
+def get_world_encoding(env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> np.ndarray:
+    # (width, height, 3) minigrid encoding of the full grid
+    version, encoding = getattr(env, 'world_encoding', (None, None))
+    if version != env.grid_version:
+        encoding = env.grid.encode()
+        env.world_encoding = (env.grid_version, encoding)
+    return encoding
+
+# Content of a cell in the knowledge maps of a learner (goal of color c: 2 + 2 * c, subgoal of color c: 2 + 2 * c + 1)
+UNKNOWN = -1
+EMPTY = 0
+WALL = 1
+
+def get_world_labels(env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> np.ndarray:
+    # (width, height) int8 content of the cells of the current grid (same categories as the knowledge maps)
+    version, labels = getattr(env, 'world_labels', (None, None))
+    if version != env.grid_version:
+        encoding = get_world_encoding(env)
+        types, colors = encoding[:, :, 0], encoding[:, :, 1].astype(np.int8)
+        labels = np.full(types.shape, EMPTY, dtype=np.int8)
+        labels[types == 2] = WALL
+        labels[types == 4] = 2 + (colors[types == 4] - 1) * 2
+        labels[types == 5] = 2 + (colors[types == 5] - 1) * 2 + 1
+        env.world_labels = (env.grid_version, labels)
+    return labels
+
+def reveal_cells(knowledge: np.ndarray, rf_values: np.ndarray, rf_indices: list, pos: tuple, dir: int, env: MultiGoalsEnv | MultiRoomsGoalsEnv,
+                 labels: np.ndarray | None=None) -> np.ndarray:
+    # Write the content of the cells seen from (pos, dir) in the (num_rf, H, W) knowledge maps of the given receptive fields
+    # (content of the current grid of the env, or given labels with the same opacity)
+    # Returns the number of cells that were unknown (or changed) in each of these maps
+    labels = (get_world_labels(env) if labels is None else labels).reshape(-1)
+    knowledge_flat = knowledge.reshape(knowledge.shape[0], -1)
+
+    cells = [visible_cells(pos, dir, rf_values[rf_idx], env) for rf_idx in rf_indices]
+    rf_ids = np.repeat(np.arange(len(cells)), [len(c) for c in cells])
+    cells = np.concatenate(cells)
+    rows = np.asarray(rf_indices, dtype=int)[rf_ids]
+
+    seen = labels[cells]
+    # The learner stands on an empty cell
+    seen[cells == pos[0] * knowledge.shape[2] + pos[1]] = EMPTY
+    new = knowledge_flat[rows, cells] != seen
+    knowledge_flat[rows, cells] = seen
+
+    return np.bincount(rf_ids[new], minlength=len(rf_indices))
+
+def known_labels(knowledge: np.ndarray, num_labels: int) -> np.ndarray:
+    # (num_rf, num_labels) True if the label is somewhere in the knowledge map of the rf (one bincount for all the rf)
+    num_rf = knowledge.shape[0]
+    offsets = (np.arange(num_rf) * (num_labels + 1))[:, None]
+    counts = np.bincount((knowledge.reshape(num_rf, -1) + 1 + offsets).ravel(), minlength=num_rf * (num_labels + 1))
+    return counts.reshape(num_rf, num_labels + 1)[:, 1:] > 0
+
+def visible_cells(pos: tuple, dir: int, receptive_field: int, env: MultiGoalsEnv | MultiRoomsGoalsEnv, see_through: bool | None=None) -> np.ndarray:
+    # Flat indices (x * height + y) of the world cells in the view (see_through defaults to the env setting)
+    see_through = env.see_through_walls if see_through is None else see_through
+    return get_visibility_atlas(env).visible_cells(pos, dir, receptive_field, see_through)
 
-    f_vec = DIR_TO_VEC[agent_dir]
-    dir_vec = DIR_TO_VEC[agent_dir]
-    dx, dy = dir_vec
-    r_vec =  np.array((-dy, dx))
-    top_left = (
-        agent_pos
-        + f_vec * (receptive_field - 1)
-        - r_vec * (receptive_field // 2)
-    )
-
-    # For each cell in the visibility mask
-    for vis_j in range(0, receptive_field):
-        for vis_i in range(0, receptive_field):
-            
-            if not vis_mask[vis_i, vis_j]:
-                continue
-
-            # Compute the world coordinates of this cell
-            abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-            if (abs_i, abs_j) == obj_pos:
-                return True
-
-    return False
+def obj_in_view(agent_pos: tuple, agent_dir: int, receptive_field: int, obj_pos: tuple, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> bool:
+    return get_visibility_atlas(env).is_visible(agent_pos, agent_dir, receptive_field, obj_pos, env.see_through_walls)
 
+@METRICS.timed('compute_learner_obs')
 def compute_learner_obs(pos: tuple, dir: int, receptive_field: int, env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> np.ndarray:
     
     topX, topY, _, _ = get_view(pos, dir, receptive_field)
@@ -266,15 +437,188 @@ def compute_learner_obs(pos: tuple, dir: int, receptive_field: int, env: MultiGo
     return obs, vis_mask
 
 
+##
+# Compact description of the layout of an env (e.g. to rebuild a private copy of the env in a worker process)
+##
+
+def layout_description(env: MultiGoalsEnv | MultiRoomsGoalsEnv) -> dict:
+    # Constructor parameters and object positions: reset_grid rebuilds the grid from them
+    description = dict(env_type=type(env),
+                       size=env.height,
+                       agent_goal=int(env.agent_goal),
+                       agent_view_size=int(env.agent_view_size),
+                       agent_start_pos=tuple(int(v) for v in env.agent_start_pos),
+                       agent_start_dir=int(env.agent_start_dir),
+                       num_colors=env.num_doors,
+                       max_steps=env.max_steps,
+                       obj_idx=[tuple(int(v) for v in pos) for pos in env.obj_idx])
+    if isinstance(env, MultiRoomsGoalsEnv):
+        description['num_rooms'] = env.num_rooms
+        description['wall_idx'] = [tuple(int(v) for v in pos) for pos in env.wall_idx]
+    return description
+
+def layout_key(description: dict) -> str:
+    # Content hash of a layout description
+    content = repr(sorted((name, value.__name__ if name == 'env_type' else value) for name, value in description.items()))
+    return hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+
+def env_from_layout(description: dict) -> MultiGoalsEnv | MultiRoomsGoalsEnv:
+    # New env with the same layout (the objects placed by the first reset are replaced)
+    kwargs = dict(description)
+    env_type = kwargs.pop('env_type')
+    obj_idx = kwargs.pop('obj_idx')
+    wall_idx = kwargs.pop('wall_idx', None)
+
+    env = env_type(rng=np.random.default_rng(0), **kwargs)
+    env.reset()
+    env.obj_idx = list(obj_idx)
+    if wall_idx is not None:
+        env.wall_idx = list(wall_idx)
+    env.reset_grid()
+    return env
+
+
+##
+# Demonstration synthesis on the initial layout of an env (the env is never stepped nor reset)
+##
+
+# Visibility atlases of the static layouts, shared by the demos synthesized on them
+_LAYOUT_ATLASES = OrderedDict()
+_LAYOUT_ATLASES_LOCK = threading.Lock()
+
+def initial_layout(env: MultiGoalsEnv | MultiRoomsGoalsEnv, num_colors: int=4) -> tuple:
+    # Read-only obstacle grid, opacity, goals (doors) and subgoals (keys) of the env with the keys in place and the doors locked
+    # Same obstacle grid and positions as generate_grid after reset_grid, read from the walls and env.obj_idx
+    walls = np.array([obj is not None and obj.type == 'wall' for obj in env.grid.grid], dtype=bool).reshape(env.height, env.width).T
+
+    goals_pos = np.zeros((num_colors, 2))
+    subgoals_pos = np.zeros((num_colors, 2))
+    for ii in range(min(num_colors, env.num_doors)):
+        goals_pos[ii, :] = env.obj_idx[1 + 2 * ii]
+        subgoals_pos[ii, :] = env.obj_idx[1 + 2 * ii + 1]
+    doors = np.array(env.obj_idx[1::2], dtype=int).reshape(-1, 2)
+    keys = np.array(env.obj_idx[2::2], dtype=int).reshape(-1, 2)
+
+    obstacle_grid = walls.copy()
+    obstacle_grid[doors[:, 0], doors[:, 1]] = True
+    obstacle_grid[keys[:, 0], keys[:, 1]] = True
+    # Keys do not block the view
+    opacity = walls.copy()
+    opacity[doors[:, 0], doors[:, 1]] = True
+
+    for layout_array in (obstacle_grid, opacity, goals_pos, subgoals_pos):
+        layout_array.setflags(write=False)
+    return obstacle_grid, opacity, goals_pos, subgoals_pos
+
+def get_layout_atlas(opacity: np.ndarray, max_layouts: int=16) -> VisibilityAtlas:
+    key = grid_hash(opacity)
+    with _LAYOUT_ATLASES_LOCK:
+        atlas = _LAYOUT_ATLASES.get(key)
+        if atlas is None:
+            atlas = VisibilityAtlas(opacity)
+            _LAYOUT_ATLASES[key] = atlas
+            if len(_LAYOUT_ATLASES) > max_layouts:
+                _LAYOUT_ATLASES.popitem(last=False)
+        else:
+            _LAYOUT_ATLASES.move_to_end(key)
+    return atlas
+
+def step_pose(obstacle_grid: np.ndarray, pos: tuple, dir: int, action: int) -> tuple:
+    # Kinematics of the agent: turn left, turn right or move forward if the front cell is free (other actions do not move)
+    if action == 0:
+        return pos, (dir - 1) % 4
+    if action == 1:
+        return pos, (dir + 1) % 4
+    if action == 2:
+        next_x, next_y = pos[0] + DIR_VEC[dir][0], pos[1] + DIR_VEC[dir][1]
+        if 0 <= next_x < obstacle_grid.shape[0] and 0 <= next_y < obstacle_grid.shape[1] and not obstacle_grid[next_x, next_y]:
+            return (next_x, next_y), dir
+    return pos, dir
+
+def synthesize_traj(obstacle_grid: np.ndarray,
+                    atlas: VisibilityAtlas,
+                    state: tuple,
+                    dest_pos: tuple,
+                    rf: int,
+                    see_through: bool,
+                    layout: LayoutAnalysis | None=None) -> tuple:
+    # Same actions as generate_traj from the (pos, dir) state, returns the actions and the final (pos, dir) state
+    # (see_through: see_through_walls setting of the env with a view of size rf)
+    pos, dir = (int(state[0][0]), int(state[0][1])), int(state[1])
+    dest_pos = (int(dest_pos[0]), int(dest_pos[1]))
+
+    if layout is not None:
+        path = layout.path(pos, dest_pos)
+    else:
+        grid = obstacle_grid.copy()
+        grid[dest_pos[0], dest_pos[1]] = 0
+        path = A_star_algorithm(pos, dest_pos, grid)
+
+    traj = []
+    ii = 0
+    while not atlas.is_visible(pos, dir, rf, dest_pos, see_through):
+        # Unreachable object: it cannot be shown
+        if path is None:
+            raise ValueError(f'No path to the object at {dest_pos}')
+        transition = path[ii]
+        for a in map_actions(pos, transition[1], dir):
+            pos, dir = step_pose(obstacle_grid, pos, dir, a)
+            traj.append(a)
+            if atlas.is_visible(pos, dir, rf, dest_pos, see_through):
+                break
+        ii += 1
+    return traj, (pos, dir)
+
+def synthesize_visit(obstacle_grid: np.ndarray,
+                     atlas: VisibilityAtlas,
+                     state: tuple,
+                     objects: list,
+                     rf: int,
+                     see_through: bool,
+                     objects_dist: np.ndarray | None=None,
+                     layout: LayoutAnalysis | None=None) -> list:
+    # Go to the closest object not visited yet until all the objects have been in view
+    # Closest by path (distance maps of the objects, read at (x, x) as in generate_demo) or by Manhattan distance
+    gridsize = obstacle_grid.shape[0]
+    objects = [(int(obj[0]), int(obj[1])) for obj in objects]
+
+    is_obj_visited = np.zeros(len(objects), dtype=bool)
+    traj = []
+    while not np.all(is_obj_visited):
+        pos = state[0]
+        max_dist = gridsize ** 2
+        # Objects not reachable from the current position are visited in the given order
+        goal_idx = np.argmin(is_obj_visited)
+        for kk, obj in enumerate(objects):
+            if not is_obj_visited[kk]:
+                if objects_dist is not None:
+                    dist = objects_dist[kk, pos[0], pos[0]]
+                else:
+                    dist = Manhattan_dist(pos, obj)
+                if dist < max_dist:
+                    goal_idx = kk
+                    max_dist = dist
+
+        is_obj_visited[goal_idx] = True
+        actions, state = synthesize_traj(obstacle_grid, atlas, state, objects[goal_idx], rf, see_through, layout)
+        traj += actions
+
+    return traj
+
 def generate_traj(env: MultiGoalsEnv | MultiRoomsGoalsEnv,
                   dest_pos: tuple,
                   rf: int,
-                  grid: np.ndarray) -> list:
+                  grid: np.ndarray,
+                  layout: LayoutAnalysis | None=None) -> list:
     
-    obstacle_grid = grid.copy()
+    if layout is not None:
+        # A* path memoized by the layout (same path as below)
+        path = layout.path(env.agent_pos, dest_pos)
+    else:
+        obstacle_grid = grid.copy()
 
-    obstacle_grid[dest_pos[0], dest_pos[1]] = 0
-    path = A_star_algorithm(env.agent_pos, dest_pos, obstacle_grid)
+        obstacle_grid[dest_pos[0], dest_pos[1]] = 0
+        path = A_star_algorithm(env.agent_pos, dest_pos, obstacle_grid)
     
     traj = []
     ii = 0
@@ -290,245 +634,109 @@ def generate_traj(env: MultiGoalsEnv | MultiRoomsGoalsEnv,
     return traj
 
 def generate_grid(env: MultiGoalsEnv | MultiRoomsGoalsEnv, num_colors: int=4) -> tuple:
-
-    gridsize = env.height
-    env_image = np.ones((gridsize, gridsize))
-    obs = env.grid.encode(np.ones((gridsize, gridsize)))
-
-    subgoals_pos = np.zeros((num_colors, 2))
-    goals_pos = np.zeros((num_colors, 2))
-    
-    for abs_j in range(0, gridsize):
-        for abs_i in range(0, gridsize):
-            color_idx = obs[abs_i, abs_j, 1]
-
-            # Goal
-            if obs[abs_i, abs_j, 0] == 4:
-                value = 3
-                goals_pos[color_idx - 1, :] = (abs_i, abs_j)
-            # Subgoal (key)
-            elif obs[abs_i, abs_j, 0] == 5:
-                value = 2
-                subgoals_pos[color_idx - 1, :] = (abs_i, abs_j)
-            # Wall
-            elif obs[abs_i, abs_j, 0] in [2, 5, 4]:
-                value = 1
-            # Nothing
-            else:
-                value= 0
-
-            env_image[abs_i, abs_j] = value
-    obstacle_grid = (env_image != 0)
-
-    return obstacle_grid, goals_pos, subgoals_pos
-
-def generate_demo(env: MultiGoalsEnv | MultiRoomsGoalsEnv, rf: int, goal_color: int):
+    # Obstacle grid, goals (doors) and subgoals (keys) of the current grid of the env
+    return layout_objects(get_world_encoding(env), num_colors)
+
+def analyse_env_layout(env: MultiGoalsEnv | MultiRoomsGoalsEnv, num_colors: int=4) -> tuple:
+    # Obstacle grid, goals (doors), subgoals (keys) and optimal episode length of each goal color
+    # of the initial layout of the env (the env is not reset)
+    obstacle_grid, _, goals_pos, subgoals_pos = initial_layout(env, num_colors)
+    lengths = optimal_lengths(obstacle_grid, goals_pos, subgoals_pos, env.agent_start_pos, env.agent_start_dir)
+    return obstacle_grid, goals_pos, subgoals_pos, lengths
+
+@METRICS.timed('generate_demo')
+def generate_demo(env: MultiGoalsEnv | MultiRoomsGoalsEnv, rf: int, goal_color: int, layout: LayoutAnalysis | None=None):
     
-    # Save current config of the env
-    prev_agent_view_size = env.agent_view_size
-    
-    gridsize = env.height
     assert(env.height == env.width)
 
-    # Teacher has full observability
-    env.agent_view_size = gridsize
-    env.reset_grid()
-    
-    # Get image of the env
-    obstacle_grid, goals, subgoals = generate_grid(env)
+    # Initial layout of the env (teacher has full observability)
+    obstacle_grid, opacity, goals, subgoals = initial_layout(env)
     goal_pos = tuple(goals[goal_color, :].astype(int))
-    subgoal_pos = tuple(subgoals[goal_color, :].astype(int).astype(int))
+    subgoal_pos = tuple(subgoals[goal_color, :].astype(int))
 
-    # Create demo
-    env.agent_view_size = rf
-    env.reset_grid()
-
-    obstacle_grid
-
-    subgoal_dist = Dijkstra(np.array(obstacle_grid, dtype='float'), subgoal_pos[0], subgoal_pos[1])[env.agent_pos[0], env.agent_pos[0]]
-    goal_dist = Dijkstra(np.array(obstacle_grid, dtype='float'), goal_pos[0], goal_pos[1])[env.agent_pos[0], env.agent_pos[0]]
-    
-    # Go first to the closest object
-    if subgoal_dist < goal_dist:
-        Goals = [subgoal_pos, goal_pos]
+    # Go first to the closest object (goal if same distance)
+    objects = [goal_pos, subgoal_pos]
+    if layout is not None:
+        objects_dist = layout.distance_fields(objects)
     else:
-        Goals = [goal_pos, subgoal_pos]
-
-    traj = []
-    for g in Goals:
-        traj += generate_traj(env, dest_pos=g, rf=rf, grid=obstacle_grid)
+        objects_dist = cached_distance_fields(obstacle_grid, objects)
 
-    # Reset the position of the agent in the env and the env config
-    env.agent_view_size = prev_agent_view_size
-    env.reset_grid()
-    
-    return traj
+    start = (env.agent_start_pos, env.agent_start_dir)
+    return synthesize_visit(obstacle_grid, get_layout_atlas(opacity), start, objects, rf, env.view_sees_through_walls(rf, env.height), objects_dist, layout)
 
-def generate_demo_all(env: MultiGoalsEnv | MultiRoomsGoalsEnv, min_rf: int=3):
+def generate_demo_all(env: MultiGoalsEnv | MultiRoomsGoalsEnv, min_rf: int=3, layout: LayoutAnalysis | None=None):
 
-    rf = min_rf
-    
-    # Save current config of the env
-    prev_agent_view_size = env.agent_view_size
-    
-    gridsize = env.height
     assert(env.height == env.width)
 
-    # Teacher has full observability
-    env.agent_view_size = gridsize
-    env.reset_grid()
-    
-    # Get image of the env
-    obstacle_grid, goals, subgoals = generate_grid(env)
-
-    # Create demo
-    env.agent_view_size = rf
-    env.reset_grid()
+    # Initial layout of the env (teacher has full observability)
+    obstacle_grid, opacity, goals, subgoals = initial_layout(env)
 
     objects = np.concatenate((goals, subgoals))
+    # Distance maps to all the objects (same obstacle grid)
+    if layout is not None:
+        objects_dist = layout.distance_fields(objects)
+    else:
+        objects_dist = cached_distance_fields(obstacle_grid, objects)
 
-    is_obj_visited = np.zeros(objects.shape[0]).astype(bool)
-
-    traj = []
-    while not np.all(is_obj_visited):
-        max_dist = gridsize ** 2
-        for kk, obj in enumerate(objects):
-            obj = tuple(obj.astype(int))
-            if not is_obj_visited[kk]:
-                start = env.agent_pos
-                dist = Dijkstra(np.array(obstacle_grid, dtype='float'), obj[0], obj[1])[start[0], start[0]]
-                if dist < max_dist:
-                    goal = obj
-                    goal_idx = kk
-                    max_dist = dist
-
-        is_obj_visited[goal_idx] = True
-        traj += generate_traj(env, dest_pos=goal, rf=rf, grid=obstacle_grid)
-
-    # Reset the position of the agent in the env and the env config
-    env.agent_view_size = prev_agent_view_size
-    env.reset_grid()
-    
-    return traj
+    start = (env.agent_start_pos, env.agent_start_dir)
+    return synthesize_visit(obstacle_grid, get_layout_atlas(opacity), start, objects, min_rf, env.view_sees_through_walls(min_rf, env.height), objects_dist, layout)
 
 def generate_random_demo(env: MultiGoalsEnv | MultiRoomsGoalsEnv, 
                          n_obj: int, 
-                         min_rf: int=3):
+                         min_rf: int=3,
+                         layout: LayoutAnalysis | None=None,
+                         rng: np.random.Generator | None=None):
 
-    rf = min_rf
-    
-    # Save current config of the env
-    prev_agent_view_size = env.agent_view_size
-    
-    gridsize = env.height
     assert(env.height == env.width)
 
-    # Teacher has full observability
-    env.agent_view_size = gridsize
-    env.reset_grid()
-    
-    # Get image of the env
-    obstacle_grid, goals, subgoals = generate_grid(env)
-
-    # Create demo
-    env.agent_view_size = rf
-    env.reset_grid()
+    # Initial layout of the env (teacher has full observability)
+    obstacle_grid, opacity, goals, subgoals = initial_layout(env)
 
     objects = np.concatenate((goals, subgoals))
     # Pick n_obj random objects to show
-    objects = objects[np.array(random.sample(list(np.arange(0, objects.shape[0])), n_obj))]
-
-    is_obj_visited = np.zeros(objects.shape[0]).astype(bool)
-
-    traj = []
-    while not np.all(is_obj_visited):
-        max_dist = gridsize ** 2
-        for kk, obj in enumerate(objects):
-            obj = tuple(obj.astype(int))
-            if not is_obj_visited[kk]:
-                start = env.agent_pos
-                dist = Manhattan_dist(start, obj)
-                if dist < max_dist:
-                    goal = obj
-                    goal_idx = kk
-                    max_dist = dist
-
-        is_obj_visited[goal_idx] = True
-        traj += generate_traj(env, dest_pos=goal, rf=rf, grid=obstacle_grid)
+    rng = np.random.default_rng() if rng is None else rng
+    objects = objects[rng.choice(objects.shape[0], size=n_obj, replace=False)]
 
-    # Reset the position of the agent in the env and the env config
-    env.agent_view_size = prev_agent_view_size
-    env.reset_grid()
-    
-    return traj
-    
-def compute_opt_length(env: MultiGoalsEnv, goal_color: int):
+    start = (env.agent_start_pos, env.agent_start_dir)
+    return synthesize_visit(obstacle_grid, get_layout_atlas(opacity), start, objects, min_rf, env.view_sees_through_walls(min_rf, env.height), layout=layout)
     
-    # Save current config of the env
-    prev_agent_view_size = env.agent_view_size
-    
-    gridsize = env.height
-    assert(env.height == env.width)
-
-    # Teacher has full observability
-    env.agent_view_size = gridsize
-    env.reset_grid()
+def compute_opt_length(env: MultiGoalsEnv, goal_color: int, layout: LayoutAnalysis | None=None, exact: bool=False):
+    # Number of actions to pick up the subgoal (key) then open the goal (door) from the start of the initial layout
+    # (the env is not reset), UNREACHABLE if the task cannot be done
+    # exact=False: actions of the A* paths to the subgoal then to the goal (first version of the dataset labels)
+    # exact=True: optimal number of actions of the env (over the (x, y, dir) states, the A* count can be lower or higher)
+    if exact:
+        _, _, _, lengths = analyse_env_layout(env)
+        return int(lengths[goal_color])
+
+    obstacle_grid, _, goals, subgoals = initial_layout(env)
+    goal_pos = tuple(goals[goal_color, :].astype(int).tolist())
+    subgoal_pos = tuple(subgoals[goal_color, :].astype(int).tolist())
+    start_pos = tuple(int(v) for v in env.agent_start_pos)
+
+    # Subgoal (key) free, goal (door) obstacle on the way to the subgoal then free on the way to the goal
+    if layout is not None:
+        paths = [layout.path(start_pos, subgoal_pos), layout.path(subgoal_pos, goal_pos)]
+    else:
+        grid = obstacle_grid.astype(float)
+        grid[subgoal_pos] = 0
+        path_subgoal = A_star_algorithm(start_pos, subgoal_pos, grid)
+        grid[goal_pos] = 0
+        paths = [path_subgoal, A_star_algorithm(subgoal_pos, goal_pos, grid)]
+    if paths[0] is None or paths[1] is None:
+        return UNREACHABLE
 
-    env_image = np.ones((gridsize, gridsize))
-    obs = env.grid.encode(np.ones((gridsize, gridsize)))
-    
-    # Get image of the env
-    for abs_j in range(0, gridsize):
-        for abs_i in range(0, gridsize):
-            color_idx = obs[abs_i, abs_j, 1]
-
-            # Goal
-            if obs[abs_i, abs_j, 0] == 4 and color_idx == goal_color + 1:
-                value = 3
-                goal_pos = (abs_i, abs_j)
-            # Subgoal (key)
-            elif obs[abs_i, abs_j, 0] == 5 and color_idx == goal_color + 1:
-                value = 2
-                subgoal_pos = (abs_i, abs_j)
-            # Wall
-            elif obs[abs_i, abs_j, 0] in [2, 5, 4]:
-                value = 1
-            # Nothing
-            else:
-                value= 0
-
-            env_image[abs_i, abs_j] = value
-
-    obstacle_grid = (env_image == 1)
-    obstacle_grid[goal_pos[0], goal_pos[1]] = 1
-    
     # Compute length of the optimal path to finish the task
     length_opt_path = 0
     agent_dir = env.agent_start_dir
-
-    path_subgoal = A_star_algorithm(env.agent_start_pos, subgoal_pos, obstacle_grid)
-    for trans in path_subgoal:
-        actions = map_actions(trans[0], trans[1], agent_dir)
-        for a in actions:
-            if a == 0:
-                agent_dir = (agent_dir - 1) % 4
-            elif a == 1:
-                agent_dir = (agent_dir + 1) % 4
-            length_opt_path += 1
-    obstacle_grid[goal_pos[0], goal_pos[1]] = 0
-    path_goal = A_star_algorithm(subgoal_pos, goal_pos, obstacle_grid)
-    for trans in path_goal:
-        actions = map_actions(trans[0], trans[1], agent_dir)
-        for a in actions:
-            if a == 0:
-                agent_dir = (agent_dir - 1) % 4
-            elif a == 1:
-                agent_dir = (agent_dir + 1) % 4
-            length_opt_path += 1
-
-    # Reset the position of the agent in the env and the env config
-    env.agent_view_size = prev_agent_view_size
-    env.reset_grid()
+    for path in paths:
+        for trans in path:
+            for a in map_actions(trans[0], trans[1], agent_dir):
+                if a == 0:
+                    agent_dir = (agent_dir - 1) % 4
+                elif a == 1:
+                    agent_dir = (agent_dir + 1) % 4
+                length_opt_path += 1
 
     return length_opt_path
 
@@ -16,6 +16,7 @@ from minigrid.core.constants import IDX_TO_COLOR, COLORS
 
 from learner import BayesianLearner
 from bayesian_ToM.bayesian_teacher import AlignedBayesianTeacher, BayesianTeacher
+from learner_knowledge import LearnerKnowledgeTracker
 from tools.utils import Shannon_entropy
 
 ##
@@ -752,9 +753,12 @@ def display_learner_play_both_teachers_infer_blind_with_uncertainty_color(learne
     ii_key = None
     images = []
 
+    # Both teachers observe the same learner (knowledge of the learner tracked once)
+    knowledge_tracker = LearnerKnowledgeTracker(learner.env, rf_values=rf_values_basic)
+
     ## Rational ToM-teacher
 
-    teacher = BayesianTeacher(env=learner.env, lambd=lambd, rf_values=rf_values_basic)
+    teacher = BayesianTeacher(env=learner.env, lambd=lambd, rf_values=rf_values_basic, knowledge_tracker=knowledge_tracker)
     goal_belief = np.sum(teacher.beliefs, axis=1)
 
     color = np.sum([goal_colors[i] * goal_belief[i] for i in range(num_colors)], axis=0)
@@ -770,7 +774,7 @@ def display_learner_play_both_teachers_infer_blind_with_uncertainty_color(learne
     
     ## Aligned ToM-teacher
 
-    aligned_teacher = AlignedBayesianTeacher(env=learner.env, rf_values=rf_values_basic)
+    aligned_teacher = AlignedBayesianTeacher(env=learner.env, rf_values=rf_values_basic, knowledge_tracker=knowledge_tracker)
     aligned_goal_belief = np.sum(aligned_teacher.beliefs, axis=1)
 
     color = np.sum([goal_colors[i] * aligned_goal_belief[i] for i in range(num_colors)], axis=0)
@@ -790,8 +794,7 @@ def display_learner_play_both_teachers_infer_blind_with_uncertainty_color(learne
         agent_pos = learner.env.agent_pos
         agent_dir = learner.env.agent_dir
 
-        teacher.update_knowledge(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
-        aligned_teacher.update_knowledge(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
+        knowledge_tracker.update(learner_pos=agent_pos, learner_dir=agent_dir, learner_step_count=ii)
 
         traj = learner.play(size=1)
 
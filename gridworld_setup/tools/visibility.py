@@ -0,0 +1,198 @@
+import numpy as np
+import threading
+from array import array
+from bisect import bisect_left
+
+from distance_field import DIR_VEC
+
+##
+# Visibility of the world cells from a (pos, dir, receptive field) view (same as minigrid process_vis)
+##
+
+def opacity_grid(grid) -> np.ndarray:
+    # (width, height) bool array indexed [x, y]: True if the object blocks the view (wall, closed door)
+    opaque = [obj is not None and not obj.see_behind() for obj in grid.grid]
+    return np.array(opaque, dtype=bool).reshape(grid.height, grid.width).T
+
+def view_cells(pos: tuple, dir: int, receptive_field: int) -> tuple:
+    # World coordinates of the cells of the view, indexed [vis_i, vis_j] as in the agent observation
+    f_x, f_y = DIR_VEC[dir]
+    r_x, r_y = -f_y, f_x
+    top_x = pos[0] + f_x * (receptive_field - 1) - r_x * (receptive_field // 2)
+    top_y = pos[1] + f_y * (receptive_field - 1) - r_y * (receptive_field // 2)
+    vis_i, vis_j = np.meshgrid(np.arange(receptive_field), np.arange(receptive_field), indexing='ij')
+    return top_x - f_x * vis_j + r_x * vis_i, top_y - f_y * vis_j + r_y * vis_i
+
+def sliced_cells(pos: tuple, dir: int, receptive_field: int) -> tuple:
+    # World coordinates of the cells of the grid slice rotated as in the agent observation (used for the propagation)
+    # Same as view_cells for odd receptive fields
+    if dir == 0:
+        top_x, top_y = pos[0], pos[1] - receptive_field // 2
+    elif dir == 1:
+        top_x, top_y = pos[0] - receptive_field // 2, pos[1]
+    elif dir == 2:
+        top_x, top_y = pos[0] - receptive_field + 1, pos[1] - receptive_field // 2
+    else:
+        top_x, top_y = pos[0] - receptive_field // 2, pos[1] - receptive_field + 1
+    slice_i, slice_j = np.meshgrid(np.arange(receptive_field), np.arange(receptive_field), indexing='ij')
+    cells_x, cells_y = top_x + slice_i, top_y + slice_j
+    # Grid.rotate_left: new[j, width - 1 - i] = old[i, j]
+    for _ in range(dir + 1):
+        cells_x, cells_y = cells_x.T[:, ::-1], cells_y.T[:, ::-1]
+    return cells_x, cells_y
+
+def process_vis(opaque: list, agent_pos: tuple) -> list:
+    # Same propagation as minigrid Grid.process_vis on a [i][j] list of opacity flags
+    width, height = len(opaque), len(opaque[0])
+    mask = [[False] * height for _ in range(width)]
+    mask[agent_pos[0]][agent_pos[1]] = True
+
+    for j in reversed(range(0, height)):
+        for i in range(0, width - 1):
+            if not mask[i][j] or opaque[i][j]:
+                continue
+            mask[i + 1][j] = True
+            if j > 0:
+                mask[i + 1][j - 1] = True
+                mask[i][j - 1] = True
+
+        for i in reversed(range(1, width)):
+            if not mask[i][j] or opaque[i][j]:
+                continue
+            mask[i - 1][j] = True
+            if j > 0:
+                mask[i - 1][j - 1] = True
+                mask[i][j - 1] = True
+
+    return mask
+
+##
+# Visible world cells per (pos, dir, receptive field) of a layout, lazily computed and stored in CSR arrays
+##
+
+class VisibilityAtlas:
+
+    def __init__(self, opacity: np.ndarray) -> None:
+        self.opacity = np.array(opacity, dtype=bool)
+        self.shape = self.opacity.shape
+
+        # Entry s holds the sorted flat indices (x * height + y) indices[indptr[s]:indptr[s + 1]]
+        # (x, y, dir, receptive field, see through walls) --> entry
+        # The three are swapped together (one attribute) so that a reader always sees a consistent snapshot
+        self.table = ({}, array('i', [0]), array('i'))
+        self.num_dead = 0
+
+        self.hits = 0
+        self.misses = 0
+        # Entries are added under the lock (an atlas can be shared by the threads synthesizing demos)
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _compute(self, opacity: np.ndarray, pos: tuple, dir: int, receptive_field: int, see_through: bool) -> list:
+        width, height = self.shape
+        cells_x, cells_y = view_cells(pos, dir, receptive_field)
+        in_grid = (cells_x >= 0) & (cells_x < width) & (cells_y >= 0) & (cells_y < height)
+
+        if see_through:
+            visible = in_grid
+        else:
+            # Cells outside of the grid are seen as walls
+            sliced_x, sliced_y = sliced_cells(pos, dir, receptive_field)
+            sliced_in_grid = (sliced_x >= 0) & (sliced_x < width) & (sliced_y >= 0) & (sliced_y < height)
+            opaque = np.ones((receptive_field, receptive_field), dtype=bool)
+            opaque[sliced_in_grid] = opacity[sliced_x[sliced_in_grid], sliced_y[sliced_in_grid]]
+            mask = process_vis(opaque.tolist(), (receptive_field // 2, receptive_field - 1))
+            visible = np.array(mask, dtype=bool) & in_grid
+
+        return sorted((cells_x[visible] * height + cells_y[visible]).tolist())
+
+    @property
+    def entries(self) -> dict:
+        return self.table[0]
+
+    def _entry(self, pos: tuple, dir: int, receptive_field: int, see_through: bool) -> tuple:
+        # (indices, start, end) of the cells visible from the view, read from one snapshot of the table
+        key = (int(pos[0]), int(pos[1]), int(dir), int(receptive_field), bool(see_through))
+        entries, indptr, indices = self.table
+        entry = entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return indices, indptr[entry], indptr[entry + 1]
+
+        while True:
+            opacity = self.opacity
+            cells = self._compute(opacity, key[:2], key[2], key[3], key[4])
+            with self.lock:
+                # Opacity replaced by update_opacity meanwhile: the cells are computed again
+                if opacity is not self.opacity:
+                    continue
+                entries, indptr, indices = self.table
+                # Already added by another thread
+                entry = entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    # Append only: the entries of the snapshots already read are left as they are
+                    indices.extend(cells)
+                    indptr.append(len(indices))
+                    entry = len(indptr) - 2
+                    entries[key] = entry
+                return indices, indptr[entry], indptr[entry + 1]
+
+    def visible_cells(self, pos: tuple, dir: int, receptive_field: int, see_through: bool=False) -> np.ndarray:
+        # Flat indices (x * height + y) of the world cells visible from (pos, dir)
+        indices, start, end = self._entry(pos, dir, receptive_field, see_through)
+        return np.array(indices[start:end], dtype=np.int64)
+
+    def is_visible(self, pos: tuple, dir: int, receptive_field: int, cell: tuple, see_through: bool=False) -> bool:
+        indices, start, end = self._entry(pos, dir, receptive_field, see_through)
+        flat = int(cell[0]) * self.shape[1] + int(cell[1])
+        idx = bisect_left(indices, flat, start, end)
+        return idx < end and indices[idx] == flat
+
+    def update_opacity(self, opacity: np.ndarray) -> None:
+        # Door opened/closed: drop the entries whose view contains a cell with a new opacity
+        # (picking up a key does not change the opacity: keys do not block the view)
+        opacity = np.asarray(opacity, dtype=bool)
+        changed = np.argwhere(opacity != self.opacity)
+        if len(changed) == 0:
+            return
+
+        with self.lock:
+            self.opacity = opacity.copy()
+            for key in list(self.entries):
+                x, y, _, receptive_field, _ = key
+                if np.any(np.maximum(np.abs(changed[:, 0] - x), np.abs(changed[:, 1] - y)) < receptive_field):
+                    del self.entries[key]
+                    self.num_dead += 1
+
+            # Compact the arrays when they hold more dropped entries than live ones
+            if self.num_dead > len(self.entries):
+                self._compact()
+
+    def _compact(self) -> None:
+        # New arrays swapped in one assignment (the readers of the previous snapshot are not affected)
+        old_entries, old_indptr, old_indices = self.table
+        entries, indptr, indices = {}, array('i', [0]), array('i')
+        for key, entry in old_entries.items():
+            indices.extend(old_indices[old_indptr[entry]:old_indptr[entry + 1]])
+            indptr.append(len(indices))
+            entries[key] = len(indptr) - 2
+        self.table = (entries, indptr, indices)
+        self.num_dead = 0
+
+    def clear(self) -> None:
+        with self.lock:
+            self.table = ({}, array('i', [0]), array('i'))
+            self.num_dead = 0
+
+    def stats(self) -> dict:
+        entries, indptr, indices = self.table
+        return dict(hits=self.hits, misses=self.misses, entries=len(entries), nbytes=indices.itemsize * (len(indices) + len(indptr)))